@@ -0,0 +1,20 @@
+import { getCollection } from "../config/mongo";
+
+// Changesets are only read by the handlers of the scrape batch right after it is written
+const createChangesetIndexes = async () => {
+  const collection = await getCollection("offerchangesets");
+  return Promise.all([
+    collection.createIndex({ scrapeBatchId: 1 }, { name: "scrapeBatchId_1" }),
+    collection.createIndex(
+      { createdAt: 1 },
+      { expireAfterSeconds: 60 * 60 * 24 * 7, name: "createdAt_1_ttl" },
+    ),
+  ]);
+};
+
+createChangesetIndexes()
+  .then((indexes) => {
+    console.log(indexes);
+    process.exit(0);
+  })
+  .catch((e) => console.error(e));
@@ -132,6 +132,7 @@ class DbHandleConfig(TypedDict):
     extractIngredientsFields: List[str]
     categoriesLimits: List[int]
     ignore_none: bool
+    parallelWorkers: int
     provenance: str
     namespace: str
     collection_name: str
@@ -153,9 +154,18 @@ class PriceHistoryRecord(TypedDict):
     price: float
 
 
+class PriceWindow(TypedDict):
+    start: str
+    firstDate: str
+    lastRecord: PriceHistoryRecord
+    prices: List[PriceHistoryRecord]
+
+
 class PriceHistoryForOffer(TypedDict):
     uri: str
     history: List[PriceHistoryRecord]
+    priceWindow: Optional[PriceWindow]
+    compactHistory: Optional[Any]
 
 
 class IngredientType(TypedDict):
@@ -2,11 +2,13 @@ import json
 import logging
 from unittest import TestCase
 from offer_feed.categories import (
+    get_category_mappings_hash,
+    get_category_update,
+    get_changed_and_stale_offers,
     get_mpn_categories_for_offer,
     get_mpn_categories_for_meny_offer,
 )
 
-
 logging.basicConfig(level=logging.DEBUG)
 
 
@@ -87,3 +89,72 @@ class TestGetCategories(TestCase):
                 {"key": "frukt_1", "parent": "frukt-gront_0"},
             ],
         )
+
+
+class FakeOffersCollection:
+    def __init__(self, offers):
+        self.offers = offers
+
+    def find(self, filter, projection=None):
+        if "uri" in filter:
+            return list(x for x in self.offers if x["uri"] in filter["uri"]["$in"])
+        return list(
+            x
+            for x in self.offers
+            if x["scrapeBatchId"] == filter["scrapeBatchId"]
+            and x.get("mpnCategoryMappingsHash")
+            != filter["mpnCategoryMappingsHash"]["$ne"]
+        )
+
+
+class TestIncrementalCategories(TestCase):
+    def setUp(self):
+        self.category_mappings = [
+            {"_id": 1, "source": ["Melk"], "target": "melk"},
+            {"_id": 2, "source": ["Ost"], "target": "ost"},
+        ]
+        self.mpn_categories = [{"_id": 3, "key": "melk", "parent": None}]
+
+    def test_mappings_hash(self):
+        mappings_hash = get_category_mappings_hash(
+            self.category_mappings, self.mpn_categories
+        )
+        self.assertEqual(
+            get_category_mappings_hash(
+                list(reversed(self.category_mappings)), self.mpn_categories
+            ),
+            mappings_hash,
+        )
+        self.category_mappings[1]["target"] = "melk"
+        self.assertNotEqual(
+            get_category_mappings_hash(self.category_mappings, self.mpn_categories),
+            mappings_hash,
+        )
+
+    def test_changed_and_stale_offers(self):
+        collection = FakeOffersCollection(
+            [
+                {"uri": "a", "scrapeBatchId": "b", "mpnCategoryMappingsHash": "h"},
+                {"uri": "b", "scrapeBatchId": "b", "mpnCategoryMappingsHash": "h"},
+                {"uri": "c", "scrapeBatchId": "b", "mpnCategoryMappingsHash": "old"},
+                {"uri": "d", "scrapeBatchId": "b"},
+            ]
+        )
+        offers = get_changed_and_stale_offers(collection, "b", ["a", "c"], "h", {})
+        self.assertEqual(list(x["uri"] for x in offers), ["c", "d", "a"])
+
+    def test_update_marks_changed_categories(self):
+        melk = [{"_id": 3, "key": "melk", "parent": None}]
+        offer = {"_id": "62d6bb7c0b5b5c4d9e8a1f00", "mpnCategories": melk}
+
+        update = get_category_update(offer, {"mpnCategories": melk}, "h")
+        self.assertEqual(
+            update._doc,
+            {"$set": {"mpnCategories": melk, "mpnCategoryMappingsHash": "h"}},
+        )
+
+        update = get_category_update(offer, {"mpnCategories": []}, "h")
+        self.assertEqual(
+            update._doc["$unset"],
+            {"contentHash": "", "contentGroupHashes.categories": ""},
+        )
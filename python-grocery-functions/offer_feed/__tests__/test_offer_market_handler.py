@@ -0,0 +1,100 @@
+from datetime import datetime
+from unittest import TestCase
+
+from offer_feed.offer_market_handler import (
+    get_market_merge_pipeline,
+    get_market_sync_plan,
+)
+
+
+def get_offer(_id, **kwargs):
+    return {
+        "_id": _id,
+        "provenance": "meny",
+        "contentHash": "hash-1",
+        "scrapeBatchId": "batch-1",
+        "validThrough": datetime(2022, 1, 11),
+        "pageviews": 2,
+        **kwargs,
+    }
+
+
+class TestGetMarketSyncPlan(TestCase):
+    def test_unchanged_offer_is_skipped(self):
+        self.assertEqual(
+            get_market_sync_plan([get_offer(1)], {1: get_offer(1)}), ([], [], 1)
+        )
+
+    def test_new_offer_is_copied(self):
+        self.assertEqual(get_market_sync_plan([get_offer(1)], {}), ([1], [], 0))
+
+    def test_changed_content_is_copied(self):
+        self.assertEqual(
+            get_market_sync_plan(
+                [get_offer(1, contentHash="hash-2")], {1: get_offer(1)}
+            ),
+            ([1], [], 0),
+        )
+
+    def test_offer_without_hash_is_copied(self):
+        self.assertEqual(
+            get_market_sync_plan(
+                [get_offer(1, contentHash=None)], {1: get_offer(1, contentHash=None)}
+            ),
+            ([1], [], 0),
+        )
+
+    def test_changed_offer_is_copied(self):
+        self.assertEqual(
+            get_market_sync_plan(
+                [get_offer(1, uri="a"), get_offer(2, uri="b")],
+                {1: get_offer(1), 2: get_offer(2)},
+                {"a"},
+            ),
+            ([1], [], 1),
+        )
+
+    def test_offer_missing_from_market_is_copied_with_changeset(self):
+        self.assertEqual(
+            get_market_sync_plan([get_offer(1, uri="a")], {}, set()), ([1], [], 0)
+        )
+
+    def test_volatile_and_derived_fields_are_copied_partially(self):
+        market_offers = {1: get_offer(1), 2: get_offer(2)}
+        self.assertEqual(
+            get_market_sync_plan(
+                [
+                    get_offer(1, validThrough=datetime(2022, 1, 12)),
+                    get_offer(2, pageviews=3),
+                ],
+                market_offers,
+            ),
+            ([], [1, 2], 0),
+        )
+
+    def test_categories_are_copied_partially(self):
+        self.assertEqual(
+            get_market_sync_plan(
+                [get_offer(1, mpnCategories=[{"key": "melk"}])],
+                {1: get_offer(1, mpnCategories=[])},
+            ),
+            ([], [1], 0),
+        )
+
+    def test_offer_without_derived_field_is_copied(self):
+        offer = get_offer(1)
+        del offer["pageviews"]
+        self.assertEqual(get_market_sync_plan([offer], {1: get_offer(1)}), ([1], [], 0))
+        self.assertEqual(get_market_sync_plan([offer], {1: offer}), ([], [], 1))
+
+
+class TestGetMarketMergePipeline(TestCase):
+    def test_full_copy_replaces(self):
+        merge = get_market_merge_pipeline({}, "no", ["title"], False)[-1]["$merge"]
+        self.assertEqual(merge["whenMatched"], "replace")
+        self.assertEqual(merge["whenNotMatched"], "insert")
+
+    def test_partial_copy_discards_new_offers(self):
+        merge = get_market_merge_pipeline({}, "no", ["title"], True)[-1]["$merge"]
+        self.assertEqual(merge["whenMatched"], "merge")
+        self.assertEqual(merge["whenNotMatched"], "discard")
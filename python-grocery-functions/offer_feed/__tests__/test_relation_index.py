@@ -0,0 +1,141 @@
+from unittest import TestCase
+
+from bson import ObjectId
+
+from offer_feed.offer_relations_handler import handle_offer_relations_chunk
+from offer_feed.relation_index import RelationIndex, get_offer_relation_gtins
+
+EAN_1 = "7038010000737"
+EAN_2 = "7038010001543"
+
+
+class FakeResult:
+    def __init__(self, bulk_api_result):
+        self.bulk_api_result = bulk_api_result
+
+
+def matches(document, filter):
+    for key, condition in filter.items():
+        if key == "$or":
+            if not any(matches(document, x) for x in condition):
+                return False
+            continue
+        value = document.get(key)
+        values = value if isinstance(value, list) else [value]
+        if isinstance(condition, dict) and "$in" in condition:
+            if not any(x in condition["$in"] for x in values):
+                return False
+        elif isinstance(condition, dict) and "$ne" in condition:
+            if value == condition["$ne"]:
+                return False
+        elif condition not in values:
+            return False
+    return True
+
+
+class FakeRelationsCollection:
+    name = "offerbirelations"
+
+    def __init__(self, relations=()):
+        self.relations = list(relations)
+        self.queries = []
+
+    def find(self, filter, projection=None):
+        self.queries.append(filter)
+        return list(dict(x) for x in self.relations if matches(x, filter))
+
+    def bulk_write(self, operations, ordered=True):
+        result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0}
+        for operation in operations:
+            relation = next(
+                (x for x in self.relations if matches(x, operation._filter)), None
+            )
+            if relation is None:
+                relation = {
+                    "_id": ObjectId(),
+                    **operation._doc.get("$setOnInsert", {}),
+                }
+                self.relations.append(relation)
+                result["nUpserted"] += 1
+                continue
+            result["nMatched"] += 1
+            relation.update(operation._doc.get("$set", {}))
+            for key, value in operation._doc.get("$addToSet", {}).items():
+                relation[key] = list(
+                    dict.fromkeys([*relation.get(key, []), *value["$each"]])
+                )
+        return FakeResult(result)
+
+
+def get_relation(uris, gtins):
+    return {
+        "_id": ObjectId(),
+        "relationType": "identical",
+        "isMerged": False,
+        "offerSet": uris,
+        "gtins": gtins,
+    }
+
+
+def get_offer(uri, ean=None):
+    return {"uri": uri, "title": uri, "gtins": {"ean": ean} if ean else {}}
+
+
+class TestRelationIndex(TestCase):
+    def test_fetches_only_new_keys(self):
+        relation = get_relation(["a"], [f"ean:{EAN_1}"])
+        collection = FakeRelationsCollection([relation])
+        index = RelationIndex(collection, {})
+        index.fetch(["a"], [f"ean:{EAN_1}"])
+        index.fetch(["a"], [f"ean:{EAN_1}"])
+        self.assertEqual(len(collection.queries), 1)
+        index.fetch(["a", "b"], [])
+        self.assertEqual(collection.queries[1]["$or"], [{"offerSet": {"$in": ["b"]}}])
+        self.assertEqual(index.get_relations(["a", f"ean:{EAN_1}"]), [relation])
+
+    def test_update_relation(self):
+        relation = get_relation(["a"], [])
+        index = RelationIndex(FakeRelationsCollection([relation]), {})
+        index.fetch(["a"], [])
+        index.update_relation(
+            relation["_id"], {"offerSet": ["a", "b"]}, {"title": "Melk"}
+        )
+        self.assertEqual(index.get_relations(["b"])[0]["offerSet"], ["a", "b"])
+        self.assertEqual(index.get_relations(["a"])[0]["title"], "Melk")
+
+    def test_offer_relation_gtins(self):
+        self.assertEqual(
+            get_offer_relation_gtins(
+                {"gtins": {"ean": EAN_1, "nobb": "12345678", "gtin8": "1234"}}
+            ),
+            [f"ean:{EAN_1}", "nobb:12345678"],
+        )
+        self.assertEqual(get_offer_relation_gtins({"gtins": {"ean": "123"}}), [])
+
+
+class TestHandleOfferRelationsChunk(TestCase):
+    def test_later_chunk_sees_created_relation(self):
+        collection = FakeRelationsCollection()
+        index = RelationIndex(collection, {})
+        handle_offer_relations_chunk([get_offer("a", EAN_1)], "no", index)
+        handle_offer_relations_chunk([get_offer("b", EAN_1)], "no", index)
+        self.assertEqual(len(collection.relations), 1)
+        self.assertEqual(collection.relations[0]["offerSet"], ["a", "b"])
+
+    def test_later_chunk_sees_merge(self):
+        relation_1 = get_relation(["a"], [f"ean:{EAN_1}"])
+        relation_2 = get_relation(["b"], [f"ean:{EAN_2}"])
+        collection = FakeRelationsCollection([relation_1, relation_2])
+        index = RelationIndex(collection, {})
+        offer = {"uri": "c", "title": "c", "gtins": {"ean": EAN_1, "gtin13": EAN_2}}
+        handle_offer_relations_chunk([offer], "no", index)
+        self.assertEqual(relation_1["offerSet"], ["a", "b", "c"])
+        self.assertTrue(relation_2["isMerged"])
+        self.assertEqual(relation_2["mergedTo"], relation_1["_id"])
+
+        # The gtin was fetched in the first chunk, and the merged relation is gone
+        handle_offer_relations_chunk([get_offer("d", EAN_2)], "no", index)
+        self.assertEqual(collection.queries[1]["$or"], [{"offerSet": {"$in": ["d"]}}])
+        self.assertEqual(relation_1["offerSet"], ["a", "b", "c", "d"])
+        self.assertEqual(relation_2["offerSet"], ["b"])
+        self.assertEqual(len(collection.relations), 2)
@@ -0,0 +1,177 @@
+import copy
+import random
+from datetime import datetime
+from unittest import TestCase
+
+from pymongo import UpdateOne
+
+from offer_feed.__tests__.test_relation_index import (
+    EAN_1,
+    EAN_2,
+    FakeRelationsCollection,
+    get_offer,
+    get_relation,
+)
+from offer_feed.offer_relations_handler import (
+    get_relation_info,
+    plan_relation_merges,
+)
+from offer_feed.relation_index import RelationIndex, get_offer_relation_gtins
+
+"""
+Compares plan_relation_merges with planning the merges offer by offer, which is how
+it was done before the merges were planned for the whole chunk.
+"""
+
+
+def get_plan(offers, relations):
+    index = RelationIndex(FakeRelationsCollection(relations), {})
+    offers_gtins = list(get_offer_relation_gtins(x) for x in offers)
+    index.fetch((x["uri"] for x in offers), (y for x in offers_gtins for y in x))
+    return plan_relation_merges(offers, offers_gtins, index, "no", datetime.now())
+
+
+def get_operations_offer_by_offer(offers, index):
+    """
+    The operations of the per offer planner, without the fields of the relations.
+    """
+    merge_operations = []
+    operations = []
+    for offer in offers:
+        offer_gtins = get_offer_relation_gtins(offer)
+        rels = index.get_relations([offer["uri"], *offer_gtins])
+        if rels:
+            rel_to_use = sorted(
+                rels,
+                key=lambda x: (len(x["offerSet"]), offer["uri"] not in x["offerSet"]),
+                reverse=True,
+            )[0]
+            other_rels = list(x for x in rels if x["_id"] != rel_to_use["_id"])
+            rel_info = get_relation_info(offer, rels, market="no")
+            other_uris = list(uri for x in other_rels for uri in x["offerSet"])
+            operations.append(
+                UpdateOne(
+                    {"_id": rel_to_use["_id"]},
+                    {
+                        "$addToSet": {
+                            "gtins": {"$each": offer_gtins},
+                            "offerSet": {"$each": [*other_uris, offer["uri"]]},
+                        },
+                        "$set": {"m:no": rel_info["rel"]},
+                    },
+                )
+            )
+            for rel in other_rels:
+                merge_operations.append(
+                    UpdateOne(
+                        {"_id": rel["_id"]},
+                        {"$set": {"mergedTo": rel_to_use["_id"], "isMerged": True}},
+                    )
+                )
+        else:
+            operations.append(
+                UpdateOne(
+                    {"relationType": "identical", "offerSet": offer["uri"]},
+                    {
+                        "$setOnInsert": {
+                            "relationType": "identical",
+                            "offerSet": [offer["uri"]],
+                            "gtins": offer_gtins,
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+    return merge_operations, operations
+
+
+def get_random_chunk(n_offers, n_gtins, n_relations):
+    random.seed(1)
+    nobbs = list(str(10000000 + i) for i in range(n_gtins))
+    offers = list(
+        {"uri": f"byggmax:product:{i}", "title": str(i), "gtins": {"nobb": x}}
+        for i, x in enumerate(random.choices(nobbs, k=n_offers))
+    )
+    # Relations with two gtins connect the offers of both
+    relations = list(
+        get_relation(
+            [f"monter:product:{i}"],
+            list(f"nobb:{x}" for x in random.sample(nobbs, random.randint(1, 2))),
+        )
+        for i in range(n_relations)
+    )
+    return offers, relations
+
+
+def get_relations_by_uri(collection):
+    result = {}
+    for relation in collection.relations:
+        if not relation.get("isMerged"):
+            for uri in relation["offerSet"]:
+                result.setdefault(uri, []).append(relation["_id"])
+    return result
+
+
+def write(operations, relations):
+    collection = FakeRelationsCollection(copy.deepcopy(relations))
+    for x in operations:
+        collection.bulk_write(x)
+    return collection
+
+
+class TestPlanRelationMerges(TestCase):
+    def test_offers_with_new_gtin_are_one_relation(self):
+        plan = get_plan([get_offer("a", EAN_1), get_offer("b", EAN_1)], [])
+        self.assertEqual(len(plan.operations), 1)
+        self.assertEqual(
+            plan.operations[0]._doc["$setOnInsert"]["offerSet"], ["a", "b"]
+        )
+        self.assertEqual(plan.new_relation_keys, ["a", "b", f"ean:{EAN_1}"])
+
+    def test_one_update_per_kept_relation(self):
+        relation_1 = get_relation(["x", "y"], [f"ean:{EAN_1}"])
+        relation_2 = get_relation(["z"], [f"ean:{EAN_2}"])
+        offers = [
+            get_offer("a", EAN_1),
+            {"uri": "b", "title": "b", "gtins": {"ean": EAN_1, "gtin13": EAN_2}},
+            get_offer("c", EAN_2),
+        ]
+        plan = get_plan(offers, [relation_1, relation_2])
+        self.assertEqual(len(plan.operations), 1)
+        self.assertEqual(plan.operations[0]._filter, {"_id": relation_1["_id"]})
+        self.assertEqual(
+            plan.operations[0]._doc["$addToSet"]["offerSet"]["$each"],
+            ["z", "a", "b", "c"],
+        )
+        self.assertEqual(plan.merged_relation_ids, [relation_2["_id"]])
+        merge_fields = plan.merge_operations[0]._doc["$set"]
+        self.assertEqual(merge_fields["mergedTo"], relation_1["_id"])
+        self.assertIn("offerSetMeta.b.auto", merge_fields)
+        self.assertIn("offerSetMeta.c.auto", merge_fields)
+
+    def test_separate_components(self):
+        relation = get_relation(["x"], [f"ean:{EAN_1}"])
+        plan = get_plan([get_offer("a", EAN_1), get_offer("b", EAN_2)], [relation])
+        self.assertEqual(len(plan.operations), 2)
+        self.assertEqual(plan.merge_operations, [])
+
+    def test_fewer_operations_than_offer_by_offer(self):
+        offers, relations = get_random_chunk(1000, 300, 400)
+        index = RelationIndex(FakeRelationsCollection(copy.deepcopy(relations)), {})
+        index.fetch(
+            (x["uri"] for x in offers),
+            (y for x in offers for y in get_offer_relation_gtins(x)),
+        )
+        by_offer = get_operations_offer_by_offer(offers, index)
+        plan = get_plan(offers, copy.deepcopy(relations))
+        self.assertLess(
+            len(plan.merge_operations) + len(plan.operations),
+            sum(len(x) for x in by_offer),
+        )
+
+        # Every offer ends up in exactly one relation that is not merged
+        plan_relations = get_relations_by_uri(
+            write([plan.merge_operations, plan.operations], relations)
+        )
+        for offer in offers:
+            self.assertEqual(len(plan_relations[offer["uri"]]), 1)
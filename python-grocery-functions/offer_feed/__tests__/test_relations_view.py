@@ -0,0 +1,124 @@
+from datetime import datetime
+from unittest import TestCase
+
+from pymongo import ReplaceOne
+
+from offer_feed.relations_view import (
+    get_relation_pageviews,
+    get_relation_view,
+    get_view_update,
+)
+
+
+def get_relation():
+    return {
+        "_id": "relation-1",
+        "offerSet": ["meny:product:1", "kolonial:product:1"],
+        "quantity": {"size": {"standard": {"max": 2}}},
+        "title": "Old title",
+        "m:no": {"title": "Melk", "mpnCategories": ["Meieri"]},
+    }
+
+
+def get_offers():
+    return [
+        {
+            "uri": "meny:product:1",
+            "pricing": {"price": 30},
+            "validThrough": datetime(2022, 1, 10),
+            "pageviews": 3,
+        },
+        {
+            "uri": "kolonial:product:1",
+            "pricing": {"price": 20},
+            "validThrough": datetime(2022, 1, 12),
+        },
+    ]
+
+
+class TestGetRelationView(TestCase):
+    def test_aggregates(self):
+        view = get_relation_view(get_relation(), get_offers(), "no")
+        self.assertEqual(
+            list(x["uri"] for x in view["offers"]),
+            ["kolonial:product:1", "meny:product:1"],
+        )
+        self.assertEqual(view["priceMin"], 20)
+        self.assertEqual(view["priceMax"], 30)
+        self.assertEqual(view["valueMin"], 10)
+        self.assertEqual(view["valueMax"], 15)
+        self.assertEqual(view["validThrough"], datetime(2022, 1, 12))
+        self.assertEqual(view["pageviews"], 3)
+
+    def test_market_fields(self):
+        view = get_relation_view(get_relation(), get_offers(), "no")
+        self.assertEqual(view["title"], "Melk")
+        self.assertEqual(view["mpnCategories"], ["Meieri"])
+        self.assertNotIn("m:no", view)
+
+    def test_without_offers(self):
+        view = get_relation_view(get_relation(), [], "no")
+        self.assertEqual(view["offers"], [])
+        self.assertIsNone(view["priceMin"])
+        self.assertEqual(view["pageviews"], 0)
+
+
+class TestGetViewUpdate(TestCase):
+    def test_view_without_hashes_is_replaced(self):
+        view = get_relation_view(get_relation(), get_offers(), "no")
+        update = get_view_update(view, None)
+        self.assertIsInstance(update, ReplaceOne)
+        self.assertTrue(update._upsert)
+        self.assertEqual(set(update._doc), set(view) | {"viewHashes"})
+
+    def test_unchanged_view_is_skipped(self):
+        view = get_relation_view(get_relation(), get_offers(), "no")
+        hashes = get_view_update(view, None)._doc["viewHashes"]
+        self.assertIsNone(get_view_update(view, hashes))
+
+    def test_only_changed_fields_are_set(self):
+        view = get_relation_view(get_relation(), get_offers(), "no")
+        hashes = get_view_update(view, None)._doc["viewHashes"]
+        offers = get_offers()
+        offers[0]["pageviews"] = 4
+        update = get_view_update(
+            get_relation_view(get_relation(), offers, "no"), hashes
+        )
+        self.assertEqual(
+            set(update._doc["$set"]), {"offers", "pageviews", "viewHashes"}
+        )
+        self.assertNotIn("$unset", update._doc)
+
+    def test_removed_fields_are_unset(self):
+        view = get_relation_view(get_relation(), get_offers(), "no")
+        hashes = get_view_update(view, None)._doc["viewHashes"]
+        relation = get_relation()
+        del relation["m:no"]["mpnCategories"]
+        update = get_view_update(
+            get_relation_view(relation, get_offers(), "no"), hashes
+        )
+        self.assertEqual(update._doc["$unset"], {"mpnCategories": ""})
+
+
+class TestGetRelationPageviews(TestCase):
+    def test_sums_with_new_pageviews(self):
+        relations = [
+            {"_id": "relation-1", "offerSet": ["a", "b"]},
+            {"_id": "relation-2", "offerSet": ["c"]},
+        ]
+        offers = [
+            {"uri": "a", "pageviews": 1},
+            {"uri": "b", "pageviews": 2},
+            {"uri": "c"},
+        ]
+        self.assertEqual(
+            get_relation_pageviews(relations, offers, {"a": 5}),
+            {"relation-1": 7, "relation-2": 0},
+        )
+
+    def test_offers_that_are_not_recent_are_not_counted(self):
+        relations = [{"_id": "relation-1", "offerSet": ["a", "b"]}]
+        self.assertEqual(
+            get_relation_pageviews(relations, [{"uri": "a"}], {"a": 5, "b": 3}),
+            {"relation-1": 5},
+        )
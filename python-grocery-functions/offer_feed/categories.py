@@ -2,13 +2,16 @@ import aws_config
 import logging
 import json
 import pydash
-from typing import Iterable, Optional
+from typing import Iterable, List, Optional
 from datetime import datetime
 from copy import deepcopy
 from pymongo import UpdateOne
 from bson.objectid import ObjectId
 from typing import Iterable, TypedDict
 
+from storage.bulk_writer import adaptive_bulk_write
+from storage.changesets import get_changed_uris
+from storage.content_hash import get_hash
 from storage.db import chunked_iterable, get_collection
 from amp_types.amp_product import HandleConfig, MpnOffer
 from util.utils import log_traceback
@@ -136,6 +139,66 @@ safe_categories_for_not_processed = [
 ]
 
 
+def get_category_mappings_hash(category_mappings: list, mpn_categories: list) -> str:
+    """
+    A hash of the category mappings and categories of a context. It is stored on the
+    offers as mpnCategoryMappingsHash, so that offers that were handled with other
+    mappings can be found.
+    """
+    return get_hash(
+        list(
+            sorted(x, key=lambda x: str(x["_id"]))
+            for x in (category_mappings, mpn_categories)
+        )
+    )
+
+
+def get_changed_and_stale_offers(
+    offer_collection,
+    scrape_batch_id: str,
+    changed_uris: List[str],
+    category_mappings_hash: str,
+    projection: dict,
+):
+    """
+    The changed offers of the scrape batch, and the unchanged offers of the batch that
+    were handled with other category mappings than the current ones, or never.
+    """
+    stale_uris = set()
+    for offer in offer_collection.find(
+        {
+            "scrapeBatchId": scrape_batch_id,
+            "mpnCategoryMappingsHash": {"$ne": category_mappings_hash},
+            # Offers without categories are not handled, so they never get the hash
+            "$or": [
+                {"categories.0": {"$exists": True}},
+                {"slugCategories.0": {"$exists": True}},
+            ],
+        },
+        projection,
+    ):
+        stale_uris.add(offer["uri"])
+        yield offer
+    for uri_chunk in chunked_iterable(
+        (x for x in changed_uris if x not in stale_uris), 5000
+    ):
+        yield from offer_collection.find({"uri": {"$in": list(uri_chunk)}}, projection)
+
+
+def get_category_update(
+    offer: MpnOffer, update_set: dict, category_mappings_hash: str
+) -> UpdateOne:
+    """
+    Sets the category fields of the offer. When they change, the content hashes are
+    removed, so the next write of the offer is a full one with the categories group
+    changed, and the relations and market handlers copy the new values.
+    """
+    update = {"$set": {**update_set, "mpnCategoryMappingsHash": category_mappings_hash}}
+    if any(offer.get(key) != value for key, value in update_set.items()):
+        update["$unset"] = {"contentHash": "", "contentGroupHashes.categories": ""}
+    return UpdateOne({"_id": ObjectId(offer["_id"])}, update)
+
+
 def handle_offers_for_categories(config: HandleConfig):
     logging.info("handle_offers_for_categories")
     now = datetime.now()
@@ -157,20 +220,52 @@ def handle_offers_for_categories(config: HandleConfig):
         return None
 
     offer_collection = get_collection("mpnoffers")
+    mpn_categories = list(
+        get_collection("mpncategories").find(
+            {"context": offer_context},
+            {"_id": 1, "name": 1, "key": 1, "parent": 1, "level": 1},
+        )
+    )
+    category_mappings_hash = get_category_mappings_hash(
+        category_mappings, mpn_categories
+    )
+    offers_projection = {
+        "uri": 1,
+        "categories": 1,
+        "slugCategories": 1,
+        "mpnNutrition": 1,
+        "mpnCategories": 1,
+        "mpnIngredients": 1,
+    }
 
     offers: Iterable = []
+    changed_uris = (
+        get_changed_uris(scrape_batch_id)
+        if scrape_batch_id and config.get("hasChangeset")
+        else None
+    )
 
-    if scrape_batch_id:
+    if changed_uris is not None:
+        # Unchanged offers are only handled again when the category mappings changed
+        logging.info(f"Handling {len(changed_uris)} changed offers")
+        offers = get_changed_and_stale_offers(
+            offer_collection,
+            scrape_batch_id,
+            changed_uris,
+            category_mappings_hash,
+            offers_projection,
+        )
+    elif scrape_batch_id:
         offers = offer_collection.find(
             {
                 "scrapeBatchId": scrape_batch_id,
             },
-            {"categories": 1, "slugCategories": 1, "mpnNutrition": 1},
+            offers_projection,
         )
     else:
         offers = offer_collection.find(
             {"provenance": provenance, "validThrough": {"$gt": now}, "isRecent": True},
-            {"categories": 1, "slugCategories": 1, "mpnNutrition": 1},
+            offers_projection,
         )
 
     offers = (
@@ -181,10 +276,6 @@ def handle_offers_for_categories(config: HandleConfig):
     category_mappings_map = {}
     for x in category_mappings:
         category_mappings_map[json.dumps(x["source"])] = x
-    mpn_categories = get_collection("mpncategories").find(
-        {"context": offer_context},
-        {"_id": 1, "name": 1, "key": 1, "parent": 1, "level": 1},
-    )
     mpn_categories_map = {}
     for x in mpn_categories:
         mpn_categories_map[x["key"]] = x
@@ -209,21 +300,12 @@ def handle_offers_for_categories(config: HandleConfig):
                 "processedScore": 0,
                 "ingredients": pydash.get(offer, ["mpnIngredients", "ingredients"], {}),
             }
-        updates.append(
-            UpdateOne(
-                {"_id": ObjectId(offer["_id"])},
-                {"$set": update_set},
-            )
-        )
+        updates.append(get_category_update(offer, update_set, category_mappings_hash))
     logging.debug(f"Updates: {len(updates)}")
 
-    result = 0
-    for chunk in chunked_iterable(updates, 1000):
-        try:
-            # Can get a write error here, probably due to high write load on Mongo
-            cursor = offer_collection.bulk_write(list(chunk))
-            result += cursor.modified_count
-        except Exception as e:
-            logging.error(e)
-            log_traceback(e)
-    return result
+    try:
+        return adaptive_bulk_write(offer_collection, updates)["nModified"]
+    except Exception as e:
+        logging.error(e)
+        log_traceback(e)
+    return 0
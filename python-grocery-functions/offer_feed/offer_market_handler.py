@@ -1,16 +1,30 @@
 import json
 import aws_config
 import logging
-from typing import TypedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple, TypedDict
 from datetime import datetime
-from storage.models import mpn_offer_store_fields
+from storage.models import mpn_offer_derived_fields, mpn_offer_store_fields
 import time
-from storage.db import get_collection
+from storage.changesets import get_changed_uris
+from storage.content_hash import VOLATILE_OFFER_FIELDS
+from storage.db import chunked_iterable, get_collection
 from util.logging import configure_lambda_logging
 
 
 configure_lambda_logging()
 
+# Fields that change without the content hash of an offer changing. The categories
+# handler sets mpnCategories and mpnIngredients after the feed handler wrote the offer.
+MARKET_SYNC_FIELDS = [
+    *VOLATILE_OFFER_FIELDS,
+    *mpn_offer_derived_fields,
+    "mpnCategories",
+    "mpnIngredients",
+]
+MARKET_SYNC_CHUNK_SIZE = 5000
+# The content hash is copied so that the market sync can compare it
+MARKET_COPY_FIELDS = [*mpn_offer_store_fields, "contentHash"]
+
 
 class SnsMessage(TypedDict):
     collection_name: str
@@ -27,7 +41,9 @@ def handle_market_offers_sns(event, context):
     scrape_batch_id = sns_message.get("scrapeBatchId")
 
     if scrape_batch_id:
-        return handle_market_offers_with_scrape_batch(scrape_batch_id, market)
+        return handle_market_offers_with_scrape_batch(
+            scrape_batch_id, market, sns_message.get("hasChangeset", False)
+        )
     elif provenance:
         return handle_market_offers_with_provenance(provenance, market)
 
@@ -40,7 +56,9 @@ def handle_market_offers_trigger(event, context):
     market = event["market"]
 
     if scrape_batch_id:
-        return handle_market_offers_with_scrape_batch(scrape_batch_id, market)
+        return handle_market_offers_with_scrape_batch(
+            scrape_batch_id, market, event.get("hasChangeset", False)
+        )
     elif provenance:
         return handle_market_offers_with_provenance(provenance, market)
 
@@ -52,36 +70,52 @@ def handle_market_offers_with_provenance(provenance: str, market: str):
         "isRecent": True,
         "validThrough": {"$gt": datetime.now()},
     }
-    return save_offers_to_market_collection(offer_filter, market)
+    return sync_offers_to_market_collection(offer_filter, market)
 
 
-def handle_market_offers_with_scrape_batch(scrape_batch_id: str, market: str):
+def handle_market_offers_with_scrape_batch(
+    scrape_batch_id: str, market: str, incremental: bool = False
+):
     offer_filter = {
         "scrapeBatchId": scrape_batch_id,
     }
-
-    return save_offers_to_market_collection(offer_filter, market)
+    changed_uris = get_changed_uris(scrape_batch_id) if incremental else None
+    return sync_offers_to_market_collection(offer_filter, market, changed_uris)
+
+
+def get_market_merge_pipeline(
+    offer_filter: dict,
+    market: str,
+    fields: Iterable[str],
+    is_partial: bool,
+):
+    """
+    Copies the fields of the offers of the filter to the market collection.
+    Partial copies merge the fields into the existing offers, and full copies replace
+    them. New offers are only inserted by full copies.
+    """
+    projection = {}
+    for field_name in fields:
+        projection[field_name] = 1
+    return [
+        {"$match": offer_filter},
+        {"$project": projection},
+        {
+            "$merge": {
+                "into": f"mpnoffers_{market}",
+                "on": "_id",
+                "whenMatched": "merge" if is_partial else "replace",
+                "whenNotMatched": "discard" if is_partial else "insert",
+            }
+        },
+    ]
 
 
 def save_offers_to_market_collection(offer_filter: dict, market: str):
     timer_start = time.perf_counter_ns()
     offer_collection = get_collection("mpnoffers")
-    projection = {}
-    for field_name in mpn_offer_store_fields:
-        projection[field_name] = 1
     update_view_response = offer_collection.aggregate(
-        [
-            {"$match": offer_filter},
-            {"$project": projection},
-            {
-                "$merge": {
-                    "into": f"mpnoffers_{market}",
-                    "on": "_id",
-                    "whenMatched": "replace",
-                    "whenNotMatched": "insert",
-                }
-            },
-        ]
+        get_market_merge_pipeline(offer_filter, market, MARKET_COPY_FIELDS, False)
     )
 
     logging.info(
@@ -90,3 +124,104 @@ def save_offers_to_market_collection(offer_filter: dict, market: str):
     logging.info(update_view_response)
     timer_start = time.perf_counter_ns()
     return json.dumps(update_view_response, default=str)
+
+
+def get_market_sync_plan(
+    offers: Iterable[dict],
+    market_offers: Dict[object, dict],
+    changed_uris: Optional[Set[str]] = None,
+) -> Tuple[List, List, int]:
+    """
+    Compares the offers with the stored ones of the market collection by _id.
+    Offers that are new, where the content hash differs, that are in changed_uris or
+    that no longer have one of the volatile or derived fields are copied in full.
+    Offers where only the values of the volatile or derived fields differ are copied
+    partially.
+    Returns the ids to copy in full, the ids to copy partially and the number of
+    offers that are unchanged.
+    """
+    full_ids = []
+    partial_ids = []
+    n_unchanged = 0
+    for offer in offers:
+        market_offer = market_offers.get(offer["_id"])
+        if (
+            market_offer is None
+            or (changed_uris is not None and offer.get("uri") in changed_uris)
+            or offer.get("contentHash") is None
+            or offer.get("contentHash") != market_offer.get("contentHash")
+            # A merge can't remove fields, so offers that lost one are replaced
+            or any(x in market_offer and x not in offer for x in MARKET_SYNC_FIELDS)
+        ):
+            full_ids.append(offer["_id"])
+        elif any(offer.get(key) != market_offer.get(key) for key in MARKET_SYNC_FIELDS):
+            partial_ids.append(offer["_id"])
+        else:
+            n_unchanged += 1
+    return full_ids, partial_ids, n_unchanged
+
+
+def sync_offers_to_market_collection(
+    offer_filter: dict, market: str, changed_uris: Optional[List[str]] = None
+):
+    """
+    Copies the offers of the filter to the market collection when they differ from
+    the stored ones, and removes the expired offers of the same provenances.
+    Only the content hash and the volatile and derived fields are read to compare.
+    Offers that are missing from the market collection, e.g. after they expired there,
+    are always copied. The changed_uris of a changeset are copied in full.
+    Full copies replace the stored offers, and partial copies merge the volatile and
+    derived fields into them.
+    """
+    timer_start = time.perf_counter_ns()
+    offer_collection = get_collection("mpnoffers")
+    market_collection = get_collection(f"mpnoffers_{market}")
+    projection = dict(
+        (key, 1) for key in ["uri", "provenance", "contentHash", *MARKET_SYNC_FIELDS]
+    )
+    changed_uri_set = set(changed_uris) if changed_uris is not None else None
+    result = {"nCopied": 0, "nPartial": 0, "nSkipped": 0, "nRemoved": 0}
+    provenances = set()
+    offers_cursor = offer_collection.find(
+        offer_filter, projection, batch_size=MARKET_SYNC_CHUNK_SIZE
+    )
+    for chunk in chunked_iterable(offers_cursor, MARKET_SYNC_CHUNK_SIZE):
+        provenances.update(x.get("provenance") for x in chunk)
+        market_offers = dict(
+            (x["_id"], x)
+            for x in market_collection.find(
+                {"_id": {"$in": list(x["_id"] for x in chunk)}}, projection
+            )
+        )
+        full_ids, partial_ids, n_unchanged = get_market_sync_plan(
+            chunk, market_offers, changed_uri_set
+        )
+        if full_ids:
+            offer_collection.aggregate(
+                get_market_merge_pipeline(
+                    {"_id": {"$in": full_ids}}, market, MARKET_COPY_FIELDS, False
+                )
+            )
+        if partial_ids:
+            offer_collection.aggregate(
+                get_market_merge_pipeline(
+                    {"_id": {"$in": partial_ids}}, market, MARKET_SYNC_FIELDS, True
+                )
+            )
+        result["nCopied"] += len(full_ids)
+        result["nPartial"] += len(partial_ids)
+        result["nSkipped"] += n_unchanged
+
+    provenances.discard(None)
+    if provenances:
+        result["nRemoved"] = market_collection.delete_many(
+            {
+                "provenance": {"$in": list(provenances)},
+                "validThrough": {"$lt": datetime.now()},
+            }
+        ).deleted_count
+
+    logging.info(
+        f"Finish sync {int((time.perf_counter_ns() - timer_start) / 1e6)} ms for market {market}: {result}"
+    )
+    return json.dumps(result, default=str)
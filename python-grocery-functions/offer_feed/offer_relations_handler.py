@@ -2,21 +2,28 @@ import json
 import aws_config
 import logging
 import pydash
-from typing import Iterable, TypedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, TypedDict
 from datetime import datetime
 import time
 from pymongo import UpdateOne
 from storage.db import get_collection, yield_rows
+from storage.bulk_writer import adaptive_bulk_write
+from storage.changesets import get_changed_uris
 from amp_types.amp_product import MpnOffer
 from util.logging import configure_lambda_logging
 from bson import ObjectId
-from scraper_feed.helpers import is_valid_ean, is_valid_nobb
+from offer_feed.relation_index import RelationIndex, get_offer_relation_gtins
+from offer_feed.relations_view import update_relations_view
 from util.helpers import is_null_or_empty
 from storage.db import chunked_iterable
+from util.union_find import UnionFind
 
 
 configure_lambda_logging()
 
+# Relations don't use the prices of the offers
+RELATION_FIELD_GROUPS = ("categories", "gtins", "text", "other")
+
 
 class SnsMessage(TypedDict):
     collection_name: str
@@ -33,7 +40,9 @@ def handle_offer_relations_sns(event, context):
     scrape_batch_id = sns_message.get("scrapeBatchId")
 
     if scrape_batch_id:
-        return handle_offer_relations_with_scrape_batch(scrape_batch_id, market)
+        return handle_offer_relations_with_scrape_batch(
+            scrape_batch_id, market, sns_message.get("hasChangeset", False)
+        )
     elif provenance:
         return handle_offer_relations_with_provenance(provenance, market)
 
@@ -46,7 +55,9 @@ def handle_offer_relations_trigger(event, context):
     market = event["market"]
 
     if scrape_batch_id:
-        return handle_offer_relations_with_scrape_batch(scrape_batch_id, market)
+        return handle_offer_relations_with_scrape_batch(
+            scrape_batch_id, market, event.get("hasChangeset", False)
+        )
     elif provenance:
         return handle_offer_relations_with_provenance(provenance, market)
 
@@ -61,78 +72,98 @@ def handle_offer_relations_with_provenance(provenance: str, market: str):
     return handle_offer_relations(offer_filter, market)
 
 
-def handle_offer_relations_with_scrape_batch(scrape_batch_id: str, market: str):
+def handle_offer_relations_with_scrape_batch(
+    scrape_batch_id: str, market: str, incremental: bool = False
+):
     offer_filter = {
         "scrapeBatchId": scrape_batch_id,
     }
+    changed_uris = (
+        get_changed_uris(scrape_batch_id, RELATION_FIELD_GROUPS)
+        if incremental
+        else None
+    )
 
-    return handle_offer_relations(offer_filter, market)
+    return handle_offer_relations(offer_filter, market, changed_uris)
 
 
-def handle_offer_relations(offer_filter, market):
+def handle_offer_relations(
+    offer_filter, market, changed_uris: Optional[List[str]] = None
+):
+    """
+    Matches the offers of the filter to relations and updates the relations view.
+    When changed_uris is given, only those offers are matched. The view is still
+    updated for all offers of the filter, since it has their prices and validThrough,
+    but only the relations whose view changed are written.
+    """
     timer_start = time.perf_counter_ns()
     CHUNK_SIZE = 1000
     uris = []
 
     offers_collection = get_collection("mpnoffers")
-    offers_cursor = offers_collection.find(
-        offer_filter,
-        {
-            "uri": 1,
-            "gtins": 1,
-            "title": 1,
-            "description": 1,
-            "shortDescription": 1,
-            "subtitle": 1,
-            "imageUrl": 1,
-            "mpnCategories": 1,
-            "mpnNutrition": 1,
-            "mpnProperties": 1,
-            "mpnIngredients": 1,
-            "quantity": 1,
-            "brand": 1,
-            "brandKey": 1,
-            "mpnCategoriesV": 1,
-            "mpnIngredientsV": 1,
-            "mpnNutritionV": 1,
-            "mpnPropertiesV": 1,
-            "mpnStockV": 1,
-            "mpnQuantityV": 1,
-        },
-        batch_size=CHUNK_SIZE,
-    )
-    chunks = yield_rows(offers_cursor, CHUNK_SIZE)
+    offers_projection = {
+        "uri": 1,
+        "gtins": 1,
+        "title": 1,
+        "description": 1,
+        "shortDescription": 1,
+        "subtitle": 1,
+        "imageUrl": 1,
+        "mpnCategories": 1,
+        "mpnNutrition": 1,
+        "mpnProperties": 1,
+        "mpnIngredients": 1,
+        "quantity": 1,
+        "brand": 1,
+        "brandKey": 1,
+        "mpnCategoriesV": 1,
+        "mpnIngredientsV": 1,
+        "mpnNutritionV": 1,
+        "mpnPropertiesV": 1,
+        "mpnStockV": 1,
+        "mpnQuantityV": 1,
+    }
+    if changed_uris is None:
+        offers_cursor = offers_collection.find(
+            offer_filter, offers_projection, batch_size=CHUNK_SIZE
+        )
+        chunks = yield_rows(offers_cursor, CHUNK_SIZE)
+    else:
+        logging.info(f"Matching {len(changed_uris)} changed offers")
+        chunks = (
+            offers_collection.find(
+                {**offer_filter, "uri": {"$in": list(uri_chunk)}}, offers_projection
+            )
+            for uri_chunk in chunked_iterable(changed_uris, CHUNK_SIZE)
+        )
     result = []
     logging.info(f"Finish setup {int((time.perf_counter_ns() - timer_start) / 1e6)} ms")
     timer_start = time.perf_counter_ns()
     counter = 1
+    relation_index = get_relation_index(market)
     for chunk in chunks:
         logging.info(f"Matching chunk number {counter} of {CHUNK_SIZE}")
         counter += 1
         chunk_list = list(chunk)
         for x in chunk_list:
             uris.append(x["uri"])
-        insert_result = handle_offer_relations_chunk(chunk_list, market=market)
+        insert_result = handle_offer_relations_chunk(
+            chunk_list, market=market, relation_index=relation_index
+        )
         result.append(insert_result)
+    relation_index.log_stats()
     logging.info(
         f"Finish match offers {int((time.perf_counter_ns() - timer_start) / 1e6)} ms"
     )
     timer_start = time.perf_counter_ns()
 
-    update_view_responses = []
+    if changed_uris is not None:
+        uris = list(
+            x["uri"] for x in offers_collection.find(offer_filter, {"uri": 1, "_id": 0})
+        )
 
     logging.info(f"Saving {len(uris)} offers")
-    for uri_chunk in chunked_iterable(uris, 5000):
-        logging.info(f"Updating view with chunk of 5000")
-        update_view_response = update_offer_relations_view(
-            {
-                "offerSet": {"$in": uri_chunk},
-                "relationType": "identical",
-                "isMerged": {"$ne": True},
-            },
-            market,
-        )
-        update_view_responses.append(update_view_response)
+    update_view_response = update_relations_view(uris, market)
 
     logging.info(
         f"Finish update view {int((time.perf_counter_ns() - timer_start) / 1e6)} ms"
@@ -140,10 +171,14 @@ def handle_offer_relations(offer_filter, market):
     timer_start = time.perf_counter_ns()
     # market_rel_collection = get_collection(f"relations_with_offers_{market}")
 
-    return json.dumps(update_view_responses, default=str)
+    return json.dumps(update_view_response, default=str)
 
 
 def update_offer_relations_view(relations_filter: dict, market: str):
+    """
+    Replaces the view documents of all relations of the filter in one aggregation.
+    See update_relations_view for updating the relations of some offers.
+    """
     logging.info(f"Saving offer relations to market {market}")
     rel_collection = get_collection("offerbirelations")
     filter = {
@@ -230,42 +265,8 @@ def update_offer_relations_view(relations_filter: dict, market: str):
     return update_view_response
 
 
-def handle_offer_relations_chunk(offers: Iterable[MpnOffer], market):
-    relations_collection = get_collection("offerbirelations")
-    gtins = []
-    uris = []
-    now = datetime.now()
-    rel_fields = [
-        "quantity",
-        "brand",
-        "brandKey",
-        "mpnNutrition",
-        "mpnIngredients",
-        "mpnProperties",
-        "imageUrl",
-        "mpnCategoriesV",
-        "mpnIngredientsV",
-        "mpnNutritionV",
-        "mpnPropertiesV",
-        "mpnStockV",
-        "mpnQuantityV",
-    ]
-    rel_market_fields = [
-        "title",
-        "subtitle",
-        "shortDescription",
-        "description",
-        "mpnCategories",
-    ]
-    for offer in offers:
-        uris.append(offer["uri"])
-        for key, value in offer.get("gtins", {}).items():
-            if key in ("gtin13", "ean") and is_valid_ean(str(value)):
-                gtins.append(f"ean:{value}")
-            elif key == "nobb" and is_valid_nobb(str(value)):
-                gtins.append(f"{key}:{value}")
-
-    relations_projection = {
+def get_relations_projection(market: str) -> dict:
+    return {
         "offerSet": 1,
         "gtins": 1,
         "title": 1,
@@ -288,79 +289,104 @@ def handle_offer_relations_chunk(offers: Iterable[MpnOffer], market):
         "mpnStockV": 1,
         "mpnQuantityV": 1,
     }
-    existing_uri_relations = relations_collection.find(
-        {
-            "relationType": "identical",
-            "isMerged": {"$ne": True},
-            "offerSet": {"$in": uris},
-        },
-        relations_projection,
-    )
-    existing_gtins_relations = relations_collection.find(
-        {
-            "relationType": "identical",
-            "isMerged": {"$ne": True},
-            "gtins": {"$in": gtins},
-            "gtins.0": {"$exists": True},
-        },
-        relations_projection,
+
+
+def get_relation_index(market: str) -> RelationIndex:
+    return RelationIndex(
+        get_collection("offerbirelations"), get_relations_projection(market)
     )
 
-    relations_map = {}
-    for rel in existing_uri_relations:
-        for uri in rel["offerSet"]:
-            rels = relations_map.get(uri)
-            if rels:
-                rels.append(rel)
-            else:
-                relations_map[uri] = [rel]
-        for gtin in rel.get("gtins", []):
-            rels = relations_map.get(gtin)
-            if rels:
-                rels.append(rel)
-            else:
-                relations_map[gtin] = [rel]
-    for rel in existing_gtins_relations:
-        for uri in rel["offerSet"]:
-            rels = relations_map.get(uri)
-            if rels:
-                rels.append(rel)
-            else:
-                relations_map[uri] = [rel]
-        for gtin in rel.get("gtins", []):
-            rels = relations_map.get(gtin)
-            if rels:
-                rels.append(rel)
-            else:
-                relations_map[gtin] = [rel]
-
-    merge_operations = []
-    operations = []
-
-    for offer in offers:
-        mongo_safe_uri = offer["uri"].replace(".", "\uff0E")
-        rels = [*relations_map.get(offer["uri"], [])]
-        offer_gtins = []
-        for key, value in offer.get("gtins", {}).items():
-            if key in ("gtin13", "ean") and is_valid_ean(str(value)):
-                offer_gtins.append(f"ean:{value}")
-            elif key == "nobb" and is_valid_nobb(str(value)):
-                offer_gtins.append(f"{key}:{value}")
+
+# Fields of the offers that are copied to the relations
+RELATION_FIELDS = [
+    "quantity",
+    "brand",
+    "brandKey",
+    "mpnNutrition",
+    "mpnIngredients",
+    "mpnProperties",
+    "imageUrl",
+    "mpnCategoriesV",
+    "mpnIngredientsV",
+    "mpnNutritionV",
+    "mpnPropertiesV",
+    "mpnStockV",
+    "mpnQuantityV",
+]
+RELATION_MARKET_FIELDS = [
+    "title",
+    "subtitle",
+    "shortDescription",
+    "description",
+    "mpnCategories",
+]
+
+
+class RelationMergePlan(NamedTuple):
+    # Merge markers of the absorbed relations, written before the operations
+    merge_operations: List[UpdateOne]
+    operations: List[UpdateOne]
+    # Relation id, added keys by field and set fields of the kept relations
+    index_updates: List[Tuple[ObjectId, Dict[str, List[str]], dict]]
+    merged_relation_ids: List[ObjectId]
+    # Keys of the offers that are inserted as new relations
+    new_relation_keys: List[str]
+
+
+def get_mongo_safe_uri(uri: str) -> str:
+    return uri.replace(".", "\uff0E")
+
+
+def plan_relation_merges(
+    offers: List[MpnOffer],
+    offers_gtins: List[List[str]],
+    relation_index: RelationIndex,
+    market: str,
+    now: datetime,
+) -> RelationMergePlan:
+    """
+    Groups the offers of a chunk, their gtins and the relations they match into
+    connected components. For each component, the relation with most offers is kept
+    and gets one update with all the offers, and each of the other relations gets one
+    merge marker. A component without relations is inserted as one new relation.
+    The fields of the kept relation are taken from the last offer of the component,
+    as if the offers were handled one by one.
+    """
+    union_find = UnionFind()
+    offers_relations = []
+    for offer, offer_gtins in zip(offers, offers_gtins):
+        rels = relation_index.get_relations([offer["uri"], *offer_gtins])
+        offers_relations.append(rels)
         for gtin in offer_gtins:
-            gtin_rels = relations_map.get(gtin)
-            if gtin_rels:
-                if rels:
-                    rels.extend(gtin_rels)
-                else:
-                    rels = [*gtin_rels]
+            union_find.union(offer["uri"], gtin)
+        for rel in rels:
+            union_find.union(offer["uri"], f"_id:{rel['_id']}")
+
+    components = {}
+    for offer, offer_gtins, rels in zip(offers, offers_gtins, offers_relations):
+        component = components.setdefault(
+            union_find.find(offer["uri"]),
+            {"offers": [], "gtins": {}, "relations": {}, "relation_uris": {}},
+        )
+        component["offers"].append(offer)
+        component["gtins"].update(dict.fromkeys(offer_gtins))
+        for rel in rels:
+            component["relations"][rel["_id"]] = rel
+            component["relation_uris"].setdefault(rel["_id"], []).append(offer["uri"])
+
+    plan = RelationMergePlan([], [], [], [], [])
+    for component in components.values():
+        offer = component["offers"][-1]
+        uris = list(dict.fromkeys(x["uri"] for x in component["offers"]))
+        gtins = list(component["gtins"])
+        rels = list(component["relations"].values())
 
         if rels:
-            # Choose the one with most offers in the set, and if equal, the one without the offer itself in the set
-            rel_to_use = sorted(
+            # Choose the one with most offers in the set, and if equal, the one without the offers themselves in the set
+            rel_to_use = max(
                 rels,
-                key=lambda x: (len(x["offerSet"]), offer["uri"] not in x["offerSet"]),
-                reverse=True,
-            )[0]
+                key=lambda x: (len(x["offerSet"]), len(set(uris) - set(x["offerSet"]))),
+            )
             other_rels = list([x for x in rels if x["_id"] != rel_to_use["_id"]])
 
             rel_info = get_relation_info(offer, rels, market=market)
@@ -370,31 +396,37 @@ def handle_offer_relations_chunk(offers: Iterable[MpnOffer], market):
             for rel in other_rels:
                 other_uris.extend(rel["offerSet"])
 
-            operations.append(
+            added_keys = {
+                "gtins": gtins,
+                "offerSet": list(dict.fromkeys([*other_uris, *uris])),
+            }
+            set_fields = {
+                "updatedAt": now,
+                f"m:{market}": pydash.pick(
+                    rel_info["rel"],
+                    RELATION_MARKET_FIELDS,
+                ),
+                # f"p:{provenance}": rel_info["offer"],
+                **pydash.pick(
+                    rel_info["rel"],
+                    RELATION_FIELDS,
+                ),
+            }
+            plan.operations.append(
                 UpdateOne(
                     {"_id": ObjectId(rel_to_use["_id"])},
                     {
-                        "$addToSet": {
-                            "gtins": {"$each": offer_gtins},
-                            "offerSet": {"$each": [*other_uris, offer["uri"]]},
-                        },
-                        "$set": {
-                            "updatedAt": now,
-                            f"m:{market}": pydash.pick(
-                                rel_info["rel"],
-                                rel_market_fields,
-                            ),
-                            # f"p:{provenance}": rel_info["offer"],
-                            **pydash.pick(
-                                rel_info["rel"],
-                                rel_fields,
-                            ),
-                        },
+                        "$addToSet": dict(
+                            (key, {"$each": values})
+                            for key, values in added_keys.items()
+                        ),
+                        "$set": set_fields,
                     },
                 )
             )
+            plan.index_updates.append((rel_to_use["_id"], added_keys, set_fields))
             for rel in other_rels:
-                merge_operations.append(
+                plan.merge_operations.append(
                     UpdateOne(
                         {"_id": rel["_id"]},
                         {
@@ -402,62 +434,117 @@ def handle_offer_relations_chunk(offers: Iterable[MpnOffer], market):
                                 "mergedTo": ObjectId(rel_to_use["_id"]),
                                 "isMerged": True,
                                 "updatedAt": now,
-                                f"offerSetMeta.{mongo_safe_uri}.auto": {
-                                    "method": "auto",
-                                    "reason": "merged",
-                                    "updatedAt": now,
-                                },
+                                **dict(
+                                    (
+                                        f"offerSetMeta.{get_mongo_safe_uri(uri)}.auto",
+                                        {
+                                            "method": "auto",
+                                            "reason": "merged",
+                                            "updatedAt": now,
+                                        },
+                                    )
+                                    for uri in component["relation_uris"][rel["_id"]]
+                                ),
                             },
                         },
                     )
                 )
+                plan.merged_relation_ids.append(rel["_id"])
         else:
             rel_info = get_relation_info(offer, [], market=market)
-            operations.append(
+            plan.operations.append(
                 UpdateOne(
-                    {"relationType": "identical", "offerSet": offer["uri"]},
+                    {"relationType": "identical", "offerSet": {"$in": uris}},
                     {
                         "$setOnInsert": {
                             "relationType": "identical",
                             "isMerged": False,
                             "createdAt": now,
                             "updatedAt": now,
-                            "offerSet": [offer["uri"]],
-                            f"offerSetMeta.{mongo_safe_uri}.auto": {
-                                "method": "auto",
-                                "reason": "initial",
-                                "updatedAt": now,
-                            },
-                            "gtins": offer_gtins,
+                            "offerSet": uris,
+                            **dict(
+                                (
+                                    f"offerSetMeta.{get_mongo_safe_uri(uri)}.auto",
+                                    {
+                                        "method": "auto",
+                                        "reason": "initial",
+                                        "updatedAt": now,
+                                    },
+                                )
+                                for uri in uris
+                            ),
+                            "gtins": gtins,
                             f"m:{market}": pydash.pick(
                                 rel_info["rel"],
-                                rel_market_fields,
+                                RELATION_MARKET_FIELDS,
                             ),
                             # f"p:{provenance}": rel_info["offer"],
                             **pydash.pick(
                                 rel_info["rel"],
-                                rel_fields,
+                                RELATION_FIELDS,
                             ),
                         },
                     },
                     upsert=True,
                 )
             )
+            plan.new_relation_keys.extend([*uris, *gtins])
+    return plan
+
+
+def handle_offer_relations_chunk(
+    offers: Iterable[MpnOffer],
+    market,
+    relation_index: Optional[RelationIndex] = None,
+):
+    """
+    Adds the offers to the relations with the same uri or gtins, and merges the
+    relations when offers match several of them. See plan_relation_merges.
+    The relation index is shared by the chunks of a run. It is updated with the
+    written operations, so the next chunk sees them without querying the relations.
+    """
+    if relation_index is None:
+        relation_index = get_relation_index(market)
+    relations_collection = relation_index.collection
+    offers = list(offers)
+    offers_gtins = list(get_offer_relation_gtins(offer) for offer in offers)
+    relation_index.fetch(
+        (offer["uri"] for offer in offers),
+        (gtin for offer_gtins in offers_gtins for gtin in offer_gtins),
+    )
+    plan = plan_relation_merges(
+        offers, offers_gtins, relation_index, market, datetime.now()
+    )
 
     try:
-        if len(merge_operations) > 0:
-            relations_collection.bulk_write(merge_operations, ordered=False)
-
-        if len(operations) > 0:
-            return pydash.pick(
-                relations_collection.bulk_write(
-                    operations, ordered=False
-                ).bulk_api_result,
-                ["nInserted", "nUpserted", "nMatched", "nModified", "nRemoved"],
-            )
+        merge_result = adaptive_bulk_write(relations_collection, plan.merge_operations)
+        insert_result = (
+            adaptive_bulk_write(relations_collection, plan.operations)
+            if len(plan.operations) > 0
+            else None
+        )
     except Exception as e:
         logging.error(e)
-    return None
+        relation_index.clear()
+        return None
+
+    if merge_result["nFailed"] > 0 or (insert_result and insert_result["nFailed"] > 0):
+        # The index can't tell which of the operations were written
+        relation_index.clear()
+    else:
+        for relation_id, added_keys, set_fields in plan.index_updates:
+            relation_index.update_relation(relation_id, added_keys, set_fields)
+        for relation_id in plan.merged_relation_ids:
+            relation_index.remove_relation(relation_id)
+        # The ids of upserted relations are not known, so their keys are fetched again
+        relation_index.invalidate(plan.new_relation_keys)
+
+    if insert_result is None:
+        return None
+    return pydash.pick(
+        insert_result,
+        ["nInserted", "nUpserted", "nMatched", "nModified", "nRemoved"],
+    )
 
 
 def get_relation_info(offer, relations, market):
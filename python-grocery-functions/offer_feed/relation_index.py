@@ -0,0 +1,137 @@
+import logging
+from typing import Dict, Iterable, List
+
+from pymongo.collection import Collection
+
+from scraper_feed.helpers import is_valid_ean, is_valid_nobb
+
+
+def get_offer_relation_gtins(offer: dict) -> List[str]:
+    """
+    The gtins of the offer as relation keys, like ean:7038010000737 or nobb:12345678.
+    """
+    result = []
+    for key, value in (offer.get("gtins") or {}).items():
+        if key in ("gtin13", "ean") and is_valid_ean(str(value)):
+            result.append(f"ean:{value}")
+        elif key == "nobb" and is_valid_nobb(str(value)):
+            result.append(f"{key}:{value}")
+    return result
+
+
+def get_relation_keys(relation: dict) -> List[str]:
+    return [*relation.get("offerSet", []), *relation.get("gtins", [])]
+
+
+class RelationIndex:
+    """
+    The identical relations of a run by offer uri and gtin key.
+    Keys are fetched from the database the first time they are looked up, and the
+    index is updated from the writes of the run, so that relations that are created
+    or merged by one chunk are seen by the next chunks without another query.
+    Relations are kept with the fields of the projection.
+    """
+
+    def __init__(self, collection: Collection, projection: dict):
+        self.collection = collection
+        self.projection = projection
+        self.relations: Dict[object, dict] = {}
+        # Ids of the relations by key. The dicts are used as ordered sets.
+        self.relation_ids: Dict[str, Dict[object, None]] = {}
+        # Keys that are complete in the index, also when no relation has them
+        self.fetched_keys = set()
+        self.stats = {"queries": 0, "fetchedKeys": 0, "cachedKeys": 0}
+
+    def add_relation(self, relation: dict):
+        self.remove_relation(relation["_id"])
+        self.relations[relation["_id"]] = relation
+        for key in get_relation_keys(relation):
+            self.relation_ids.setdefault(key, {})[relation["_id"]] = None
+
+    def remove_relation(self, relation_id):
+        relation = self.relations.pop(relation_id, None)
+        if relation is None:
+            return
+        for key in get_relation_keys(relation):
+            ids = self.relation_ids.get(key)
+            if ids is not None:
+                ids.pop(relation_id, None)
+                if not ids:
+                    del self.relation_ids[key]
+
+    def invalidate(self, keys: Iterable[str]):
+        """
+        Fetches the keys again the next time they are looked up, for example after
+        an upsert that may have created a relation with them.
+        """
+        self.fetched_keys.difference_update(keys)
+
+    def clear(self):
+        self.relations = {}
+        self.relation_ids = {}
+        self.fetched_keys = set()
+
+    def fetch(self, uris: Iterable[str], gtins: Iterable[str]):
+        """
+        Fetches the relations of the keys that are not in the index yet, in one query.
+        """
+        uris = list(dict.fromkeys(uris))
+        gtins = list(dict.fromkeys(gtins))
+        missing_uris = list(x for x in uris if x not in self.fetched_keys)
+        missing_gtins = list(x for x in gtins if x not in self.fetched_keys)
+        self.stats["cachedKeys"] += (
+            len(uris) + len(gtins) - len(missing_uris) - len(missing_gtins)
+        )
+        if not missing_uris and not missing_gtins:
+            return
+        key_filters = []
+        if missing_uris:
+            key_filters.append({"offerSet": {"$in": missing_uris}})
+        if missing_gtins:
+            key_filters.append({"gtins": {"$in": missing_gtins}})
+        for relation in self.collection.find(
+            {
+                "relationType": "identical",
+                "isMerged": {"$ne": True},
+                "$or": key_filters,
+            },
+            self.projection,
+        ):
+            self.add_relation(relation)
+        self.fetched_keys.update(missing_uris)
+        self.fetched_keys.update(missing_gtins)
+        self.stats["queries"] += 1
+        self.stats["fetchedKeys"] += len(missing_uris) + len(missing_gtins)
+
+    def get_relations(self, keys: Iterable[str]) -> List[dict]:
+        """
+        The relations with any of the keys, by the order of the keys and without
+        duplicates. The keys must have been fetched.
+        """
+        ids = {}
+        for key in keys:
+            ids.update(self.relation_ids.get(key, {}))
+        return list(self.relations[x] for x in ids)
+
+    def update_relation(
+        self, relation_id, added_keys: Dict[str, List[str]], fields: dict
+    ):
+        """
+        Applies an $addToSet of the added keys by field and a $set of the fields to
+        the relation in the index, like the update that is written to the database.
+        """
+        relation = self.relations.get(relation_id)
+        if relation is None:
+            return
+        relation = {**relation, **fields}
+        for field, values in added_keys.items():
+            existing = list(relation.get(field) or [])
+            relation[field] = existing + list(
+                dict.fromkeys(x for x in values if x not in existing)
+            )
+        self.add_relation(relation)
+
+    def log_stats(self):
+        logging.info(
+            f"Relation index with {len(self.relations)} relations: {self.stats}"
+        )
@@ -0,0 +1,297 @@
+import logging
+from typing import Dict, Iterable, List, Mapping, Optional, Union
+
+import pydash
+from pymongo import ReplaceOne, UpdateOne
+
+from storage.bulk_writer import adaptive_bulk_write
+from storage.content_hash import get_hash
+from storage.db import chunked_iterable, get_collection
+
+# Hashes of the fields of a view document, used to only write the fields that changed
+VIEW_HASHES_FIELD = "viewHashes"
+# Fields of the offers in the view, like the $lookup of update_offer_relations_view
+VIEW_OFFER_FIELDS = (
+    "uri",
+    "pricing",
+    "siteCollection",
+    "market",
+    "href",
+    "ahref",
+    "vendorKey",
+    "dealerKey",
+    "validThrough",
+    "isRecent",
+    "mpnStock",
+    "pageviews",
+    "isPartner",
+)
+VIEW_MARKET_FIELDS = (
+    "title",
+    "subtitle",
+    "shortDescription",
+    "description",
+    "mpnCategories",
+)
+VIEW_CHUNK_SIZE = 5000
+
+
+def get_min(values: Iterable):
+    values = list(x for x in values if x is not None)
+    return min(values) if values else None
+
+
+def get_max(values: Iterable):
+    values = list(x for x in values if x is not None)
+    return max(values) if values else None
+
+
+def get_view_offer(offer: dict, size) -> dict:
+    result = dict(
+        (key, offer[key]) for key in ["_id", *VIEW_OFFER_FIELDS] if key in offer
+    )
+    price = pydash.get(offer, "pricing.price")
+    result["value"] = (
+        price / size
+        if isinstance(size, (int, float)) and size > 0 and price is not None
+        else None
+    )
+    return result
+
+
+def get_relation_view(relation: dict, offers: Iterable[dict], market: str) -> dict:
+    """
+    The document of the relation in relations_with_offers_{market}, the same as the
+    aggregation of update_offer_relations_view gives. The offers must be the recent
+    offers of the relation in the market.
+    """
+    size = pydash.get(relation, "quantity.size.standard.max")
+    view_offers = list(get_view_offer(x, size) for x in offers)
+    # Offers without price first, like a Mongo sort
+    view_offers.sort(
+        key=lambda x: (
+            pydash.get(x, "pricing.price") is not None,
+            pydash.get(x, "pricing.price") or 0,
+        )
+    )
+    result = dict(
+        (key, value)
+        for key, value in relation.items()
+        if key not in (f"m:{market}", VIEW_HASHES_FIELD)
+    )
+    result["offers"] = view_offers
+    result["priceMin"] = get_min(pydash.get(x, "pricing.price") for x in view_offers)
+    result["priceMax"] = get_max(pydash.get(x, "pricing.price") for x in view_offers)
+    result["valueMin"] = get_min(x["value"] for x in view_offers)
+    result["valueMax"] = get_max(x["value"] for x in view_offers)
+    result["validThrough"] = get_max(x.get("validThrough") for x in view_offers)
+    result["pageviews"] = sum(
+        x["pageviews"]
+        for x in view_offers
+        if isinstance(x.get("pageviews"), (int, float))
+    )
+    market_fields = relation.get(f"m:{market}") or {}
+    for key in VIEW_MARKET_FIELDS:
+        if key in market_fields:
+            result[key] = market_fields[key]
+        else:
+            result.pop(key, None)
+    return result
+
+
+def get_view_update(
+    view: dict, existing_hashes: Optional[Dict[str, str]]
+) -> Optional[Union[UpdateOne, ReplaceOne]]:
+    """
+    Sets the fields of the view that changed since it was written, and unsets the ones
+    that are gone. Returns None when nothing changed.
+    Views without hashes, which are new or were written by the aggregation of
+    update_offer_relations_view, are replaced, so no fields of the old view are kept.
+    """
+    hashes = dict((key, get_hash(value)) for key, value in view.items() if key != "_id")
+    if hashes == existing_hashes:
+        return None
+    if existing_hashes is None:
+        return ReplaceOne(
+            {"_id": view["_id"]}, {**view, VIEW_HASHES_FIELD: hashes}, upsert=True
+        )
+    update = {
+        "$set": {
+            **dict(
+                (key, view[key])
+                for key, field_hash in hashes.items()
+                if existing_hashes.get(key) != field_hash
+            ),
+            VIEW_HASHES_FIELD: hashes,
+        }
+    }
+    removed = list(key for key in existing_hashes if key not in hashes)
+    if removed:
+        update["$unset"] = dict((key, "") for key in removed)
+    return UpdateOne({"_id": view["_id"]}, update, upsert=True)
+
+
+def get_recent_offers_by_uri(uris: List[str], market: str) -> Dict[str, dict]:
+    offers_collection = get_collection("mpnoffers")
+    result = {}
+    for uri_chunk in chunked_iterable(uris, VIEW_CHUNK_SIZE):
+        for offer in offers_collection.find(
+            {"uri": {"$in": list(uri_chunk)}, "isRecent": True, "market": market},
+            dict((key, 1) for key in VIEW_OFFER_FIELDS),
+        ):
+            result[offer["uri"]] = offer
+    return result
+
+
+def update_relations_view(uris: Iterable[str], market: str) -> dict:
+    """
+    Updates relations_with_offers_{market} for the relations of the offer uris.
+    Only the relations that have one of the offers are recomputed, and only the fields
+    that changed are written. Relations whose view is unchanged are skipped.
+    """
+    relations_collection = get_collection("offerbirelations")
+    view_collection = get_collection(f"relations_with_offers_{market}")
+    result = {"nRelations": 0, "nSkipped": 0, "nWritten": 0, "nFailed": 0}
+    # Relations with offers in several chunks are only updated once
+    updated_relation_ids = set()
+    for uri_chunk in chunked_iterable(uris, VIEW_CHUNK_SIZE):
+        relations = list(
+            x
+            for x in relations_collection.find(
+                {
+                    "offerSet": {"$in": list(uri_chunk)},
+                    "relationType": "identical",
+                    "isMerged": {"$ne": True},
+                }
+            )
+            if x["_id"] not in updated_relation_ids
+        )
+        updated_relation_ids.update(x["_id"] for x in relations)
+        if not relations:
+            continue
+        offers_by_uri = get_recent_offers_by_uri(
+            list(dict.fromkeys(uri for x in relations for uri in x["offerSet"])),
+            market,
+        )
+        existing_hashes = dict(
+            (x["_id"], x.get(VIEW_HASHES_FIELD))
+            for x in view_collection.find(
+                {"_id": {"$in": list(x["_id"] for x in relations)}},
+                {VIEW_HASHES_FIELD: 1},
+            )
+        )
+        updates = []
+        for relation in relations:
+            view = get_relation_view(
+                relation,
+                (
+                    offers_by_uri[x]
+                    for x in dict.fromkeys(relation["offerSet"])
+                    if x in offers_by_uri
+                ),
+                market,
+            )
+            update = get_view_update(view, existing_hashes.get(relation["_id"]))
+            if update is not None:
+                updates.append(update)
+        write_result = adaptive_bulk_write(view_collection, updates)
+        result["nRelations"] += len(relations)
+        result["nSkipped"] += len(relations) - len(updates)
+        result["nWritten"] += len(updates) - write_result["nFailed"]
+        result["nFailed"] += write_result["nFailed"]
+    logging.info(f"Updated relations view for market {market}: {result}")
+    return result
+
+
+def get_relation_ids_by_uri(relations: Iterable[dict]) -> Dict[str, List]:
+    result = {}
+    for relation in relations:
+        for uri in dict.fromkeys(relation["offerSet"]):
+            result.setdefault(uri, []).append(relation["_id"])
+    return result
+
+
+def get_relation_pageviews(
+    relations: List[dict], offers: Iterable[dict], uri_pageviews: Mapping[str, int]
+) -> Dict[object, int]:
+    """
+    The sum of pageviews of the offers of each relation. The pageviews of
+    uri_pageviews are used instead of the ones of the offers.
+    """
+    relation_ids_by_uri = get_relation_ids_by_uri(relations)
+    result = dict((x["_id"], 0) for x in relations)
+    for offer in offers:
+        pageviews = uri_pageviews.get(offer["uri"], offer.get("pageviews"))
+        if not isinstance(pageviews, (int, float)):
+            continue
+        for relation_id in relation_ids_by_uri.get(offer["uri"], []):
+            result[relation_id] += pageviews
+    return result
+
+
+def update_relations_view_pageviews(
+    uri_pageviews: Mapping[str, int], market: str
+) -> dict:
+    """
+    Sets the pageviews sum of the relations of the offers in the view, without
+    recomputing the rest of the view documents. The sums are of the recent offers in
+    the market, like in get_relation_view, with the pageviews of uri_pageviews.
+    The offers in the view keep their pageviews until the next update_relations_view.
+    Relations without a view document, or with one that has no hashes yet, are left
+    to update_relations_view.
+    """
+    relations_collection = get_collection("offerbirelations")
+    offers_collection = get_collection("mpnoffers")
+    view_collection = get_collection(f"relations_with_offers_{market}")
+    updates = []
+    updated_relation_ids = set()
+    for uri_chunk in chunked_iterable(uri_pageviews.keys(), VIEW_CHUNK_SIZE):
+        relations = list(
+            x
+            for x in relations_collection.find(
+                {
+                    "offerSet": {"$in": list(uri_chunk)},
+                    "relationType": "identical",
+                    "isMerged": {"$ne": True},
+                },
+                {"offerSet": 1},
+            )
+            if x["_id"] not in updated_relation_ids
+        )
+        updated_relation_ids.update(x["_id"] for x in relations)
+        offer_uris = list(
+            dict.fromkeys(uri for x in relations for uri in x["offerSet"])
+        )
+        offers = (
+            offer
+            for offer_uri_chunk in chunked_iterable(offer_uris, VIEW_CHUNK_SIZE)
+            for offer in offers_collection.find(
+                {
+                    "uri": {"$in": list(offer_uri_chunk)},
+                    "isRecent": True,
+                    "market": market,
+                },
+                {"uri": 1, "pageviews": 1, "_id": 0},
+            )
+        )
+
+        updates.extend(
+            UpdateOne(
+                {"_id": relation_id, VIEW_HASHES_FIELD: {"$exists": True}},
+                {
+                    "$set": {
+                        "pageviews": pageviews,
+                        f"{VIEW_HASHES_FIELD}.pageviews": get_hash(pageviews),
+                    }
+                },
+            )
+            for relation_id, pageviews in get_relation_pageviews(
+                relations, offers, uri_pageviews
+            ).items()
+        )
+
+    write_result = adaptive_bulk_write(view_collection, updates, ordered=False)
+    result = pydash.pick(write_result, ["nMatched", "nModified", "nFailed"])
+    result["nRelations"] = len(updates)
+    logging.info(f"Updated relations view pageviews for market {market}: {result}")
+    return result
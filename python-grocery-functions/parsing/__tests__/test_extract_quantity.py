@@ -5,6 +5,8 @@ from parsing.quantity_extraction import (
     extract_quantity,
     standardize_quantity,
     analyze_quantity,
+    parse_quantity,
+    tokenize_quantity_string,
 )
 
 
@@ -64,6 +66,35 @@ class TestExtractQuantity(TestCase):
         print(actual)
 
 
+class TestQuantityTokens(TestCase):
+    def test_tokenize_quantity_string(self):
+        actual = tokenize_quantity_string("homestyle 4x130g kr 180,77/kg 2 pk")
+        self.assertEqual(
+            actual, (("x", 4.0), ("g", 130.0), ("/kg", 180.77), (None, None))
+        )
+
+    def test_parse_quantity_with_token_cache(self):
+        token_cache = {}
+        strings = ["Homestyle 4x130g", "kr 180,77/kg"]
+        actual = parse_quantity(strings, token_cache=token_cache)
+        self.assertDictEqual(actual, parse_quantity(strings))
+        self.assertIn("homestyle 4x130g", token_cache)
+        self.assertEqual(pydash.get(actual, "quantity.size.amount.min"), 520)
+        self.assertEqual(pydash.get(actual, "value.size.amount.min"), 180.77)
+
+        # Multipliers must not leak into the cached tokens
+        again = parse_quantity(strings, token_cache=token_cache)
+        self.assertDictEqual(again, actual)
+
+    def test_parse_quantity_returns_copies_of_cached_results(self):
+        first = parse_quantity(["500 g"], ["kg"])
+        first["quantity"]["size"]["amount"]["min"] = 1
+        first["quantity"]["size"]["unit"]["si"]["factor"] = 2
+        second = parse_quantity(["500 G"], ["kg"])
+        self.assertEqual(pydash.get(second, "quantity.size.amount.min"), 500)
+        self.assertEqual(pydash.get(second, "quantity.size.unit.si.factor"), 0.001)
+
+
 class TestAnalyzeQuantity(TestCase):
     def test_basic_without_size(self):
         offer = {
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from parsing.ingredient_matcher import AhoCorasick, IngredientMatcher
+from parsing.ingredients_extraction import (
+    get_extracted_ingredients,
+    sort_db_ingredient_key,
+)
+
+
+ingredient_documents = [
+    {"key": "salt", "patterns": [r"\bsalt\b"]},
+    {"key": "seaSalt", "patterns": ["havsalt", "sea salt"]},
+    {"key": "starch", "patterns": ["stivelse"]},
+    {"key": "modifiedStarch", "patterns": ["modifisert stivelse"]},
+    {"key": "palmOil", "patterns": [r"palm(e)?olje", "palm oil"]},
+    {"key": "sugar", "patterns": ["sukker"]},
+    {"key": "e330", "eNumber": "e330", "patterns": ["sitronsyre"]},
+    {"key": "citricAcid", "eNumber": "e330", "patterns": []},
+]
+ingredients_data = {
+    x["key"]: x for x in sorted(ingredient_documents, key=sort_db_ingredient_key)
+}
+
+
+class TestAhoCorasick(TestCase):
+    def test_search(self):
+        automaton = AhoCorasick()
+        for i, pattern in enumerate(["he", "she", "his", "hers"]):
+            automaton.add(pattern, i)
+        automaton.build()
+        self.assertSetEqual(automaton.search("ushers"), {0, 1, 3})
+        self.assertSetEqual(automaton.search("xyz"), set())
+
+
+class TestIngredientMatcher(TestCase):
+    def setUp(self):
+        self.matcher = IngredientMatcher(ingredients_data)
+
+    def test_match_in_ingredient_order(self):
+        actual = self.matcher.match("Modifisert stivelse")
+        self.assertListEqual(actual, ["modifiedStarch", "starch"])
+
+    def test_match_regex_patterns(self):
+        self.assertListEqual(self.matcher.match("Palmeolje"), ["palmOil"])
+        self.assertListEqual(self.matcher.match("havsalt"), ["seaSalt"])
+        self.assertListEqual(self.matcher.match("Salt"), ["salt"])
+
+    def test_e_number_index_uses_first_ingredient(self):
+        self.assertEqual(self.matcher.get_key_for_e_number("e330"), "e330")
+        self.assertIsNone(self.matcher.get_key_for_e_number("e999"))
+
+    def test_get_extracted_ingredients_with_matcher(self):
+        raw_ingredients = ["sukker", "havsalt", "syre (E 330)", "farge (E150b)"]
+        actual = get_extracted_ingredients(
+            raw_ingredients, ingredients_data, self.matcher
+        )
+        self.assertListEqual(list(actual.keys()), ["sugar", "seaSalt", "e330"])
+        self.assertDictEqual(
+            actual, get_extracted_ingredients(raw_ingredients, ingredients_data)
+        )
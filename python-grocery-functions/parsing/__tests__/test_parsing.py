@@ -152,6 +152,28 @@ class ExtractUnit(TestCase):
         actual = extract_unit(string)
         self.assertDictContainsSubset(expected, actual)
 
+    def test_with_alt_unit_value(self):
+        string = "kr/liter"
+        expected = dict(
+            symbol="l",
+            type=unit_types.QUANTITY_VALUE,
+            si=dict(symbol="l", factor=1),
+        )
+        actual = extract_unit(string)
+        self.assertDictEqual(actual, expected)
+
+    def test_with_piece_value_with_currency(self):
+        string = "kr/flaske"
+        expected = dict(symbol="flaske", type=unit_types.PIECE_VALUE)
+        actual = extract_unit(string)
+        self.assertDictEqual(actual, expected)
+
+    def test_prefers_longest_unit(self):
+        actual = extract_unit("kilogram")
+        self.assertEqual(actual["symbol"], "kg")
+        actual = extract_unit("ltr")
+        self.assertEqual(actual["symbol"], "l")
+
 
 class ExtractNumbersWithContext(TestCase):
     def test_basic(self):
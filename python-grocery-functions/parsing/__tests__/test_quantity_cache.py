@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from parsing.parsing import extract_unit, unit_cache
+from parsing.quantity_extraction import parse_quantity, quantity_cache
+from parsing.quantity_extraction_throughput import (
+    parse_quantity_uncached,
+    quantity_strings,
+    unit_strings,
+)
+
+
+class TestQuantityCache(TestCase):
+    def setUp(self):
+        quantity_cache.clear()
+        unit_cache.clear()
+
+    def test_extract_unit_hits(self):
+        expected = list(extract_unit(x) for x in unit_strings)
+        self.assertEqual(unit_cache.misses, len(unit_strings))
+        self.assertEqual(list(extract_unit(x) for x in unit_strings), expected)
+        self.assertEqual(unit_cache.hits, len(unit_strings))
+
+    def test_parse_quantity_hits(self):
+        for string in quantity_strings:
+            parse_quantity([string])
+        self.assertEqual(quantity_cache.misses, len(quantity_strings))
+        for string in quantity_strings:
+            parse_quantity([string.upper()])
+        self.assertEqual(quantity_cache.hits, len(quantity_strings))
+
+    def test_cached_same_as_uncached(self):
+        expected = list(parse_quantity_uncached(x) for x in quantity_strings)
+        for string in quantity_strings:
+            parse_quantity([string])
+        self.assertEqual(list(parse_quantity([x]) for x in quantity_strings), expected)
@@ -0,0 +1,133 @@
+import re
+import logging
+from typing import Dict, Iterable, List, Mapping, Optional, Set
+
+from amp_types.amp_product import IngredientType
+
+# Patterns without any of these characters are matched as plain text.
+regex_special_characters = re.compile(r"[.^$*+?{}\[\]\\|()]")
+group_reference = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class AhoCorasick:
+    """
+    Finds which of many literal patterns occur in a string in a single pass over the string.
+    Each pattern is stored with a value, and search returns the values of all patterns found.
+    """
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Set[int]] = [set()]
+
+    def add(self, pattern: str, value: int):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+            state = next_state
+        self.output[state].add(value)
+
+    def build(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] |= self.output[self.fail[next_state]]
+        return self
+
+    def search(self, string: str) -> Set[int]:
+        result = set(self.output[0])
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for char in string:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                result |= output[state]
+        return result
+
+
+class IngredientMatcher:
+    """
+    Matches raw ingredient strings against all ingredient patterns at once.
+    Built once per handle run from the ingredient documents, in the order of ingredients_data,
+    which is sorted with the longest patterns first by sort_db_ingredient_key.
+    """
+
+    def __init__(self, ingredients_data: Mapping[str, IngredientType]):
+        self.keys: List[str] = list(ingredients_data.keys())
+        self.e_number_index: Dict[str, str] = {}
+        self.literals = AhoCorasick()
+        self.regexes: List[tuple] = []
+
+        for i, (key, ingredient) in enumerate(ingredients_data.items()):
+            e_number = ingredient.get("eNumber")
+            if e_number and e_number not in self.e_number_index:
+                self.e_number_index[e_number] = key
+
+            regex_patterns = []
+            for pattern in ingredient.get("patterns", []) or []:
+                if regex_special_characters.search(pattern):
+                    regex_patterns.append(pattern)
+                else:
+                    self.literals.add(pattern.lower(), i)
+            if regex_patterns:
+                self.regexes.append((i, compile_patterns(regex_patterns)))
+        self.literals.build()
+
+        # A match of the combined regex is required for any of the regex patterns to match,
+        # so strings without one skip the per ingredient regexes.
+        self.regex_gate = compile_patterns(
+            list(
+                pattern
+                for x in ingredients_data.values()
+                for pattern in x.get("patterns", []) or []
+                if regex_special_characters.search(pattern)
+            )
+        )
+
+    def get_key_for_e_number(self, e_number: str) -> Optional[str]:
+        return self.e_number_index.get(e_number)
+
+    def match(self, string: str) -> List[str]:
+        """
+        Returns the keys of all ingredients with a pattern found in the string, in ingredient order.
+        """
+        matches = self.literals.search(string.lower())
+        if self.regexes and any(x.search(string) for x in self.regex_gate):
+            for i, patterns in self.regexes:
+                if i not in matches and any(x.search(string) for x in patterns):
+                    matches.add(i)
+        return list(self.keys[i] for i in sorted(matches))
+
+
+def compile_patterns(patterns: Iterable[str]) -> List[re.Pattern]:
+    """
+    Compiles the patterns into one case insensitive alternation, or one regex per pattern
+    if they can't be combined, e.g. when they use group references.
+    """
+    patterns = list(patterns)
+    if not patterns:
+        return []
+    if any(group_reference.search(x) for x in patterns):
+        return list(re.compile(x, re.IGNORECASE) for x in patterns)
+    try:
+        return [
+            re.compile(r"|".join(f"(?:{x})" for x in patterns), re.IGNORECASE),
+        ]
+    except re.error:
+        logging.debug(f"Could not combine ingredient patterns {patterns}")
+        return list(re.compile(x, re.IGNORECASE) for x in patterns)
@@ -3,15 +3,19 @@ import json
 import os
 import logging
 import pydash
-from typing import Iterable, List
+from typing import Iterable, List, Optional
 from typing import Mapping
 
 from transform.offer import get_field_from_scraper_offer
 from amp_types.amp_product import HandleConfig, ScraperOffer, IngredientType
+from parsing.ingredient_matcher import IngredientMatcher
+
+e_number_pattern = re.compile(r"[Ee]\d{3,4}[a-z]?")
+whitespace_pattern = re.compile(r"\s")
 
 
 def extract_e_number(string: str):
-    matches = re.findall(r"[Ee]\d{3,4}[a-z]?", re.sub(r"\s", "", string))
+    matches = e_number_pattern.findall(whitespace_pattern.sub("", string))
     if matches:
         return str.lower(matches[0])
     else:
@@ -32,32 +36,36 @@ def extract_individual_ingredients(raw_ingredients: str) -> List[str]:
     return raw_ingredients.split(", ")
 
 
+def get_ingredients_matcher(
+    ingredients_data: Mapping[str, IngredientType]
+) -> IngredientMatcher:
+    return IngredientMatcher(ingredients_data)
+
+
 def get_extracted_ingredients(
-    raw_ingredients: Iterable[str], ingredients_data: Mapping[str, IngredientType]
+    raw_ingredients: Iterable[str],
+    ingredients_data: Mapping[str, IngredientType],
+    ingredients_matcher: Optional[IngredientMatcher] = None,
 ):
+    if ingredients_matcher is None:
+        ingredients_matcher = get_ingredients_matcher(ingredients_data)
     result = {}
     for string in raw_ingredients:
         e_number = extract_e_number(string)
         if e_number:
-            database_e_number = next(
-                (x for x in ingredients_data.values() if x.get("eNumber") == e_number),
-                None,
-            )
-            if not database_e_number:
+            e_number_key = ingredients_matcher.get_key_for_e_number(e_number)
+            if not e_number_key:
                 continue
-            result[database_e_number["key"]] = {
+            result[e_number_key] = {
                 "text": string,
-                "key": database_e_number["key"],
+                "key": e_number_key,
             }
             continue
-        for config_key, config in ingredients_data.items():
-            for pattern in config.get("patterns", []):
-                if re.findall(re.compile(pattern, re.IGNORECASE), string):
-                    result[config_key] = {
-                        "text": string,
-                        "key": config_key,
-                    }
-                    break
+        for config_key in ingredients_matcher.match(string):
+            result[config_key] = {
+                "text": string,
+                "key": config_key,
+            }
     return result
 
 
@@ -65,6 +73,7 @@ def get_ingredients_data(
     offer: ScraperOffer,
     config: HandleConfig,
     ingredients_data: Mapping[str, IngredientType],
+    ingredients_matcher: Optional[IngredientMatcher] = None,
 ):
     raw_ingredients_fields: List[str] = []
     for key in config["extractIngredientsFields"]:
@@ -79,7 +88,7 @@ def get_ingredients_data(
         raw_ingredients_values.extend(extract_individual_ingredients(raw_ingredients))
 
     extracted_ingredients = get_extracted_ingredients(
-        raw_ingredients_values, ingredients_data
+        raw_ingredients_values, ingredients_data, ingredients_matcher
     )
 
     processed_score = 0
@@ -1,4 +1,5 @@
 from amp_types.quantity_types import MpnUnit
+import os
 import re
 import logging
 from typing import Optional
@@ -14,6 +15,74 @@ from parsing.constants import (
     alt_unit_map,
 )
 from parsing.enums import unit_types
+from util.cache import LruCache
+
+
+number_pattern = re.compile(r"(\d+(?:[,\.\:]\d+)?)", re.A)
+
+known_prefix_units = frozenset(["x"])
+known_suffix_units = frozenset(
+    [
+        *piece_units,
+        *quantity_units,
+        *quantity_value_units,
+        *piece_value_units,
+        "x",
+    ]
+)
+
+quantity_unit_search_pattern = re.compile(
+    r"({})".format(r"|".join(re.escape(x) for x in quantity_units))
+)
+piece_unit_search_pattern = re.compile(
+    r"({})".format(r"|".join(re.escape(x) for x in piece_units))
+)
+
+
+def _build_unit_table():
+    """
+    Resolves every known unit string to its unit once, in the same priority as the
+    checks in extract_unit: quantity, quantity value, piece and then piece value units.
+    """
+    table = {}
+    for unit in quantity_units:
+        symbol = alt_unit_map.get(unit, unit)
+        table.setdefault(unit, (symbol, unit_types.QUANTITY, True))
+    for unit in quantity_value_units:
+        symbol = quantity_unit_search_pattern.search(unit).group(0).replace("/", "")
+        symbol = alt_unit_map.get(symbol, symbol)
+        table.setdefault(unit, (symbol, unit_types.QUANTITY_VALUE, True))
+    for unit in piece_units:
+        table.setdefault(unit, (unit, unit_types.PIECE, False))
+    for unit in piece_value_units:
+        symbol = piece_unit_search_pattern.search(unit).group(0).replace("/", "")
+        table.setdefault(unit, (symbol, unit_types.PIECE_VALUE, False))
+    return table
+
+
+unit_table = _build_unit_table()
+
+# Alternatives are ordered by unit type priority and then by length, so the first
+# alternative matching at the start of a string is the same unit extract_unit used to find
+# with one regex per unit type.
+unit_pattern = re.compile(
+    r"^(?:{})".format(
+        r"|".join(
+            re.escape(x)
+            for x in (
+                *quantity_units,
+                *quantity_value_units,
+                *piece_units,
+                *piece_value_units,
+            )
+        )
+    )
+)
+
+
+# Unit strings repeat across every offer in a feed, so their parsed units are kept between calls.
+unit_cache = LruCache(int(os.getenv("UNIT_CACHE_SIZE", 1024)))
+_missing = object()
 
 
 def extract_number(string: str) -> Optional[float]:
@@ -34,10 +103,7 @@ def extract_numbers_with_context(string: str) -> Optional[list]:
     Finds numbers and returns a list of tuples with the number and its prefix and suffix.
     TODO Support different decimal separators such as "," or ":"
     """
-    number_pattern = r"(\d+(?:[,\.\:]\d+)?)"
-    compiled_number_pattern = re.compile(number_pattern, re.A)
-    number_matches = re.finditer(number_pattern, string)
-    number_matches = list(number_matches)
+    number_matches = list(number_pattern.finditer(string))
     result = list(
         [string[: x.span(0)[0]], x.group(0), string[x.span(0)[1] :]]
         for x in number_matches
@@ -49,16 +115,6 @@ def extract_units_from_number_context(context: list) -> list:
     """
     Extracts likely and known units from numbers.
     """
-    known_prefixes = [
-        {"symbol": "x"},
-    ]
-    known_suffixes = [
-        *list({"symbol": x} for x in piece_units),
-        *list({"symbol": x} for x in quantity_units),
-        *list({"symbol": x} for x in quantity_value_units),
-        *list({"symbol": x} for x in piece_value_units),
-        {"symbol": "x"},
-    ]
     prefix, number, suffix = context
     prefix = re.sub(r" $", "", prefix)
     suffix = re.sub(r"^ ", "", suffix)
@@ -67,16 +123,12 @@ def extract_units_from_number_context(context: list) -> list:
     suffix_unit = re.split(r" ", suffix)[0]
     suffix_unit = re.sub(r"[^a-zA-Z/]", "", suffix_unit)
     result = {}
-    for x in known_prefixes:
-        if prefix_unit == x["symbol"]:
-            result["unit"] = x["symbol"]
-            result["value"] = float(format_number(number))
-            break
-    for x in known_suffixes:
-        if suffix_unit == x["symbol"]:
-            result["unit"] = x["symbol"]
-            result["value"] = float(format_number(number))
-            break
+    if prefix_unit in known_prefix_units:
+        result["unit"] = prefix_unit
+        result["value"] = float(format_number(number))
+    if suffix_unit in known_suffix_units:
+        result["unit"] = suffix_unit
+        result["value"] = float(format_number(number))
 
     # Handle cases like 4x130g. Get the x as a unit even though there are no spaces.
     if not result.get("unit") and pydash.get(suffix_unit, "0") == "x":
@@ -124,53 +176,38 @@ def format_number(string: str, loader_context: dict = dict()) -> Optional[str]:
 
 
 def extract_unit(string: str) -> Optional[MpnUnit]:
-    string = string.lower()
-    quantity_unit_pattern = r"^({})".format(r"|".join(quantity_units))
-    quantity_unit_matches = re.findall(quantity_unit_pattern, string)
-    if quantity_unit_matches:
-        unit = quantity_unit_matches[0]
-        unit = alt_unit_map[unit] if unit in alt_unit_map.keys() else unit
-        return dict(symbol=unit, type=unit_types.QUANTITY, si=get_si(unit))
-
-    quantity_value_pattern = r"^({})".format(r"|".join(quantity_value_units))
-    quantity_value_matches = re.findall(quantity_value_pattern, string)
-    if quantity_value_matches:
-        unit = extract_quantity_unit(quantity_value_matches[0])
-        unit = unit.replace("/", "")
-        unit = alt_unit_map[unit] if unit in alt_unit_map.keys() else unit
-        return dict(symbol=unit, type=unit_types.QUANTITY_VALUE, si=get_si(unit))
-
-    piece_unit_pattern = r"^({})".format(r"|".join(piece_units))
-    piece_unit_matches = re.findall(piece_unit_pattern, string)
-    if piece_unit_matches:
-        unit = piece_unit_matches[0]
-        return dict(symbol=unit, type=unit_types.PIECE)
+    unit = unit_cache.get(string, _missing)
+    if unit is _missing:
+        unit = _extract_unit(string)
+        unit_cache.put(string, unit)
+    return dict(unit) if unit else unit
+
 
-    piece_value_pattern = r"^({})".format(r"|".join(piece_value_units))
-    piece_value_matches = re.findall(piece_value_pattern, string)
-    if piece_value_matches:
-        unit = extract_piece_unit(piece_value_matches[0])
-        unit = unit.replace("/", "")
-        return dict(symbol=unit, type=unit_types.PIECE_VALUE)
+def _extract_unit(string: str) -> Optional[MpnUnit]:
+    string = string.lower()
+    unit_match = unit_pattern.match(string)
+    if unit_match:
+        symbol, unit_type, has_si = unit_table[unit_match.group(0)]
+        if has_si:
+            return dict(symbol=symbol, type=unit_type, si=get_si(symbol))
+        return dict(symbol=symbol, type=unit_type)
 
     if string == "x":
         return dict(symbol="x", type=unit_types.MULTIPLIER)
 
 
 def extract_quantity_unit(string: str) -> Optional[str]:
-    quantity_unit_pattern = r"({})".format(r"|".join(quantity_units))
-    quantity_unit_matches = re.findall(quantity_unit_pattern, string)
+    quantity_unit_matches = quantity_unit_search_pattern.findall(string)
     if quantity_unit_matches:
         return quantity_unit_matches[0]
 
 
 def extract_piece_unit(string: str) -> Optional[str]:
-    piece_unit_pattern = r"({})".format(r"|".join(piece_units))
-    piece_unit_matches = re.findall(piece_unit_pattern, string)
+    piece_unit_matches = piece_unit_search_pattern.findall(string)
     if piece_unit_matches:
         return piece_unit_matches[0]
 
 
 def get_si(unit: str) -> Optional[dict]:
-    unit = alt_unit_map[unit] if unit in alt_unit_map.keys() else unit
-    return si_mappings[unit] if unit in si_mappings.keys() else None
+    unit = alt_unit_map.get(unit, unit)
+    return si_mappings.get(unit)
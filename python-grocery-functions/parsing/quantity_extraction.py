@@ -1,10 +1,11 @@
 import logging
 import json
+import os
 from util.utils import log_traceback
 
 from transform.offer import get_field_from_scraper_offer
 from amp_types.amp_product import MpnOffer
-from typing import List
+from typing import Dict, List, Optional, Tuple
 import pydash
 import re
 
@@ -12,8 +13,10 @@ from parsing.parsing import (
     extract_numbers_with_context,
     extract_unit,
     extract_units_from_number_context,
+    unit_cache,
 )
 from parsing.enums import unit_types
+from util.cache import LruCache
 from amp_types.amp_product import MpnOffer, ScraperOffer, HandleConfig
 from amp_types.quantity_types import (
     Quantity,
@@ -25,9 +28,49 @@ from amp_types.quantity_types import (
 from parsing.constants import (
     quantity_units,
     piece_units,
-    alt_unit_map,
 )
 
+# A number found in a quantity string, as (unit, value). Numbers without a known unit are
+# kept as (None, None) so multipliers are applied to the same neighbours as before.
+QuantityToken = Tuple[Optional[str], Optional[float]]
+QuantityTokenCache = Dict[str, Tuple[QuantityToken, ...]]
+
+# Parsed quantities keyed on the lowercased strings and safe units. Many offers in a feed share
+# the same quantity strings, and the cache lives as long as the (warm) Lambda container.
+quantity_cache = LruCache(int(os.getenv("QUANTITY_CACHE_SIZE", 8192)))
+
+
+def get_quantity_cache_stats() -> dict:
+    return {
+        "parseQuantity": quantity_cache.stats(),
+        "extractUnit": unit_cache.stats(),
+    }
+
+
+def reset_quantity_cache_stats():
+    quantity_cache.reset_stats()
+    unit_cache.reset_stats()
+
+
+def add_quantity_cache_stats(stats: dict):
+    """
+    Adds the hits and misses of get_quantity_cache_stats from another process, e.g. a
+    transform worker, to the counters of this process.
+    """
+    for cache, key in ((quantity_cache, "parseQuantity"), (unit_cache, "extractUnit")):
+        cache.hits += stats[key]["hits"]
+        cache.misses += stats[key]["misses"]
+
+
+def copy_parsed_quantity(value):
+    """
+    Copies the nested dicts of a parsed quantity. Cached results are shared between offers,
+    while handle_multipliers, analyze_quantity and standardize_quantity change dicts in place.
+    """
+    if type(value) is dict:
+        return {k: copy_parsed_quantity(v) for k, v in value.items()}
+    return value
+
 
 def get_standard_si_amount(si_config: SiConfig, value: float, invert=False):
     return (
@@ -66,7 +109,9 @@ def get_value_from_quantity(offer: MpnOffer, quantity: Quantity) -> Quantity:
     return result
 
 
-def analyze_quantity(offer: MpnOffer) -> MpnOffer:
+def analyze_quantity(
+    offer: MpnOffer, token_cache: Optional[QuantityTokenCache] = None
+) -> MpnOffer:
     # Use price unit as size when the product price is denominated as a unit.
     price_unit_string: str = offer["pricing"].get("priceUnit")
     if price_unit_string:
@@ -86,7 +131,7 @@ def analyze_quantity(offer: MpnOffer) -> MpnOffer:
             offer, ["quantity", "size", "unit", "symbol"]
         ) in ["stk", "pcs"]:
             unit_string = f"{pydash.get(offer, ['pricing', 'price']) / offer.get('altPrice')}{offer.get('altPriceUnit')}"
-            quantity = parse_quantity([unit_string])
+            quantity = parse_quantity([unit_string], token_cache=token_cache)
             offer["quantity"] = quantity["quantity"]
 
     size_amount = pydash.get(offer, ["quantity", "size", "amount"])
@@ -120,51 +165,90 @@ def analyze_quantity(offer: MpnOffer) -> MpnOffer:
     return offer
 
 
-def parse_quantity(strings: List[str], safe_units=None) -> ExtractQuantityReturnType:
+def parse_quantity(
+    strings: List[str],
+    safe_units=None,
+    token_cache: Optional[QuantityTokenCache] = None,
+) -> ExtractQuantityReturnType:
     """Returns a dict describing the quantity and value with unitsextracted from strings.
     Quantity can be denominated in both size (kg, l, grams, etc.) or pieces (packs, bags, etc.)
     It also extracts value which is price divided by quantity. It does this only by parsing text, not by using the price then dividing it by the extracted quantity.
+    Pass the same token_cache for all calls on one offer to scan each string only once.
     """
 
     # TODO Also support extracting number of items. E.g. sometimes an offer describes a buy one get one free, or buy 4 for 50,00,-. The extracting currently doesn't realize this.
 
     _strings = list(s.lower() for s in strings)
+    cache_key = (tuple(_strings), tuple(safe_units) if safe_units else None)
+    parsed_quantity = quantity_cache.get(cache_key)
+    if parsed_quantity is None:
+        tokens = get_quantity_tokens(_strings, token_cache)
 
-    quantity = extract_quantity(_strings, safe_units)
-    value = extract_value(_strings, safe_units)
-    items = extract_items(_strings)
+        quantity = extract_quantity_from_tokens(tokens, safe_units)
+        value = extract_value_from_tokens(tokens, safe_units)
+        items = extract_items(_strings)
 
-    return dict(quantity=quantity, value=value, items=items)
+        parsed_quantity = dict(quantity=quantity, value=value, items=items)
+        quantity_cache.put(cache_key, parsed_quantity)
 
+    return copy_parsed_quantity(parsed_quantity)
 
-def extract_quantity(strings: List[str], safe_units=None) -> QuantityField:
-    extracted_strings = []
-    for string in strings:
-        context = extract_numbers_with_context(string)
-        extracted_numbers = (
-            pydash.chain(context).map(extract_units_from_number_context).value()
+
+def tokenize_quantity_string(string: str) -> Tuple[QuantityToken, ...]:
+    return tuple(
+        (number["unit"], number["value"]) if number else (None, None)
+        for number in map(
+            extract_units_from_number_context, extract_numbers_with_context(string)
         )
-        extracted_numbers = handle_multipliers(extracted_numbers)
-        extracted_strings.append(extracted_numbers)
+    )
+
+
+def get_quantity_tokens(
+    strings: List[str], token_cache: Optional[QuantityTokenCache] = None
+) -> List[Tuple[QuantityToken, ...]]:
+    if token_cache is None:
+        return list(tokenize_quantity_string(string) for string in strings)
+    result = []
+    for string in strings:
+        tokens = token_cache.get(string)
+        if tokens is None:
+            tokens = tokenize_quantity_string(string)
+            token_cache[string] = tokens
+        result.append(tokens)
+    return result
+
+
+def extract_quantity(strings: List[str], safe_units=None) -> QuantityField:
+    return extract_quantity_from_tokens(get_quantity_tokens(strings), safe_units)
+
+
+def extract_quantity_from_tokens(
+    tokens: List[Tuple[QuantityToken, ...]], safe_units=None
+) -> QuantityField:
     size = {}
     pieces = {}
-    for string in extracted_strings:
-        for i, number in enumerate(x for x in string if x):
-            unit = number.get("unit")
-            unit = alt_unit_map[unit] if unit in alt_unit_map.keys() else unit
-            unit = extract_unit(unit)
+    for string_tokens in tokens:
+        extracted_numbers = handle_multipliers(
+            list(
+                {"unit": unit, "value": value} if unit else {}
+                for unit, value in string_tokens
+            )
+        )
+        for number in extracted_numbers:
+            if not number:
+                continue
+            unit = extract_unit(number["unit"])
 
             if unit["type"] not in (unit_types.QUANTITY, unit_types.PIECE):
                 continue
             if unit["symbol"] in quantity_units:
                 if safe_units and unit["si"]["symbol"] not in safe_units:
                     continue
-                size_value = number.get("value")
+                size_value = number["value"]
                 size_amount = dict(min=size_value, max=size_value)
                 size = dict(unit=unit, amount=size_amount)
-                result = dict(size=size, pieces=dict())
             elif unit["symbol"] in piece_units:
-                pieces_value = number.get("value")
+                pieces_value = number["value"]
                 pieces_amount = dict(min=pieces_value, max=pieces_value)
                 pieces = dict(unit=unit, amount=pieces_amount)
 
@@ -173,24 +257,22 @@ def extract_quantity(strings: List[str], safe_units=None) -> QuantityField:
 
 
 def extract_value(strings: List[str], safe_units=None) -> QuantityField:
-    extracted_strings = []
-    for string in strings:
-        context = extract_numbers_with_context(string)
-        extracted_numbers = (
-            pydash.chain(context)
-            .map(extract_units_from_number_context)
-            .filter(lambda x: not not x)
-            .value()
-        )
-        extracted_numbers = handle_multipliers(extracted_numbers)
+    return extract_value_from_tokens(get_quantity_tokens(strings), safe_units)
 
-        extracted_strings.append(extracted_numbers)
 
+def extract_value_from_tokens(
+    tokens: List[Tuple[QuantityToken, ...]], safe_units=None
+) -> QuantityField:
     size = {}
     pieces = {}
-    for string in extracted_strings:
-        for i, number in enumerate(string):
-            unit = extract_unit(number.get("unit"))
+    for string_tokens in tokens:
+        extracted_numbers = handle_multipliers(
+            list(
+                {"unit": unit, "value": value} for unit, value in string_tokens if unit
+            )
+        )
+        for number in extracted_numbers:
+            unit = extract_unit(number["unit"])
             if safe_units and unit["symbol"] not in safe_units:
                 continue
             if unit["type"] not in (unit_types.QUANTITY_VALUE, unit_types.PIECE_VALUE):
@@ -198,12 +280,11 @@ def extract_value(strings: List[str], safe_units=None) -> QuantityField:
             if unit["symbol"] in quantity_units:
                 if safe_units and unit["si"]["symbol"] not in safe_units:
                     continue
-                size_value = number.get("value")
+                size_value = number["value"]
                 size_amount = dict(min=size_value, max=size_value)
                 size = dict(unit=unit, amount=size_amount)
-                result = dict(size=size, pieces=dict())
             elif unit["symbol"] in piece_units:
-                pieces_value = number.get("value")
+                pieces_value = number["value"]
                 pieces_amount = dict(min=pieces_value, max=pieces_value)
                 pieces = dict(unit=unit, amount=pieces_amount)
 
@@ -232,8 +313,14 @@ def extract_items(strings: List[str]) -> ItemsField:
     return dict(max=1, min=1)
 
 
-def parse_explicit_quantity(offer: ScraperOffer, config: HandleConfig):
-    parsed_quantity = parse_quantity(get_explicit_quantity_strings(offer, config))
+def parse_explicit_quantity(
+    offer: ScraperOffer,
+    config: HandleConfig,
+    token_cache: Optional[QuantityTokenCache] = None,
+):
+    parsed_quantity = parse_quantity(
+        get_explicit_quantity_strings(offer, config), token_cache=token_cache
+    )
     return {
         k: v
         for k, v in parsed_quantity.items()
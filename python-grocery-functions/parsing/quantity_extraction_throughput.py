@@ -0,0 +1,68 @@
+"""
+Measures how many strings per second the quantity parser handles.
+Run with python -m parsing.quantity_extraction_throughput
+"""
+
+import time
+
+from parsing.parsing import extract_unit, unit_cache
+from parsing.quantity_extraction import parse_quantity, quantity_cache
+
+unit_strings = [
+    "g",
+    "kg",
+    "gram",
+    "liter",
+    "ml",
+    "/kg",
+    "kr/kg",
+    "kr/l",
+    "stk",
+    "/stk",
+    "flaske",
+    "x",
+    "pk",
+    "stkarielcolor",
+]
+
+quantity_strings = [
+    "225 ml",
+    "m/Sjokolade 21g United Bakeries",
+    "0,5l boks",
+    "Gilde 4x130g",
+    "Pris 59,90 kr/kg",
+    "6 stk",
+    "1 liter melk",
+    "200 g Fra 150,00/kg. 1 pose 39,90",
+    "Lambi tørke-/toalettpapir 4/8 pk. Pr 100 m fra 20,53",
+    "1,5lx8 flaske",
+]
+
+
+def get_strings_per_second(f, strings, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for string in strings:
+            f(string)
+    return len(strings) * rounds / (time.perf_counter() - start)
+
+
+def parse_quantity_uncached(string):
+    quantity_cache.clear()
+    unit_cache.clear()
+    return parse_quantity([string])
+
+
+def main():
+    result = get_strings_per_second(extract_unit, unit_strings, 2000)
+    print(f"extract_unit: {int(result)} strings per second")
+    result = get_strings_per_second(
+        lambda x: parse_quantity([x]), quantity_strings, 200
+    )
+    print(f"parse_quantity: {int(result)} strings per second")
+    result = get_strings_per_second(parse_quantity_uncached, quantity_strings, 50)
+    print(f"parse_quantity without cache: {int(result)} strings per second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+from datetime import datetime, timedelta
+from unittest import TestCase, mock
+
+import bson
+
+from scraper_feed.compact_price_history import (
+    add_price_to_compact_history,
+    create_price_window_from_compact_history,
+    decode_price_history,
+    encode_price_history,
+)
+from scraper_feed.migrate_price_histories import (
+    get_migration_update,
+    migrate_price_histories,
+)
+from scraper_feed.pricing_history import (
+    create_price_window,
+    get_price_difference_update_set,
+)
+
+
+def get_daily_history(n_days, end_date):
+    return list(
+        {
+            "price": [19.9, 24.5, 1234.99][day % 3],
+            "date": (end_date - timedelta(days=day)).strftime("%Y-%m-%d"),
+        }
+        for day in range(n_days)
+        if day % 7 != 3
+    )
+
+
+class TestCompactPriceHistory(TestCase):
+    def setUp(self):
+        self.history = [
+            {"price": 18, "date": "2022-04-28"},
+            {"price": 19.9, "date": "2022-05-02"},
+            {"price": 20.45, "date": "2022-05-12"},
+            {"price": 1299.99, "date": "2022-05-20"},
+        ]
+
+    def test_encode_and_decode(self):
+        compact_history = encode_price_history(list(reversed(self.history)))
+        self.assertEqual(compact_history["startDate"], "2022-04-28")
+        self.assertEqual(len(compact_history["days"]), 4 * 4)
+        self.assertEqual(len(compact_history["prices"]), 4 * 8)
+        self.assertEqual(decode_price_history(compact_history), self.history)
+
+    def test_encode_empty(self):
+        self.assertIsNone(encode_price_history([]))
+
+    def test_add_price(self):
+        compact_history = encode_price_history(self.history[1:3])
+        compact_history = add_price_to_compact_history(compact_history, self.history[3])
+        compact_history = add_price_to_compact_history(compact_history, self.history[0])
+        self.assertEqual(decode_price_history(compact_history), self.history)
+
+        compact_history = add_price_to_compact_history(
+            compact_history, {"price": 21, "date": "2022-05-12"}
+        )
+        compact_history = add_price_to_compact_history(
+            compact_history, {"price": 20.45, "date": "2022-05-12"}
+        )
+        self.assertEqual(
+            decode_price_history(compact_history),
+            self.history[:3] + [{"price": 21, "date": "2022-05-12"}] + self.history[3:],
+        )
+
+    def test_add_earlier_price(self):
+        compact_history = encode_price_history(self.history[1:])
+        compact_history = add_price_to_compact_history(compact_history, self.history[0])
+        self.assertEqual(compact_history["startDate"], "2022-04-28")
+        self.assertEqual(decode_price_history(compact_history), self.history)
+
+    def test_prices_are_exact(self):
+        history = [{"price": 123456.79, "date": "2022-05-02"}]
+        self.assertEqual(decode_price_history(encode_price_history(history)), history)
+
+    def test_add_price_to_empty(self):
+        compact_history = add_price_to_compact_history(None, self.history[0])
+        self.assertEqual(decode_price_history(compact_history), self.history[:1])
+
+    def test_price_window(self):
+        scrape_time = datetime(year=2023, month=3, day=1)
+        history = get_daily_history(800, scrape_time - timedelta(days=1))
+        self.assertEqual(
+            create_price_window_from_compact_history(
+                encode_price_history(history), scrape_time
+            ),
+            create_price_window(history, scrape_time),
+        )
+
+    def test_means_with_several_prices_per_day(self):
+        scrape_time = datetime(year=2023, month=3, day=1)
+        history = get_daily_history(500, scrape_time - timedelta(days=1))
+        history += list(
+            {"price": x["price"] + 5.55, "date": x["date"]} for x in history[::4]
+        )
+        config = {"scrape_time": scrape_time, "collection_name": "meny"}
+        compact_window = create_price_window_from_compact_history(
+            encode_price_history(history), scrape_time
+        )
+        self.assertEqual(
+            get_price_difference_update_set(
+                {"priceWindow": compact_window}, config, 25
+            ),
+            get_price_difference_update_set({"history": history}, config, 25),
+        )
+
+    def test_bson_size(self):
+        history = get_daily_history(730, datetime(year=2023, month=3, day=1))
+        history_bytes = len(bson.encode({"history": history}))
+        compact_bytes = len(
+            bson.encode({"compactHistory": encode_price_history(history)})
+        )
+        # 12 bytes per price instead of a document per price
+        self.assertLess(compact_bytes, len(history) * 12 + 100)
+        self.assertLess(compact_bytes, history_bytes / 3)
+
+
+class FakeResult:
+    def __init__(self, bulk_api_result):
+        self.bulk_api_result = bulk_api_result
+
+
+class FakeCursor(list):
+    def limit(self, limit):
+        return FakeCursor(self[:limit])
+
+    def close(self):
+        pass
+
+
+class FakePriceHistoriesCollection:
+    """
+    Applies the migration updates like Mongo, after on_find has changed the documents
+    that were read.
+    """
+
+    name = "offerpricinghistories"
+
+    def __init__(self, price_histories, on_find=None):
+        self.price_histories = price_histories
+        self.on_find = on_find
+
+    def find(self, filter, projection=None):
+        result = FakeCursor(
+            dict(x) for x in self.price_histories if "compactHistory" not in x
+        )
+        if self.on_find:
+            self.on_find(self.price_histories)
+        return result
+
+    def bulk_write(self, operations, ordered=True):
+        result = {"nMatched": 0, "nModified": 0}
+        for operation in operations:
+            for x in self.price_histories:
+                if (
+                    x["_id"] == operation._filter["_id"]
+                    and "compactHistory" not in x
+                    and x.get("updatedAt") == operation._filter["updatedAt"]
+                    and len(x["history"]) == operation._filter["history"]["$size"]
+                ):
+                    x.update(operation._doc["$set"])
+                    result["nMatched"] += 1
+                    result["nModified"] += 1
+        return FakeResult(result)
+
+
+class TestMigratePriceHistories(TestCase):
+    def setUp(self):
+        self.price_histories = [
+            {
+                "_id": i,
+                "updatedAt": datetime(2022, 5, 2),
+                "history": [{"price": 18, "date": "2022-05-02"}],
+            }
+            for i in range(3)
+        ]
+
+    def migrate(self, collection, **kwargs):
+        with mock.patch(
+            "scraper_feed.migrate_price_histories.get_collection",
+            return_value=collection,
+        ):
+            return migrate_price_histories(**kwargs)
+
+    def test_migrates(self):
+        collection = FakePriceHistoriesCollection(self.price_histories)
+        self.assertEqual(
+            self.migrate(collection), {"migrated": 3, "changed": 0, "done": True}
+        )
+        self.assertEqual(
+            decode_price_history(self.price_histories[0]["compactHistory"]),
+            [{"price": 18, "date": "2022-05-02"}],
+        )
+
+    def test_history_changed_after_read_is_migrated_next_run(self):
+        def add_price(price_histories):
+            price_histories[1]["history"].append({"price": 19, "date": "2022-05-03"})
+            price_histories[1]["updatedAt"] = datetime(2022, 5, 3)
+
+        collection = FakePriceHistoriesCollection(self.price_histories, add_price)
+        self.assertEqual(
+            self.migrate(collection), {"migrated": 2, "changed": 1, "done": False}
+        )
+        self.assertNotIn("compactHistory", self.price_histories[1])
+
+        collection.on_find = None
+        self.assertEqual(
+            self.migrate(collection), {"migrated": 1, "changed": 0, "done": True}
+        )
+        self.assertEqual(
+            len(decode_price_history(self.price_histories[1]["compactHistory"])), 2
+        )
+
+    def test_empty_history_is_marked(self):
+        self.price_histories.append({"_id": 3, "history": []})
+        update = get_migration_update(self.price_histories[-1])
+        self.assertEqual(update._doc, {"$set": {"compactHistory": None}})
+        self.assertIsNone(get_migration_update({"_id": 4})._filter["history"])
+
+        collection = FakePriceHistoriesCollection(self.price_histories)
+        self.assertTrue(self.migrate(collection)["done"])
+        self.assertEqual(self.migrate(collection)["migrated"], 0)
+
+    def test_limit(self):
+        collection = FakePriceHistoriesCollection(self.price_histories)
+        self.assertEqual(
+            self.migrate(collection, limit=2),
+            {"migrated": 2, "changed": 0, "done": False},
+        )
+        self.assertEqual(
+            self.migrate(collection, limit=2),
+            {"migrated": 1, "changed": 0, "done": True},
+        )
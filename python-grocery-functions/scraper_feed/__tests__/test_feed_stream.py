@@ -0,0 +1,62 @@
+from unittest import TestCase
+import io
+import json
+
+from scraper_feed.feed_stream import (
+    get_peak_rss_mb,
+    iterate_feed_offer_fields,
+    iterate_feed_offers,
+)
+
+
+class TestIterateFeedOffers(TestCase):
+    def setUp(self):
+        with open("assets/meny-scraper-feed.json", "rb") as meny_feed:
+            self.meny_feed = meny_feed.read()
+
+    def test_streams_all_offers(self):
+        actual = list(iterate_feed_offers(io.BytesIO(self.meny_feed)))
+        self.assertEqual(actual, json.loads(self.meny_feed))
+
+    def test_prices_are_floats(self):
+        offer = next(iterate_feed_offers(io.BytesIO(b'[{"price": 10.5}]')))
+        self.assertIs(type(offer["price"]), float)
+
+    def test_stops_at_limit(self):
+        actual = list(iterate_feed_offers(io.BytesIO(self.meny_feed), 3))
+        self.assertEqual(len(actual), 3)
+
+    def test_stops_reading_at_limit(self):
+        feed = b'[{"price": 1}, {"price": 2}, {"price": '
+        self.assertEqual(len(list(iterate_feed_offers(io.BytesIO(feed), 2))), 2)
+
+    def test_get_peak_rss_mb(self):
+        self.assertGreater(get_peak_rss_mb(), 0)
+
+
+class TestIterateFeedOfferFields(TestCase):
+    def setUp(self):
+        with open("assets/meny-scraper-feed.json", "rb") as meny_feed:
+            self.meny_feed = meny_feed.read()
+
+    def test_projects_fields(self):
+        fields = ["sku", "url", "price"]
+        actual = list(iterate_feed_offer_fields(io.BytesIO(self.meny_feed), fields))
+        expected = list(
+            dict((key, x[key]) for key in fields if key in x)
+            for x in json.loads(self.meny_feed)
+        )
+        self.assertEqual(actual, expected)
+
+    def test_skips_nested_values(self):
+        feed = b"""[
+            {"sku": "1", "price": {"amount": 5}, "images": [{"sku": "2"}]},
+            {"images": [], "sku": "3", "price": 10.5}
+        ]"""
+        actual = list(iterate_feed_offer_fields(io.BytesIO(feed), ["sku", "price"]))
+        self.assertEqual(actual, [{"sku": "1"}, {"sku": "3", "price": 10.5}])
+
+    def test_stops_at_limit(self):
+        feed = b'[{"price": 1}, {"price": 2}, {"price": '
+        actual = list(iterate_feed_offer_fields(io.BytesIO(feed), ["price"], 2))
+        self.assertEqual(actual, [{"price": 1}, {"price": 2}])
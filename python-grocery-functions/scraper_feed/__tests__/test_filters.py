@@ -1,6 +1,7 @@
 from unittest import TestCase, mock
 
 from scraper_feed.filters import (
+    compile_filters,
     filter_product,
     replace_offer_fields_with_meta,
 )
@@ -48,6 +49,53 @@ class TestFilters(TestCase):
         )
 
 
+class TestCompileFilters(TestCase):
+    def test_in_operator_with_list_target(self):
+        is_kept = compile_filters(
+            [{"operator": "in", "source": "brand", "target": ["Tine", "Q", "Synnøve"]}]
+        )
+        self.assertTrue(is_kept({"brand": "TINE"}))
+        self.assertFalse(is_kept({"brand": "Arla"}))
+        self.assertFalse(is_kept({"brand": ["tine"]}))
+
+    def test_in_operator_with_string_target(self):
+        is_kept = compile_filters(
+            [{"operator": "in", "source": "brand", "target": "Tine Meierier"}]
+        )
+        self.assertTrue(is_kept({"brand": "tine"}))
+
+    def test_filter_with_path_and_number(self):
+        is_kept = compile_filters(
+            [{"operator": "gt", "source": "pricing.price", "target": 100}]
+        )
+        self.assertTrue(is_kept({"pricing": {"price": 200}}))
+        self.assertFalse(is_kept({"pricing": {"price": 50}}))
+
+    def test_any_filter_is_accepted(self):
+        is_kept = compile_filters(
+            [
+                {"operator": "eq", "source": "brand", "target": "makita"},
+                {"operator": "has", "source": "categories", "target": "verktøy"},
+            ]
+        )
+        self.assertTrue(is_kept({"brand": "Bosch", "categories": ["Verktøy"]}))
+        self.assertFalse(is_kept({"brand": "Bosch", "categories": ["Hage"]}))
+
+    def test_no_filters(self):
+        self.assertTrue(compile_filters([])({}))
+
+    def test_stops_at_first_accepted_filter(self):
+        is_kept = compile_filters(
+            [
+                {"operator": "eq", "source": "brand", "target": "makita"},
+                {"operator": "eq", "source": "brand", "target": None},
+            ]
+        )
+        self.assertTrue(is_kept({"brand": "Makita"}))
+        with self.assertRaises(Exception):
+            is_kept({"brand": "Bosch"})
+
+
 class TestAddMeta(TestCase):
     def test_add_basic_meta_to_offer(self):
         scraper_offer = {"title": "Byggryn", "price": 22, "quantityString": "64g"}
@@ -3,6 +3,7 @@ from unittest import TestCase, mock
 from scraper_feed import handle_config
 from scraper_feed.handle_config import (
     fetch_handle_configs,
+    get_event_handle_config,
 )
 from util.errors import NoHandleConfigError
 
@@ -38,3 +39,84 @@ class TestHandleConfig(TestCase):
             self.fail("Should throw error and not come this far")
         except NoHandleConfigError:
             pass
+
+
+class TestHandleConfigCache(TestCase):
+    db_configs = [
+        {
+            "_id": "1",
+            "provenance": "shopgun",
+            "market": "no",
+            "namespace": "meny",
+            "collection_name": "groceryoffers",
+            "updatedAt": "2022-01-01",
+        }
+    ]
+
+    def setUp(self):
+        handle_config.handle_config_cache.clear()
+
+    def test_cache_hit(self):
+        with mock.patch.object(
+            handle_config, "get_handle_configs", return_value=self.db_configs
+        ) as mock_method:
+            fetch_handle_configs("meny", use_cache=True)
+            result = fetch_handle_configs("meny", use_cache=True)
+        self.assertEqual(result[0]["collection_name"], "groceryoffers")
+        self.assertEqual(mock_method.call_count, 1)
+
+    def test_cached_configs_are_copies(self):
+        with mock.patch.object(
+            handle_config, "get_handle_configs", return_value=self.db_configs
+        ):
+            fetch_handle_configs("meny", use_cache=True)[0]["scrape_time"] = 1
+            result = fetch_handle_configs("meny", use_cache=True)
+        self.assertNotIn("scrape_time", result[0])
+
+    def test_revalidates_after_ttl(self):
+        with mock.patch.object(
+            handle_config, "get_handle_configs", return_value=self.db_configs
+        ) as mock_method, mock.patch.object(
+            handle_config,
+            "get_handle_config_versions",
+            return_value=[("1", "2022-01-01")],
+        ):
+            fetch_handle_configs("meny", use_cache=True)
+            handle_config.handle_config_cache["all:meny"]["expiresAt"] = 0
+            fetch_handle_configs("meny", use_cache=True)
+        self.assertEqual(mock_method.call_count, 1)
+
+    def test_fetches_changed_configs(self):
+        with mock.patch.object(
+            handle_config, "get_handle_configs", return_value=self.db_configs
+        ) as mock_method, mock.patch.object(
+            handle_config,
+            "get_handle_config_versions",
+            return_value=[("1", "2022-01-02")],
+        ):
+            fetch_handle_configs("meny", use_cache=True)
+            handle_config.handle_config_cache["all:meny"]["expiresAt"] = 0
+            fetch_handle_configs("meny", use_cache=True)
+        self.assertEqual(mock_method.call_count, 2)
+
+    def test_configs_without_updated_at_are_not_cached(self):
+        db_configs = [{**self.db_configs[0], "updatedAt": None}]
+        with mock.patch.object(
+            handle_config, "get_handle_configs", return_value=db_configs
+        ) as mock_method:
+            fetch_handle_configs("meny", use_cache=True)
+            fetch_handle_configs("meny", use_cache=True)
+        self.assertEqual(mock_method.call_count, 2)
+
+    def test_event_handle_config(self):
+        event = {**handle_config.generate_handle_config(self.db_configs[0])}
+        event["feed_key"] = "shopgun/feed.json"
+        self.assertIs(get_event_handle_config(event), event)
+
+        with mock.patch.object(
+            handle_config, "get_single_handle_config", return_value=self.db_configs[0]
+        ) as mock_method:
+            result = get_event_handle_config({"feed_key": "shopgun/feed.json"})
+        mock_method.assert_called_once_with("shopgun")
+        self.assertEqual(result["collection_name"], "groceryoffers")
+        self.assertEqual(result["feed_key"], "shopgun/feed.json")
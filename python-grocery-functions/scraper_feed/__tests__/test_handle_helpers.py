@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from scraper_feed.helpers import get_provenance_id
+from scraper_feed.helpers import get_offer_prices, get_provenance_id
 from scraper_feed.handle_shopgun_offers import get_shopgun_quantity
 
 
@@ -25,3 +25,15 @@ class TestHelpers(TestCase):
             "pieces": {"from": 1, "to": 1},
         }
         actual = get_shopgun_quantity(shopgun_quantity)
+
+    def test_get_offer_prices(self):
+        offers = [
+            {"sku": "1", "price": 10.5},
+            {"sku": "2", "price": 0},
+            {"sku": "3"},
+            {"url": "https://hei.com/4", "price": 20},
+        ]
+        self.assertEqual(
+            get_offer_prices(offers, "meny"),
+            {"meny:product:1": 10.5, "meny:product:4": 20},
+        )
@@ -0,0 +1,114 @@
+from unittest import TestCase, mock
+import json
+
+from parsing.quantity_extraction import (
+    get_quantity_cache_stats,
+    quantity_cache,
+    reset_quantity_cache_stats,
+)
+from scraper_feed.parallel_transform import (
+    TRANSFORM_BATCH_SIZE,
+    get_parallel_workers,
+    transform_offers,
+)
+from scraper_feed.scraper_configs import get_field_mapping
+
+
+class TestParallelTransform(TestCase):
+    def setUp(self):
+        with open("assets/obsbygg-scraper-feed.json") as obsbygg_products_json:
+            self.obsbygg_products = json.load(obsbygg_products_json)
+        self.config = {
+            "provenance": "obsbygg_spider",
+            "namespace": "obsbygg",
+            "market": "no",
+            "fieldMapping": get_field_mapping(),
+            "categoriesLimits": [],
+            "extractQuantityFields": ["title"],
+            "extractPropertiesFields": [],
+            "extractIngredientsFields": [],
+            "extractNutritionFields": [],
+            "ignore_none": False,
+            "collection_name": "byggoffers",
+            "filters": [{"operator": "gt", "source": "pricing.price", "target": 100}],
+        }
+
+    def test_get_parallel_workers(self):
+        self.assertEqual(get_parallel_workers({}), 0)
+        self.assertEqual(get_parallel_workers({"parallelWorkers": 1}), 0)
+        self.assertEqual(get_parallel_workers({"parallelWorkers": "4"}), 0)
+        self.assertEqual(get_parallel_workers({"parallelWorkers": 4}), 4)
+
+    def test_parallel_results_are_in_order(self):
+        offers = self.obsbygg_products * (
+            1 + 3 * TRANSFORM_BATCH_SIZE // len(self.obsbygg_products)
+        )
+        serial = list(transform_offers(offers, self.config, {}))
+        parallel = list(transform_offers(offers, self.config, {}, workers=2))
+        self.assertEqual(len(parallel), len(offers))
+        self.assertEqual(
+            list(x and x["uri"] for x, _ in parallel),
+            list(x and x["uri"] for x, _ in serial),
+        )
+        self.assertEqual(
+            list(keep for _, keep in parallel), list(keep for _, keep in serial)
+        )
+        self.assertIn(True, list(keep for _, keep in serial))
+        self.assertIn(False, list(keep for _, keep in serial))
+
+    def test_parallel_without_semaphores(self):
+        # Like on AWS Lambda, where there is no /dev/shm
+        with mock.patch(
+            "multiprocessing.synchronize.SemLock.__init__",
+            side_effect=OSError(38, "Function not implemented"),
+        ):
+            parallel = list(
+                transform_offers(self.obsbygg_products, self.config, {}, workers=2)
+            )
+        self.assertEqual(len(parallel), len(self.obsbygg_products))
+
+    def test_parallel_quantity_cache_stats(self):
+        quantity_cache.clear()
+        reset_quantity_cache_stats()
+        list(transform_offers(self.obsbygg_products * 2, self.config, {}))
+        serial_stats = get_quantity_cache_stats()["parseQuantity"]
+
+        quantity_cache.clear()
+        reset_quantity_cache_stats()
+        list(transform_offers(self.obsbygg_products * 2, self.config, {}, workers=2))
+        parallel_stats = get_quantity_cache_stats()["parseQuantity"]
+        self.assertEqual(
+            parallel_stats["hits"] + parallel_stats["misses"],
+            serial_stats["hits"] + serial_stats["misses"],
+        )
+        self.assertGreater(parallel_stats["hits"], 0)
+
+    def test_worker_error_is_raised(self):
+        with self.assertRaisesRegex(Exception, "Transform worker failed"):
+            list(
+                transform_offers(
+                    [*self.obsbygg_products, None], self.config, {}, workers=2
+                )
+            )
+
+    def test_offers_are_filtered_before_transform(self):
+        results = list(transform_offers(self.obsbygg_products, self.config, {}))
+        self.assertIn((None, False), results)
+        self.assertTrue(all(x is not None for x, keep in results if keep))
+
+        # The same offers are kept when the filters are applied after the transform
+        config = {
+            **self.config,
+            "filters": [
+                *self.config["filters"],
+                {"operator": "eq", "source": "mpnStock", "target": "never"},
+            ],
+        }
+        results_after_transform = list(
+            transform_offers(self.obsbygg_products, config, {})
+        )
+        self.assertNotIn((None, False), results_after_transform)
+        self.assertEqual(
+            list(keep for _, keep in results),
+            list(keep for _, keep in results_after_transform),
+        )
@@ -0,0 +1,126 @@
+import io
+import json
+from datetime import datetime
+from unittest import TestCase, mock
+
+from scraper_feed.helpers import get_product_uri
+from scraper_feed.pricing_backfill import (
+    backfill_price_histories,
+    get_backfill_updates,
+)
+from storage.__tests__.test_bulk_writer import FakeCollection
+
+URI = get_product_uri("meny", "1")
+
+
+class FakeCheckpointCollection:
+    def __init__(self):
+        self.checkpoints = {}
+
+    def find_one(self, filter):
+        return self.checkpoints.get(filter["feedKey"])
+
+    def update_one(self, filter, update, upsert=False):
+        self.checkpoints.setdefault(filter["feedKey"], {}).update(update["$set"])
+
+
+def get_versions(n):
+    return list(
+        {"VersionId": f"version-{i}", "LastModified": datetime(2022, 5, i + 1)}
+        for i in range(n)
+    )
+
+
+def get_s3_object(bucket, key, version_id):
+    price = 10 + int(version_id.split("-")[1])
+    return {"Body": io.BytesIO(json.dumps([{"sku": "1", "price": price}]).encode())}
+
+
+class TestBackfillUpdates(TestCase):
+    def test_one_update_per_offer(self):
+        updated_at = datetime(year=2022, month=5, day=31)
+        actual = get_backfill_updates(
+            {
+                "meny:product:1": {"2022-05-31": 12, "2022-05-30": 10},
+                "meny:product:2": {"2022-05-30": 20},
+            },
+            {"meny:product:1": updated_at, "meny:product:2": updated_at},
+            {"collection_name": "groceryoffers"},
+        )
+        self.assertEqual(len(actual), 2)
+        self.assertEqual(actual[0]._filter, {"uri": "meny:product:1"})
+        self.assertEqual(
+            actual[0]._doc["$addToSet"]["history"]["$each"],
+            [
+                {"price": 10, "date": "2022-05-30"},
+                {"price": 12, "date": "2022-05-31"},
+            ],
+        )
+        self.assertEqual(actual[0]._doc["$setOnInsert"], {"latestPrice": 12})
+        self.assertEqual(actual[0]._doc["$max"], {"updatedAt": updated_at})
+
+
+class TestBackfillPriceHistories(TestCase):
+    def setUp(self):
+        self.checkpoint_collection = FakeCheckpointCollection()
+        self.pricing_collection = FakeCollection()
+
+    def backfill(self, versions):
+        collections = {
+            "pricingbackfillcheckpoints": self.checkpoint_collection,
+            "offerpricinghistories": self.pricing_collection,
+        }
+        with mock.patch(
+            "scraper_feed.pricing_backfill.list_s3_object_versions",
+            return_value=versions,
+        ), mock.patch(
+            "scraper_feed.pricing_backfill.get_s3_object", get_s3_object
+        ), mock.patch(
+            "scraper_feed.pricing_backfill.get_collection", collections.get
+        ):
+            return backfill_price_histories(
+                "bucket",
+                "meny.json",
+                {"namespace": "meny", "collection_name": "groceryoffers"},
+                max_workers=2,
+                versions_per_write=2,
+            )
+
+    def get_written_dates(self):
+        return list(
+            x["date"]
+            for call in self.pricing_collection.calls
+            for operation in call
+            for x in operation._doc["$addToSet"]["history"]["$each"]
+        )
+
+    def test_continues_after_checkpoint(self):
+        result = self.backfill(get_versions(3))
+        self.assertEqual(result["versions"], 3)
+        self.assertEqual(result["lastVersionId"], "version-2")
+        self.assertTrue(result["done"])
+
+        self.pricing_collection.calls = []
+        result = self.backfill(get_versions(5))
+        self.assertEqual(result["versions"], 2)
+        self.assertEqual(result["lastVersionId"], "version-4")
+        self.assertEqual(self.get_written_dates(), ["2022-05-04", "2022-05-05"])
+
+    def test_failed_chunk_is_not_checkpointed(self):
+        self.pricing_collection.error_codes = {URI: 121}
+        result = self.backfill(get_versions(4))
+        self.assertEqual(result["versions"], 0)
+        self.assertEqual(result["failedUpdates"], 1)
+        self.assertIsNone(result["lastVersionId"])
+        self.assertFalse(result["done"])
+        self.assertEqual(self.checkpoint_collection.checkpoints, {})
+
+        # The failed chunk is written again in the next run
+        self.pricing_collection.calls = []
+        result = self.backfill(get_versions(4))
+        self.assertEqual(result["versions"], 4)
+        self.assertTrue(result["done"])
+        self.assertEqual(
+            self.get_written_dates(),
+            ["2022-05-01", "2022-05-02", "2022-05-03", "2022-05-04"],
+        )
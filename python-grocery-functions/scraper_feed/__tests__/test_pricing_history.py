@@ -2,8 +2,11 @@ from datetime import datetime
 from unittest import TestCase
 
 from scraper_feed.pricing_history import (
+    create_price_window,
     get_differences_for_series,
     get_price_difference_update_set,
+    get_price_window,
+    get_updated_price_window,
 )
 
 
@@ -208,3 +211,73 @@ class TestPriceDifferencesForSeries(TestCase):
         self.assertAlmostEqual(actual["mean"], 11)
         self.assertAlmostEqual(actual["difference"], 9)
         self.assertAlmostEqual(actual["differencePercentage"], 81.81818181818183)
+
+
+class TestPriceWindow(TestCase):
+    def setUp(self):
+        self.history = [
+            {"price": 30, "date": "2021-03-01"},
+            {"price": 18, "date": "2022-04-28"},
+            {"price": 18, "date": "2022-05-02"},
+            {"price": 20, "date": "2022-05-12"},
+            {"price": 20, "date": "2022-05-20"},
+            {"price": 19, "date": "2022-05-28"},
+        ]
+        self.scrape_time = datetime(year=2022, month=5, day=31)
+        self.config = {
+            "collection_name": "groceryoffers",
+            "scrape_time": self.scrape_time,
+        }
+
+    def test_create_price_window(self):
+        actual = create_price_window(list(reversed(self.history)), self.scrape_time)
+        self.assertEqual(actual["start"], "2021-03-02")
+        self.assertEqual(actual["firstDate"], "2021-03-01")
+        self.assertEqual(actual["lastRecord"], {"price": 19, "date": "2022-05-28"})
+        self.assertEqual(actual["prices"], self.history[1:])
+
+    def test_get_price_window_too_old_for_scrape_time(self):
+        price_window = create_price_window(self.history, self.scrape_time)
+        price_history = {"history": self.history, "priceWindow": price_window}
+        self.assertIsNotNone(get_price_window(price_history, self.scrape_time))
+        self.assertIsNone(
+            get_price_window(price_history, datetime(year=2022, month=5, day=30))
+        )
+
+    def test_update_set_from_price_window(self):
+        price_window = create_price_window(self.history, self.scrape_time)
+        expected = get_price_difference_update_set(
+            {"history": self.history}, self.config, 20
+        )
+        actual = get_price_difference_update_set(
+            {"priceWindow": price_window}, self.config, 20
+        )
+        self.assertEqual(actual, expected)
+
+    def test_get_updated_price_window(self):
+        price_history = {
+            "history": self.history,
+            "priceWindow": create_price_window(self.history, self.scrape_time),
+        }
+        next_scrape_time = datetime(year=2022, month=6, day=1)
+        pricing_object = {"price": 21, "date": "2022-06-01"}
+        actual = get_updated_price_window(
+            price_history, pricing_object, next_scrape_time
+        )
+        self.assertEqual(actual["start"], "2021-03-03")
+        self.assertEqual(actual["lastRecord"], {"price": 21, "date": "2022-06-01"})
+        self.assertEqual(actual["prices"], self.history[1:] + [pricing_object])
+        self.assertEqual(
+            actual,
+            create_price_window(self.history + [pricing_object], next_scrape_time),
+        )
+
+    def test_get_updated_price_window_with_existing_record(self):
+        price_history = {
+            "history": self.history,
+            "priceWindow": create_price_window(self.history, self.scrape_time),
+        }
+        actual = get_updated_price_window(
+            price_history, {"price": 20, "date": "2022-05-20"}, self.scrape_time
+        )
+        self.assertEqual(actual, price_history["priceWindow"])
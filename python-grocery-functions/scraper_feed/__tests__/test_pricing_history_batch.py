@@ -0,0 +1,79 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from scraper_feed.pricing_history import (
+    create_price_window,
+    get_price_difference_update_set,
+)
+from scraper_feed.pricing_history_batch import get_price_difference_update_sets
+
+
+def get_random_price_histories(n_offers, n_days, scrape_time):
+    random.seed(0)
+    result = []
+    for _ in range(n_offers):
+        history = list(
+            {
+                "price": random.choice([19.9, 24.5, 29.9]),
+                "date": (scrape_time - timedelta(days=day)).strftime("%Y-%m-%d"),
+            }
+            for day in range(1, random.randint(0, n_days) + 1)
+        )
+        result.append(
+            {
+                "history": history,
+                "priceWindow": create_price_window(history, scrape_time),
+            }
+        )
+    return result
+
+
+class TestPriceDifferenceUpdateSets(TestCase):
+    def setUp(self):
+        self.scrape_time = datetime(year=2022, month=5, day=31)
+        self.config = {
+            "collection_name": "groceryoffers",
+            "scrape_time": self.scrape_time,
+        }
+
+    def test_same_as_single_update_sets(self):
+        price_histories = get_random_price_histories(50, 500, self.scrape_time)
+        price_histories.append(
+            {
+                "history": [
+                    {"price": 18, "date": "2022-04-28"},
+                    {"price": 18, "date": "2022-05-02"},
+                    {"price": 20, "date": "2022-05-12"},
+                    {"price": 20, "date": "2022-05-20"},
+                    {"price": 19, "date": "2022-05-28"},
+                ]
+            }
+        )
+        price_histories.append({"history": []})
+        current_prices = list(20 for _ in price_histories)
+
+        actual = get_price_difference_update_sets(
+            price_histories, self.config, current_prices
+        )
+
+        self.assertEqual(len(actual), len(price_histories))
+        for price_history, update_set in zip(price_histories, actual):
+            expected = get_price_difference_update_set(price_history, self.config, 20)
+            self.assertEqual(list(update_set.keys()), list(expected.keys()))
+            for key, value in expected.items():
+                if type(value) is float:
+                    self.assertAlmostEqual(update_set[key], value)
+                else:
+                    self.assertEqual(update_set[key], value)
+
+    def test_values_are_python_floats(self):
+        price_histories = get_random_price_histories(2, 10, self.scrape_time)
+        actual = get_price_difference_update_sets(
+            price_histories, self.config, [20, 20]
+        )
+        self.assertIs(type(actual[0]["price7DaysMean"]), float)
+
+    def test_empty(self):
+        self.assertEqual(get_price_difference_update_sets([], self.config, []), [])
+
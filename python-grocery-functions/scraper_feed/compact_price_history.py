@@ -0,0 +1,132 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple, TypedDict
+
+import numpy as np
+from bson.binary import Binary
+
+from amp_types.amp_product import PriceHistoryRecord, PriceWindow
+from scraper_feed.pricing_history import PRICE_WINDOW_DAYS, get_date_string
+
+# A compact layout of the price history of an offer, stored next to the history array
+# as compactHistory. Every record of the history is kept, as a packed little endian int32
+# array of days from startDate and a packed little endian float64 array of prices.
+# Records are sorted by date, and records of the same date are in the order they were
+# added, like the sorted history in create_price_window.
+DAY_DTYPE = np.dtype("<i4")
+PRICE_DTYPE = np.dtype("<f8")
+
+
+class CompactPriceHistory(TypedDict):
+    startDate: str
+    days: bytes
+    prices: bytes
+
+
+def get_unique_records(history: List[PriceHistoryRecord]) -> List[PriceHistoryRecord]:
+    """
+    The records sorted by date without duplicates, like $addToSet keeps them.
+    """
+    result = []
+    for x in sorted(history, key=lambda x: x["date"]):
+        record = {"price": x["price"], "date": x["date"]}
+        if record not in result:
+            result.append(record)
+    return result
+
+
+def encode_records(
+    start_date: date, days: np.ndarray, prices: np.ndarray
+) -> CompactPriceHistory:
+    return {
+        "startDate": start_date.isoformat(),
+        "days": Binary(days.astype(DAY_DTYPE).tobytes()),
+        "prices": Binary(prices.astype(PRICE_DTYPE).tobytes()),
+    }
+
+
+def encode_price_history(
+    history: List[PriceHistoryRecord],
+) -> Optional[CompactPriceHistory]:
+    records = get_unique_records(history)
+    if len(records) == 0:
+        return None
+    start_date = date.fromisoformat(records[0]["date"])
+    return encode_records(
+        start_date,
+        np.array(
+            list((date.fromisoformat(x["date"]) - start_date).days for x in records)
+        ),
+        np.array(list(x["price"] for x in records), dtype=PRICE_DTYPE),
+    )
+
+
+def decode_price_history_arrays(
+    compact_history: CompactPriceHistory,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the dates and prices of the records of the history as arrays.
+    """
+    offsets = np.frombuffer(compact_history["days"], dtype=DAY_DTYPE)
+    prices = np.frombuffer(compact_history["prices"], dtype=PRICE_DTYPE)
+    return np.datetime64(compact_history["startDate"], "D") + offsets, prices
+
+
+def decode_price_history(
+    compact_history: CompactPriceHistory,
+) -> List[PriceHistoryRecord]:
+    days, prices = decode_price_history_arrays(compact_history)
+    return list(
+        {"price": price, "date": day}
+        for day, price in zip(days.astype(str).tolist(), prices.tolist())
+    )
+
+
+def add_price_to_compact_history(
+    compact_history: Optional[CompactPriceHistory], record: PriceHistoryRecord
+) -> CompactPriceHistory:
+    """
+    Adds the record after the records of the same date, unless it is already there.
+    """
+    if not compact_history:
+        return encode_price_history([record])
+    offsets = np.frombuffer(compact_history["days"], dtype=DAY_DTYPE)
+    prices = np.frombuffer(compact_history["prices"], dtype=PRICE_DTYPE)
+    start_date = date.fromisoformat(compact_history["startDate"])
+    day = (date.fromisoformat(record["date"]) - start_date).days
+    if np.any((offsets == day) & (prices == record["price"])):
+        return compact_history
+    if day < 0:
+        offsets = offsets - day
+        start_date = start_date + timedelta(days=day)
+        day = 0
+    index = int(np.searchsorted(offsets, day, side="right"))
+    return encode_records(
+        start_date,
+        np.insert(offsets, index, day),
+        np.insert(prices, index, record["price"]),
+    )
+
+
+def create_price_window_from_compact_history(
+    compact_history: CompactPriceHistory, scrape_time: datetime
+) -> PriceWindow:
+    """
+    Same as create_price_window, but selects the window days from the decoded arrays
+    and only creates records for them.
+    """
+    start = get_date_string(scrape_time, PRICE_WINDOW_DAYS)
+    days, prices = decode_price_history_arrays(compact_history)
+    if len(days) == 0:
+        return {"start": start, "firstDate": None, "lastRecord": None, "prices": []}
+    is_in_window = days >= np.datetime64(start, "D")
+    window_days = days[is_in_window].astype(str).tolist()
+    window_prices = prices[is_in_window].tolist()
+    return {
+        "start": start,
+        "firstDate": str(days[0]),
+        "lastRecord": {"date": str(days[-1]), "price": prices[-1].item()},
+        "prices": list(
+            {"date": day, "price": price}
+            for day, price in zip(window_days, window_prices)
+        ),
+    }
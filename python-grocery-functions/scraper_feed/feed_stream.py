@@ -0,0 +1,74 @@
+import logging
+import resource
+import sys
+from itertools import islice
+from typing import IO, Iterable, Iterator, Optional
+
+import ijson
+
+from amp_types.amp_product import ScraperOffer
+
+try:
+    # The C backend parses several times faster than the pure Python one.
+    ijson_backend = ijson.get_backend("yajl2_c")
+except ImportError:
+    logging.warning(f"ijson C backend not available, using {ijson.backend}")
+    ijson_backend = ijson
+
+
+def iterate_feed_offers(
+    feed_stream: IO[bytes], limit: Optional[int] = None
+) -> Iterator[ScraperOffer]:
+    """
+    Streams the offers of a scraper feed, which is a JSON array of offers,
+    without reading the whole feed into memory. Stops reading after limit offers.
+    Numbers are parsed as floats so that the offers can be stored in Mongo directly.
+    """
+    offers = ijson_backend.items(feed_stream, "item", use_float=True)
+    if limit is not None:
+        offers = islice(offers, limit)
+    return offers
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in megabytes.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    if sys.platform == "darwin":
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def iterate_feed_offer_fields(
+    feed_stream: IO[bytes], fields: Iterable[str], limit: Optional[int] = None
+) -> Iterator[dict]:
+    """
+    Like iterate_feed_offers, but only keeps the given top level scalar fields of each offer.
+    Works on the basic parser events, so that dicts and lists are never built for other
+    values of the offer, e.g. additionalProperties and images.
+    """
+    fields = frozenset(fields)
+    n_offers = 0
+    depth = 0
+    key = None
+    offer = {}
+    for event, value in ijson_backend.basic_parse(feed_stream, use_float=True):
+        if event == "map_key":
+            if depth == 2:
+                key = value if value in fields else None
+        elif event == "start_map" or event == "start_array":
+            depth += 1
+            if depth == 2:
+                offer = {}
+                key = None
+        elif event == "end_map" or event == "end_array":
+            depth -= 1
+            if depth == 1:
+                yield offer
+                n_offers += 1
+                if limit is not None and n_offers >= limit:
+                    return
+        elif depth == 2 and key is not None:
+            offer[key] = value
@@ -1,4 +1,4 @@
-from typing import List, Mapping
+from typing import Callable, List, Mapping, Optional
 import pydash
 import logging
 from datetime import datetime, timedelta
@@ -6,6 +6,7 @@ from slugify import slugify
 
 from storage.models import mpn_offer_store_fields
 from parsing.ingredients_extraction import get_ingredients_data
+from parsing.ingredient_matcher import IngredientMatcher
 from parsing.nutrition_extraction import extract_nutritional_data
 from parsing.property_extraction import (
     extract_dimensions,
@@ -16,7 +17,7 @@ from parsing.property_extraction import (
 from util.helpers import is_integer_num
 
 from transform.transform import transform_fields
-from transform.offer import get_field_from_scraper_offer
+from transform.offer import OfferView, get_field_from_scraper_offer
 from util.helpers import get_product_uri, json_time_to_datetime
 from parsing.quantity_extraction import (
     analyze_quantity,
@@ -37,6 +38,21 @@ from scraper_feed.helpers import (
 from amp_types.amp_product import MpnOffer, OfferFilterConfig, IngredientType
 
 
+OfferPredicate = Callable[[MpnOffer], bool]
+
+# Fields that transform_product copies from the offer after the field mapping
+PREFILTER_OFFER_FIELDS = (
+    "title",
+    "subtitle",
+    "shortDescription",
+    "description",
+    "brand",
+    "vendor",
+    "sku",
+)
+# Fields that filters can be evaluated on before the full transform
+PREFILTER_FIELDS = (*PREFILTER_OFFER_FIELDS, "dealer", "categories", "pricing")
+
 mpn_categories_version = 1
 mpn_ingredients_version = 3
 mpn_nutrition_version = 2
@@ -71,46 +87,137 @@ global time
 time = MyTime()
 
 
-def filter_product(product: MpnOffer, filters: List[OfferFilterConfig]):
-    """
-    Will return true if any of the filters are accepted. I.e. OR chaining."""
+def get_lowercase_operand(operand):
+    if type(operand) is str:
+        return operand.lower()
+    elif type(operand) is list:
+        return list(x.lower() if type(x) is str else x for x in operand)
+    return operand
 
-    if len(filters) == 0:
+
+def is_hashable_list(values: list) -> bool:
+    try:
+        frozenset(values)
         return True
+    except TypeError:
+        return False
+
+
+def compile_filter(_filter: OfferFilterConfig) -> OfferPredicate:
+    """
+    Returns a predicate that gives the same result as the filter in filter_product.
+    The source path is resolved and the target is lowercased once. A list target
+    of the in operator is made a frozenset, so membership doesn't scan the list.
+    """
+    source = _filter["source"]
+    operator = _filter["operator"]
+    raw_target = _filter["target"]
+    target = get_lowercase_operand(raw_target)
+
+    if type(source) is str and not any(x in source for x in ".[]\\"):
+        read_source = lambda product: product.get(source)
+    else:
+        read_source = lambda product: pydash.get(product, source)
+
+    if operator == "eq":
+        is_accepted = lambda op1: op1 == target
+    elif operator == "has":
+        is_accepted = lambda op1: target in op1
+    elif operator == "in" and type(target) is list and is_hashable_list(target):
+        target_set = frozenset(target)
+
+        def is_accepted(op1):
+            try:
+                return op1 in target_set
+            except TypeError:
+                # Unhashable operands like lists are compared like in a list
+                return op1 in target
+
+    elif operator == "in":
+        is_accepted = lambda op1: op1 in target
+    elif operator == "gt":
+        is_accepted = lambda op1: op1 > target
+    elif operator == "lt":
+        is_accepted = lambda op1: op1 < target
+    else:
+        is_accepted = lambda op1: False
 
-    for _filter in filters:
-        op1 = pydash.get(product, _filter["source"])
-        operator = _filter["operator"]
-        op2 = _filter["target"]
+    def predicate(product: MpnOffer) -> bool:
+        op1 = read_source(product)
         if not op1:
-            continue
-        if not op2:
+            return False
+        if not raw_target:
             logging.error(_filter)
             raise Exception("Filter has no target operand")
-        if type(op1) is str:
-            op1 = op1.lower()
-        elif type(op1) is list:
-            op1 = list(x.lower() if type(x) is str else x for x in op1)
-        if type(op2) is str:
-            op2 = op2.lower()
-        elif type(op2) is list:
-            op2 = list(x.lower() if type(x) is str else x for x in op2)
-
-        is_accepted = False
-
-        if operator == "eq":
-            is_accepted = op1 == op2
-        elif operator == "has":
-            is_accepted = op2 in op1
-        elif operator == "in":
-            is_accepted = op1 in op2
-        elif operator == "gt":
-            is_accepted = op1 > op2
-        elif operator == "lt":
-            is_accepted = op1 < op2
-        if is_accepted:
-            return True
-    return False
+        return is_accepted(get_lowercase_operand(op1))
+
+    return predicate
+
+
+def compile_filters(filters: List[OfferFilterConfig]) -> OfferPredicate:
+    """
+    Compiles the filters of a handle config once to a predicate that accepts a product
+    if any of the filters accepts it. The filters are evaluated in order and stop at
+    the first that accepts the product."""
+    if len(filters) == 0:
+        return lambda product: True
+    predicates = tuple(compile_filter(x) for x in filters)
+    return lambda product: any(x(product) for x in predicates)
+
+
+def filter_product(product: MpnOffer, filters: List[OfferFilterConfig]):
+    """
+    Will return true if any of the filters are accepted. I.e. OR chaining.
+    Use compile_filters to filter many products with the same filters."""
+    return compile_filters(filters)(product)
+
+
+def get_offer_categories(offer: ScraperOffer, config: HandleConfig):
+    if config["provenance"] in ["meny_api_spider"]:
+        return pydash.get(offer, "slugCategories", [])
+    return get_categories(
+        pydash.get(offer, "categories"),
+        config["categoriesLimits"],
+    )
+
+
+def get_prefilter_product(offer: ScraperOffer, config: HandleConfig) -> MpnOffer:
+    """
+    The PREFILTER_FIELDS of an offer after the field mapping, with the same values as
+    transform_product gives them.
+    """
+    result = pydash.pick(offer, PREFILTER_OFFER_FIELDS)
+    result["dealer"] = offer.get("dealer", config["namespace"])
+    result["categories"] = get_offer_categories(offer, config)
+    result["pricing"] = get_product_pricing(offer)
+    return result
+
+
+def is_prefilter_source(source) -> bool:
+    return (
+        type(source) is str
+        and not any(x in source for x in "[]\\")
+        and source.split(".")[0] in PREFILTER_FIELDS
+    )
+
+
+def compile_prefilter(config: HandleConfig) -> Optional[Callable[[ScraperOffer], bool]]:
+    """
+    Returns a predicate on the scraper offers that gives the same result as the filters
+    give on the transformed offers, so that the full transform can be skipped for the
+    offers that are filtered away.
+    A product is kept when any filter accepts it, so this is only possible when all
+    the filters are on PREFILTER_FIELDS. Returns None otherwise.
+    """
+    filters = pydash.get(config, ["filters"], [])
+    if len(filters) == 0 or "shopgun" in config["provenance"]:
+        return None
+    if not all(is_prefilter_source(x.get("source")) for x in filters):
+        return None
+    is_kept = compile_filters(filters)
+    return lambda offer: is_kept(
+        get_prefilter_product(transform_fields(offer, config["fieldMapping"]), config)
+    )
 
 
 def replace_offer_fields_with_meta(offer: ScraperOffer, offer_meta):
@@ -125,16 +232,22 @@ def transform_product(
     offer: ScraperOffer,
     config: HandleConfig,
     ingredients_data: Mapping[str, IngredientType],
+    ingredients_matcher: Optional[IngredientMatcher] = None,
 ) -> MpnOffer:
     time.set_time(config.get("scrape_time", datetime.utcnow()))
     result: MpnOffer = {}
+    # Quantity strings are tokenized once per offer and shared by all quantity parsing below
+    quantity_tokens = {}
     # Still handle Shopgun offers a little differently..
     namespace = config["namespace"]
+    # The offer is wrapped in an OfferView, so that the many field lookups of the
+    # extractors below don't search the additional properties every time.
     if "shopgun" in config["provenance"]:
+        offer = OfferView(offer)
         result = transform_shopgun_product(offer, config)
     else:
         # Start here for everything not Shopgun offer.
-        offer = transform_fields(offer, config["fieldMapping"])
+        offer = OfferView(transform_fields(offer, config["fieldMapping"]))
 
         provenance_id = get_provenance_id(offer)
 
@@ -203,7 +316,9 @@ def transform_product(
         safe_unit_list = ["l", "kg"] if "grocery" in config["collection_name"] else None
 
         parsed_quantity = parse_quantity(
-            list(x for x in parse_quantity_strings if x), safe_unit_list
+            list(x for x in parse_quantity_strings if x),
+            safe_unit_list,
+            token_cache=quantity_tokens,
         )
         if config["ignore_none"]:
             for k, v in parsed_quantity.items():
@@ -212,19 +327,15 @@ def transform_product(
                 else:
                     parsed_quantity[k] = {}
 
-        parsed_explicit_quantity = parse_explicit_quantity(offer, config)
+        parsed_explicit_quantity = parse_explicit_quantity(
+            offer, config, token_cache=quantity_tokens
+        )
         parsed_quantity = {
             **parsed_quantity,
             **parsed_explicit_quantity,
         }
         result["mpnStock"] = get_stock_status(offer)
-        if config["provenance"] in ["meny_api_spider"]:
-            result["categories"] = pydash.get(offer, "slugCategories", [])
-        else:
-            result["categories"] = get_categories(
-                pydash.get(offer, "categories"),
-                config["categoriesLimits"],
-            )
+        result["categories"] = get_offer_categories(offer, config)
         result = {**result, **parsed_quantity}
     if result["validThrough"].timestamp() > time.time.timestamp():
         result["isRecent"] = True
@@ -244,10 +355,12 @@ def transform_product(
 
     result["mpnProperties"] = standardize_additional_properties(offer, config)
     if config["collection_name"] in ["groceryoffers"]:
-        result["mpnIngredients"] = get_ingredients_data(offer, config, ingredients_data)
+        result["mpnIngredients"] = get_ingredients_data(
+            offer, config, ingredients_data, ingredients_matcher
+        )
     result["mpnNutrition"] = extract_nutritional_data(offer, config)
 
-    result = analyze_quantity({**offer, **result})
+    result = analyze_quantity({**offer, **result}, token_cache=quantity_tokens)
     result = standardize_quantity(result)
     quantity = result.get("quantity")
 
@@ -294,14 +407,9 @@ def transform_and_filter_offers(
         )
         for x in offers
     )
-    filters = pydash.get(config, ["filters"], [])
-
-    if len(filters) == 0:
-        return list(transformed_offers)
-
-    filtered_offers = list(x for x in transformed_offers if filter_product(x, filters))
+    is_kept = compile_filters(pydash.get(config, ["filters"], []))
 
-    return filtered_offers
+    return list(x for x in transformed_offers if is_kept(x))
 
 
 def get_categories(categories, categories_limits):
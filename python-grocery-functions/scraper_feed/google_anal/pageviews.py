@@ -23,7 +23,7 @@ from scraper_feed.google_anal.utils import (
 
 from storage.db import get_collection
 from util.logging import configure_lambda_logging
-from offer_feed.offer_relations_handler import update_offer_relations_view
+from offer_feed.relations_view import update_relations_view_pageviews
 
 if not os.getenv("IS_LOCAL"):
     sentry_sdk.init(
@@ -277,8 +277,8 @@ def get_and_save_pageviews_ga4(max_pages=6000):
         mongo_modified = (
             save_mongo_pageviews(uri_pageviews) if len(uri_pageviews) > 0 else 0
         )
-        update_offer_relations_view_response = update_offer_relations_view(
-            {"offerSet": {"$in": list(uri_pageviews.keys())}},
+        update_offer_relations_view_response = update_relations_view_pageviews(
+            uri_pageviews,
             market=report["site_config"]["market"],
         )
         logging.info("update_offer_relations_view_response")
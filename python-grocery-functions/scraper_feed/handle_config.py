@@ -1,6 +1,8 @@
 import logging
+import time
 import pydash
-from typing import List
+from copy import deepcopy
+from typing import Callable, List
 
 
 from scraper_feed.scraper_configs import (
@@ -10,10 +12,22 @@ from scraper_feed.scraper_configs import (
     DEFAULT_EXTRACT_QUANTITY_FIELDS,
     DEFAULT_EXTRACT_CATEGORIES_FIELD,
 )
-from storage.db import get_handle_configs, get_single_handle_config
+from storage.db import (
+    get_handle_config_versions,
+    get_handle_configs,
+    get_handle_configs_filter,
+    get_single_handle_config,
+)
 from amp_types.amp_product import HandleConfig, ScraperConfig
 from util.errors import NoHandleConfigError
 
+HANDLE_CONFIG_CACHE_TTL_SECONDS = 300
+
+# Generated handle configs by provenance. Module state is kept between invocations
+# of a warm Lambda, so the cache saves the config queries for those.
+handle_config_cache = {}
+handle_config_cache_stats = {"hits": 0, "revalidated": 0, "misses": 0}
+
 
 def generate_handle_config(config: dict) -> HandleConfig:
     result = {}
@@ -69,28 +83,108 @@ def generate_handle_config(config: dict) -> HandleConfig:
     result["ignore_none"] = pydash.get(
         config, ["additionalConfig", "ignoreNone"], False
     )
+    parallel_workers = pydash.get(config, ["additionalConfig", "parallelWorkers"], 0)
+    result["parallelWorkers"] = parallel_workers if type(parallel_workers) is int else 0
     return result
 
 
-def fetch_handle_configs(provenance: str) -> List[HandleConfig]:
+def get_handle_config_cache_stats():
+    n_lookups = sum(handle_config_cache_stats.values())
+    return {
+        **handle_config_cache_stats,
+        "hitRate": (
+            (n_lookups - handle_config_cache_stats["misses"]) / n_lookups
+            if n_lookups > 0
+            else 0
+        ),
+    }
+
+
+def get_cached_handle_configs(
+    cache_key: str,
+    handle_config_filter: dict,
+    limit: int,
+    fetch_configs: Callable[[], List[dict]],
+) -> List[HandleConfig]:
+    """
+    Returns the generated handle configs from the cache when they are newer than the TTL.
+    After the TTL the cached configs are still used if the ids and updatedAt of the
+    configs in the database are the same, which is a lot cheaper than fetching and
+    generating them again.
+    Configs without updatedAt are not cached, since their edits can't be seen.
+    """
+    now = time.monotonic()
+    entry = handle_config_cache.get(cache_key)
+    if entry and entry["expiresAt"] > now:
+        handle_config_cache_stats["hits"] += 1
+    elif (
+        entry
+        and get_handle_config_versions(handle_config_filter, limit) == entry["versions"]
+    ):
+        handle_config_cache_stats["revalidated"] += 1
+        entry["expiresAt"] = now + HANDLE_CONFIG_CACHE_TTL_SECONDS
+    else:
+        handle_config_cache_stats["misses"] += 1
+        db_configs = fetch_configs()
+        versions = list((str(x.get("_id")), x.get("updatedAt")) for x in db_configs)
+        entry = {
+            "configs": list(generate_handle_config(x) for x in db_configs),
+            "versions": versions,
+            "expiresAt": now + HANDLE_CONFIG_CACHE_TTL_SECONDS,
+        }
+        if all(x[1] is not None for x in versions):
+            handle_config_cache[cache_key] = entry
+        else:
+            handle_config_cache.pop(cache_key, None)
+    logging.info(f"Handle config cache: {get_handle_config_cache_stats()}")
+    # Callers add fields like scrape_time to the configs
+    return deepcopy(entry["configs"])
+
+
+def fetch_handle_configs(provenance: str, use_cache=False) -> List[HandleConfig]:
     """
     Finds a handle config from a database or uses a default one.
     """
 
     try:
+        if use_cache:
+            return get_cached_handle_configs(
+                f"all:{provenance}",
+                get_handle_configs_filter(provenance),
+                0,
+                lambda: get_handle_configs(provenance),
+            )
         return list(generate_handle_config(x) for x in get_handle_configs(provenance))
     except NoHandleConfigError:
         logging.warn("No handle config found")
         raise NoHandleConfigError()
 
 
-def fetch_single_handle_config(provenance: str) -> HandleConfig:
+def fetch_single_handle_config(provenance: str, use_cache=False) -> HandleConfig:
     """
     Finds a handle config from a database or uses a default one.
     """
 
     try:
+        if use_cache:
+            return get_cached_handle_configs(
+                f"single:{provenance}",
+                {"provenance": provenance},
+                1,
+                lambda: [get_single_handle_config(provenance)],
+            )[0]
         return generate_handle_config(get_single_handle_config(provenance))
     except NoHandleConfigError:
         logging.warn("No handle config found")
         raise NoHandleConfigError()
+
+
+def get_event_handle_config(event: dict) -> dict:
+    """
+    The fan-out Lambdas embed the generated handle config in the event. Events without
+    it, like manual invocations with only a feed_key, get the config of the provenance.
+    """
+    if event.get("fieldMapping") is not None:
+        return event
+    provenance = event["feed_key"].split("/")[0]
+    return {**fetch_single_handle_config(provenance, use_cache=True), **event}
@@ -23,14 +23,30 @@ from amp_types.amp_product import (
 from config.vars import SCRAPER_FEED_HANDLED_TOPIC_ARN, BOOK_FEED_HANDLED_TOPIC_ARN
 from scraper_feed.affiliate_links import add_affilite_link_to_product
 from scraper_feed.helpers import get_book_gtins
-from scraper_feed.filters import filter_product, transform_product
-from parsing.ingredients_extraction import sort_db_ingredient_key
+from scraper_feed.parallel_transform import get_parallel_workers, transform_offers
+from parsing.ingredients_extraction import (
+    get_ingredients_matcher,
+    sort_db_ingredient_key,
+)
+from parsing.quantity_extraction import (
+    get_quantity_cache_stats,
+    reset_quantity_cache_stats,
+)
+from storage.changesets import save_changeset
 from storage.db import get_collection
+from storage.pipelined_writer import PipelinedWriter
 from storage.postgres import (
     handle_store_offer_batch,
 )
 
 
+def save_handle_run(handle_run: dict):
+    if os.getenv("IS_LOCAL"):
+        logging.info({**handle_run, "example_items": handle_run["example_items"][:1]})
+    else:
+        store_handle_run(handle_run)
+
+
 def handle_feed_with_config(
     feed_json_stream: botocore.response.StreamingBody, config: HandleConfig
 ):
@@ -44,6 +60,7 @@ def handle_feed_with_config(
         raise Exception("Config needs scrapeBatchId")
 
     start_time = datetime.now()
+    reset_quantity_cache_stats()
 
     # inserted_scrape_batch: str = insert_scrape_batch(
     #    config=config,
@@ -58,9 +75,10 @@ def handle_feed_with_config(
         db_ingredients: Iterable[IngredientType] = ingredients_collection.find({})
         for x in sorted(db_ingredients, key=sort_db_ingredient_key):
             ingredients_data[x["key"]] = x
+    ingredients_matcher = get_ingredients_matcher(ingredients_data)
 
     scrape_batch_id = config["scrapeBatchId"]
-    filters = pydash.get(config, ["filters"], [])
+    parallel_workers = get_parallel_workers(config)
 
     is_book_offers = config["collection_name"] == "bookoffers"
 
@@ -68,55 +86,115 @@ def handle_feed_with_config(
     example_items = []
     total_offers = 0
     total_filtered_offers = 0
+    total_pruned_offers = 0
+
+    write_counts = {"written": 0, "skipped": 0, "failed": 0}
+    # Downstream handlers only process the changed offers when every batch has a changeset
+    changeset_state = {"isComplete": not is_book_offers}
+
+    def save_offer_batch(batch):
+        save_offers = save_book_offers if is_book_offers else save_scraped_offers
+        results = save_offers(batch)
+        if len(results) == 0:
+            changeset_state["isComplete"] = False
+        for result in results:
+            write_counts["written"] += result["nWritten"]
+            write_counts["skipped"] += result["nSkipped"]
+            write_counts["failed"] += result["nFailed"]
+            if not is_book_offers and changeset_state["isComplete"]:
+                try:
+                    save_changeset(
+                        scrape_batch_id, result["changes"], result["nSkipped"]
+                    )
+                except Exception as e:
+                    # The offers are written, so downstream handlers use the full path
+                    logging.error(f"Failed to save changeset: {e}")
+                    changeset_state["isComplete"] = False
+
+    # Batches are written in a background thread while the next batch is transformed.
+    offer_writer = PipelinedWriter(save_offer_batch)
+
+    def get_handle_run():
+        end_time = datetime.now()
+        return {
+            **config,
+            "example_items": example_items,
+            "time_elapsed_seconds": (end_time - start_time).total_seconds(),
+            "items_handled": total_offers,
+            "n_filtered_offers": total_filtered_offers,
+            "n_pruned_offers": total_pruned_offers,
+            "quantityCache": get_quantity_cache_stats(),
+            "stageTimes": offer_writer.get_stage_times(),
+            "offerWrites": write_counts,
+            "createdAt": end_time,
+            "updatedAt": end_time,
+            "logs": aws_config.get_log_group_url(),
+            "scrapeBatchId": scrape_batch_id,
+        }
 
     try:
-        for offer in ijson.items(feed_json_stream, "item"):
-            total_offers += 1
-            offer: ScraperOffer = offer
-            transformed_offer = transform_product(
-                offer=offer, config=config, ingredients_data=ingredients_data
-            )
-            should_keep = filter_product(product=transformed_offer, filters=filters)
-            if not should_keep:
-                continue
-            total_filtered_offers += 1
-
-            processed_offer: ProcessedMpnOffer = {
-                **add_affilite_link_to_product(transformed_offer),
-                "siteCollection": config["collection_name"],
-                "scrapeBatchId": scrape_batch_id,
-                "namespace": config["namespace"],
-            }
-
-            if is_book_offers:
-                book_offer = {
-                    **processed_offer,
-                    "gtins": get_book_gtins(processed_offer),
-                    "uri": processed_offer["book_uri"],
-                    "ahref": processed_offer.get("trackingUrl"),
+        try:
+            for transformed_offer, should_keep in transform_offers(
+                offers=ijson.items(feed_json_stream, "item"),
+                config=config,
+                ingredients_data=ingredients_data,
+                ingredients_matcher=ingredients_matcher,
+                workers=parallel_workers,
+            ):
+                total_offers += 1
+                if transformed_offer is None:
+                    # Filtered away before the transform
+                    total_pruned_offers += 1
+                if not should_keep:
+                    continue
+                total_filtered_offers += 1
+
+                processed_offer: ProcessedMpnOffer = {
+                    **add_affilite_link_to_product(transformed_offer),
+                    "siteCollection": config["collection_name"],
+                    "scrapeBatchId": scrape_batch_id,
+                    "namespace": config["namespace"],
                 }
-                offer_batch.append(book_offer)
-                if len(example_items) < 20:
-                    example_items.append(book_offer)
-            else:
-                offer_batch.append(processed_offer)
-                if len(example_items) < 20:
-                    example_items.append(processed_offer)
 
-            if os.getenv("STAGE") == "dev":
-                if len(offer_batch) == 512:
-                    break
-
-            if len(offer_batch) == 1000:
-                logging.info(f"Saving {len(offer_batch)} offers")
                 if is_book_offers:
-                    save_book_offers(offer_batch)
+                    book_offer = {
+                        **processed_offer,
+                        "gtins": get_book_gtins(processed_offer),
+                        "uri": processed_offer["book_uri"],
+                        "ahref": processed_offer.get("trackingUrl"),
+                    }
+                    offer_batch.append(book_offer)
+                    if len(example_items) < 20:
+                        example_items.append(book_offer)
                 else:
-                    save_scraped_offers(offer_batch)
+                    offer_batch.append(processed_offer)
+                    if len(example_items) < 20:
+                        example_items.append(processed_offer)
+
+                if os.getenv("STAGE") == "dev":
+                    if len(offer_batch) == 512:
+                        break
+
+                if len(offer_batch) == 1000:
+                    logging.info(f"Saving {len(offer_batch)} offers")
+                    offer_writer.put(offer_batch)
                     # handle_store_offer_batch(
                     #    offers=offer_batch, scrape_time=config["scrape_time"]
                     # )
-                offer_batch = []
+                    offer_batch = []
+
+            if len(offer_batch) > 0:
+                logging.info(f"Saving last {len(offer_batch)} offers")
+                offer_writer.put(offer_batch)
+                # handle_store_offer_batch(
+                #    offers=offer_batch, scrape_time=config["scrape_time"]
+                # )
+                # with open(f"./offers_for_save_{config['namespace']}.json", "w") as f:
+                #    json.dump(offer_batch[:12], f, default=str)
+            else:
+                logging.info("No offers to save")
+        finally:
+            offer_writer.close()
     except IncompleteJSONError as e:
         logging.error(e)
         logging.error("Incomplete JSON error")
@@ -124,21 +202,10 @@ def handle_feed_with_config(
             "message": "Incomplete JSON error",
             "error": str(e),
         }
-
-    if len(offer_batch) > 0:
-        logging.info(f"Saving last {len(offer_batch)} offers")
-        if is_book_offers:
-            save_book_offers(offer_batch)
-        else:
-            save_scraped_offers(offer_batch)
-            # handle_store_offer_batch(
-            #    offers=offer_batch, scrape_time=config["scrape_time"]
-            # )
-            # with open(f"./offers_for_save_{config['namespace']}.json", "w") as f:
-            #    json.dump(offer_batch[:12], f, default=str)
-
-    else:
-        logging.info("No offers to save")
+    except Exception as e:
+        # The writer has stopped, so the handle run has the stage times up to the error
+        save_handle_run({**get_handle_run(), "error": str(e)})
+        raise
 
     # update_scrape_batch_status(inserted_scrape_batch, "COMPLETED")
 
@@ -153,6 +220,7 @@ def handle_feed_with_config(
         **config,
         "collection_name": config["collection_name"],
         "scrapeBatchId": scrape_batch_id,
+        "hasChangeset": changeset_state["isComplete"],
     }
     if is_book_offers:
         sns_message_data = {
@@ -177,25 +245,11 @@ def handle_feed_with_config(
             TargetArn=SCRAPER_FEED_HANDLED_TOPIC_ARN,
         )
 
-    end_time = datetime.now()
-
-    handle_run = {
-        **config,
-        "example_items": example_items,
-        "time_elapsed_seconds": (end_time - start_time).total_seconds(),
-        "items_handled": total_offers,
-        "n_filtered_offers": total_filtered_offers,
-        "createdAt": end_time,
-        "updatedAt": end_time,
-        "logs": aws_config.get_log_group_url(),
-        "scrapeBatchId": scrape_batch_id,
-    }
-    if os.getenv("IS_LOCAL"):
-        logging.info({**handle_run, "example_items": example_items[:1]})
-    else:
-        store_handle_run(handle_run)
+    save_handle_run(get_handle_run())
 
     return {
         "items_handled": total_offers,
         "n_filtered_offers": total_filtered_offers,
+        "n_written_offers": write_counts["written"],
+        "n_skipped_offers": write_counts["skipped"],
     }
@@ -1,23 +1,39 @@
 from datetime import timedelta
 import json
 import pydash
-from json.decoder import JSONDecodeError
+from ijson.common import IncompleteJSONError
 import logging
 import os
 from typing import Dict, List, Iterable
 
 from util.helpers import json_handler
-from pymongo.errors import BulkWriteError
 from pymongo.results import InsertManyResult
 from pymongo import UpdateOne
 from config.mongo import get_collection
+from storage.bulk_writer import adaptive_bulk_write
 from storage.db import chunked_iterable
-from scraper_feed.handle_config import fetch_single_handle_config
-from scraper_feed.pricing_history import get_price_difference_update_set
+from scraper_feed.handle_config import get_event_handle_config
+from scraper_feed.pricing_history import (
+    create_price_window,
+    get_price_window,
+    get_updated_price_window,
+)
+from scraper_feed.pricing_history_batch import get_price_difference_update_sets
+from scraper_feed.compact_price_history import (
+    add_price_to_compact_history,
+    create_price_window_from_compact_history,
+    encode_price_history,
+)
 from util.logging import configure_lambda_logging
 from util.utils import log_traceback
 import boto3
-from scraper_feed.helpers import get_provenance_id
+from scraper_feed.helpers import PRICING_OFFER_FIELDS, get_offer_prices
+from scraper_feed.feed_stream import get_peak_rss_mb, iterate_feed_offer_fields
+from scraper_feed.pricing_backfill import (
+    BACKFILL_MAX_WORKERS,
+    BACKFILL_VERSIONS_PER_WRITE,
+    backfill_price_histories,
+)
 from config.vars import PRICING_FEED_HANDLED_TOPIC_ARN
 
 import aws_config
@@ -28,7 +44,7 @@ from amp_types.amp_product import (
     PriceHistoryForOffer,
     PriceHistoryRecord,
 )
-from storage.s3 import get_s3_object, get_s3_object_versions
+from storage.s3 import get_s3_object
 
 import sentry_sdk
 from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
@@ -40,6 +56,9 @@ if not os.getenv("IS_LOCAL"):
 
 configure_lambda_logging()
 
+MAX_PRICING_OFFERS = 200000
+MAX_PRICING_OFFERS_DEV = 512
+
 import time
 
 
@@ -63,47 +82,67 @@ def trigger_scraper_feed_with_config(event: EventHandleConfig, context):
 
     bucket = os.environ["SCRAPER_FEED_BUCKET"]
     key = event["feed_key"]
+    config = get_event_handle_config(event)
     s3_object = get_s3_object(bucket, key)
     scrape_time = s3_object["LastModified"]
     handle_config: HandleConfig = {
-        **event,
+        **config,
         "scrape_time": scrape_time,
         "scrapeBatchId": s3_object["VersionId"],
     }
 
     for x in ["amazon", "shopgun", "computersalg", "cdon"]:
-        if x in event["namespace"]:
+        if x in config["namespace"]:
             return publish_sns_message(handle_config)
 
     trigger_timer = Timer("trigger_scraper_feed_with_config")
 
-    try:
-        file_content = s3_object["Body"].read().decode()
-    except Exception as e:
-        logging.error(e)
-        log_traceback(e)
-        return {"message": f"Could not read s3 file", "error": str(e)}
-    if not file_content:
-        logging.warn("No items in scraper feed")
-        return {"message": "No items in scraped feed"}
+    # Limit the number of offers to avoid too much database load
+    max_offers = (
+        MAX_PRICING_OFFERS_DEV if os.getenv("STAGE") == "dev" else MAX_PRICING_OFFERS
+    )
+    n_offers = 0
+
+    def count_offers(offers: Iterable):
+        nonlocal n_offers
+        for offer in offers:
+            n_offers += 1
+            yield offer
 
-    trigger_timer.time_log("read s3 file")
     try:
-        # Limit the number of offers to avoid too much database load
         result = []
         for chunk in chunked_iterable(
-            json.loads(file_content)[: 512 if os.getenv("STAGE") == "dev" else 200000],
+            count_offers(
+                iterate_feed_offer_fields(
+                    s3_object["Body"], PRICING_OFFER_FIELDS, max_offers
+                )
+            ),
             5000,
         ):
             result.append(handle_offer_chunk(chunk, handle_config))
-        trigger_timer.time_log("finished handle_feed_with_config_for_pricing_series")
+    except IncompleteJSONError as e:
+        if n_offers == 0:
+            logging.warn("No items in scraper feed")
+            return {"message": "No items in scraped feed"}
+        logging.error(e)
+        log_traceback(e)
+        return {"message": "Incomplete JSON error", "error": str(e)}
+    except Exception as e:
+        logging.error(e)
+        log_traceback(e)
+        return {"message": str(e)}
 
+    trigger_timer.time_log("finished handle_feed_with_config_for_pricing_series")
+
+    try:
         publish_sns_message(handle_config)
 
         return {
             "message": "Go Serverless v1.0! Your function executed successfully!",
             "event": event,
             "result": json.dumps(result, default=str),
+            "itemsHandled": n_offers,
+            "peakRssMb": get_peak_rss_mb(),
         }
     except Exception as e:
         logging.error(e)
@@ -126,12 +165,10 @@ def trigger_scraper_feed_pricing_with_history(event, context):
     logging.info(event)
     aws_config.lambda_context = context
 
-    result = []
-
     try:
         key = event["feed_key"]
         provenance = key.split("/")[0]
-        config = fetch_single_handle_config(provenance)
+        config = get_event_handle_config(event)
 
         if not config:
             logging.error(f"No handle config for {provenance}")
@@ -139,29 +176,18 @@ def trigger_scraper_feed_pricing_with_history(event, context):
 
         try:
             bucket = os.environ["SCRAPER_FEED_BUCKET"]
-            versions = get_s3_object_versions(bucket, key)
-            for version in versions:
-                logging.debug(f"version: {version}")
-                version_data = version.get()
-                logging.debug(json.dumps(version_data, default=str))
-                scrape_time = version_data.get("LastModified")
-                file_content = version_data["Body"].read().decode()
-                try:
-                    result.append(
-                        handle_feed_with_config_for_pricing_series(
-                            json.loads(file_content),
-                            {**config, "scrape_time": scrape_time},
-                            use_history=False,
-                        )
-                    )
-                except JSONDecodeError:
-                    # Means empty S3 file
-                    pass
-                except BulkWriteError as e:
-                    # Means duplicate pricing object for one day
-                    log_traceback(e)
-                    pass
-            logging.info(f"Ran pricing for {len(result)} feeds")
+            result = backfill_price_histories(
+                bucket,
+                key,
+                config,
+                max_workers=event.get("maxWorkers", BACKFILL_MAX_WORKERS),
+                versions_per_write=event.get(
+                    "versionsPerWrite", BACKFILL_VERSIONS_PER_WRITE
+                ),
+                restart=event.get("restart", False),
+                context=context,
+            )
+            logging.info(f"Ran pricing for {result['versions']} feeds")
 
         except Exception as e:
             logging.error(e)
@@ -192,16 +218,9 @@ def handle_feed_with_config_for_pricing_series(
 
     handle_timer = Timer("handle_feed_with_config_for_pricing_series")
 
-    for offer in feed:
-        sku = get_provenance_id(offer)
-        if not sku:
-            continue
-        uri = get_product_uri(config["namespace"], sku)
-        if not offer.get("price") > 0:
-            continue
-
+    for uri, price in get_offer_prices(feed, config["namespace"]).items():
         pricing_object_map[uri] = {
-            "price": offer["price"],
+            "price": price,
             "date": scrape_time_string,
         }
 
@@ -210,11 +229,27 @@ def handle_feed_with_config_for_pricing_series(
     pricing_collection = get_collection("offerpricinghistories")
     price_history_map: Dict[str, PriceHistoryForOffer] = {}
     if use_history:
+        # The full history is only needed for offers without an up to date price window
+        # or a compact history to create it from
         existing_price_histories: List[PriceHistoryForOffer] = pricing_collection.find(
-            {"uri": {"$in": list(pricing_object_map.keys())}}
+            {"uri": {"$in": list(pricing_object_map.keys())}}, {"history": 0}
         )
+        uris_without_price_window = []
         for price_history in existing_price_histories:
             price_history_map[price_history["uri"]] = price_history
+            if get_price_window(price_history, scrape_time) is not None:
+                continue
+            if price_history.get("compactHistory"):
+                price_history["priceWindow"] = create_price_window_from_compact_history(
+                    price_history["compactHistory"], scrape_time
+                )
+            else:
+                uris_without_price_window.append(price_history["uri"])
+        if len(uris_without_price_window) > 0:
+            for price_history in pricing_collection.find(
+                {"uri": {"$in": uris_without_price_window}}
+            ):
+                price_history_map[price_history["uri"]] = price_history
     else:
         pass
     handle_timer.time_log("got existing price histories")
@@ -222,17 +257,36 @@ def handle_feed_with_config_for_pricing_series(
     updates = []
     offer_updates = []
 
+    uris_with_history = list(x for x in pricing_object_map if x in price_history_map)
+    update_set_map = dict(
+        zip(
+            uris_with_history,
+            get_price_difference_update_sets(
+                list(price_history_map[x] for x in uris_with_history),
+                config,
+                list(pricing_object_map[x]["price"] for x in uris_with_history),
+            ),
+        )
+    )
+    handle_timer.time_log("computed price differences")
+
     for uri, pricing_object in pricing_object_map.items():
         price_history = price_history_map.get(uri, None)
         if price_history:
-            update_set = get_price_difference_update_set(
-                price_history, config, pricing_object["price"]
-            )
+            update_set = update_set_map[uri]
             updates.append(
                 UpdateOne(
                     {"uri": uri},
                     {
-                        "$set": update_set,
+                        "$set": {
+                            **update_set,
+                            "priceWindow": get_updated_price_window(
+                                price_history, pricing_object, scrape_time
+                            ),
+                            **get_compact_history_update_set(
+                                price_history, pricing_object
+                            ),
+                        },
                         "$addToSet": {"history": pricing_object},
                     },
                 )
@@ -266,7 +320,28 @@ def handle_feed_with_config_for_pricing_series(
                     },
                 )
             )
+        elif use_history:
+            updates.append(
+                UpdateOne(
+                    {"uri": uri},
+                    {
+                        "$set": {
+                            "siteCollection": config["collection_name"],
+                            "updatedAt": scrape_time,
+                            "latestPrice": pricing_object["price"],
+                            "priceWindow": create_price_window(
+                                [pricing_object], scrape_time
+                            ),
+                            "compactHistory": encode_price_history([pricing_object]),
+                        },
+                        "$addToSet": {"history": pricing_object},
+                    },
+                    upsert=True,
+                )
+            )
         else:
+            # The history is not read, so a stored price window and compact history can't
+            # be updated. They are removed and recreated from the full history later.
             updates.append(
                 UpdateOne(
                     {"uri": uri},
@@ -277,6 +352,7 @@ def handle_feed_with_config_for_pricing_series(
                             "latestPrice": pricing_object["price"],
                         },
                         "$addToSet": {"history": pricing_object},
+                        "$unset": {"priceWindow": "", "compactHistory": ""},
                     },
                     upsert=True,
                 )
@@ -285,23 +361,36 @@ def handle_feed_with_config_for_pricing_series(
 
     offer_collection = get_collection("mpnoffers")
 
-    result = None
-
     if os.getenv("STAGE") == "dev":
-        if len(offer_updates) > 0:
-            offer_collection.bulk_write(offer_updates[:512])
-        if len(updates) > 0:
-            result = pricing_collection.bulk_write(updates[:512])
-    else:
-        if len(offer_updates) > 0:
-            offer_collection.bulk_write(offer_updates)
-        if len(updates) > 0:
-            result = pricing_collection.bulk_write(updates)
+        offer_updates = offer_updates[:512]
+        updates = updates[:512]
+    adaptive_bulk_write(offer_collection, offer_updates)
+    result = adaptive_bulk_write(pricing_collection, updates)
     handle_timer.time_log("wrote updates to db")
 
     logging.debug(result)
 
-    return result.matched_count
+    return result["nMatched"]
+
+
+def get_compact_history_update_set(
+    price_history: PriceHistoryForOffer, pricing_object: PriceHistoryRecord
+):
+    """
+    The compact history is only written when the whole history is known,
+    otherwise the offer is left for migrate_price_histories.
+    """
+    if price_history.get("compactHistory"):
+        compact_history = add_price_to_compact_history(
+            price_history["compactHistory"], pricing_object
+        )
+    elif "history" in price_history:
+        compact_history = encode_price_history(
+            [*price_history["history"], pricing_object]
+        )
+    else:
+        return {}
+    return {"compactHistory": compact_history}
 
 
 def handle_feed_with_config_for_pricing(
@@ -1,10 +1,15 @@
 import re
+from typing import Dict, Iterable
 from urllib.parse import urlparse
 from gtin import has_valid_check_digit
 
 from util.enums import currency_codes
+from util.helpers import get_product_uri
 from amp_types.amp_product import ScraperOffer, PricingField
 
+# The only offer fields used by get_offer_prices
+PRICING_OFFER_FIELDS = ("provenanceId", "sku", "id", "url", "price")
+
 
 def get_product_pricing(product: ScraperOffer) -> PricingField:
     currency = product.get("priceCurrency") or product.get("currency") or ""
@@ -111,6 +116,22 @@ def get_provenance_id(product):
     return next(x for x in candidates if x)
 
 
+def get_offer_prices(offers: Iterable[ScraperOffer], namespace: str) -> Dict[str, float]:
+    """
+    Returns the price of each offer with a positive price by its uri.
+    """
+    result = {}
+    for offer in offers:
+        sku = get_provenance_id(offer)
+        if not sku:
+            continue
+        price = offer.get("price")
+        if not price or not price > 0:
+            continue
+        result[get_product_uri(namespace, sku)] = price
+    return result
+
+
 def get_stock_status(product):
     availability = product.get("availability")
     if availability is None:
@@ -0,0 +1,117 @@
+import logging
+import time
+from typing import List
+
+from bson.raw_bson import RawBSONDocument
+from pymongo import UpdateOne
+
+import aws_config
+from config.mongo import get_collection
+from scraper_feed.compact_price_history import encode_price_history
+from storage.bulk_writer import adaptive_bulk_write
+from storage.db import chunked_iterable
+from util.logging import configure_lambda_logging
+
+configure_lambda_logging()
+
+# Stop a migration run this long before the Lambda times out
+MIGRATION_TIME_MARGIN_MILLIS = 60 * 1000
+
+
+def get_migration_update(price_history: dict) -> UpdateOne:
+    """
+    Sets compactHistory from the history that was read. The update only matches when
+    the history is unchanged since it was read, so a price added by the pricing feed in
+    between is not left out of compactHistory. Such documents are migrated in the next
+    run. Empty histories get compactHistory None, so they are not read again.
+    """
+    history = price_history.get("history")
+    return UpdateOne(
+        {
+            "_id": price_history["_id"],
+            "compactHistory": {"$exists": False},
+            "updatedAt": price_history.get("updatedAt"),
+            # None also matches a missing history
+            "history": {"$size": len(history)} if history is not None else None,
+        },
+        {"$set": {"compactHistory": encode_price_history(history or [])}},
+    )
+
+
+def migrate_price_histories(batch_size=1000, limit=None, context=None):
+    """
+    Adds compactHistory to the price histories that don't have it yet.
+    Only documents without compactHistory are read, so an unfinished migration
+    continues where it stopped when it is started again.
+    """
+    collection = get_collection("offerpricinghistories")
+    cursor = collection.find(
+        {"compactHistory": {"$exists": False}},
+        {"uri": 1, "history": 1, "updatedAt": 1},
+    )
+    if limit:
+        cursor = cursor.limit(limit)
+
+    n_read = 0
+    n_migrated = 0
+    n_changed = 0
+    is_done = True
+    for chunk in chunked_iterable(cursor, batch_size):
+        updates = list(get_migration_update(x) for x in chunk)
+        write_result = adaptive_bulk_write(collection, updates, batch_size=batch_size)
+        n_read += len(updates)
+        n_migrated += write_result["nModified"]
+        n_changed += len(updates) - write_result["nMatched"] - write_result["nFailed"]
+        logging.info(f"Migrated {n_migrated} price histories")
+        if (
+            context
+            and context.get_remaining_time_in_millis() < MIGRATION_TIME_MARGIN_MILLIS
+        ):
+            is_done = False
+            break
+    cursor.close()
+    if limit and n_read >= limit:
+        # There may be more documents after the limit
+        is_done = False
+    if n_read > n_migrated:
+        # Histories that changed after they were read, or failed, are left for the next run
+        is_done = False
+
+    return {"migrated": n_migrated, "changed": n_changed, "done": is_done}
+
+
+def migrate_price_histories_trigger(event, context):
+    logging.info("event")
+    logging.info(event)
+    aws_config.lambda_context = context
+    if event.get("compareUris"):
+        return compare_price_history_layouts(event["compareUris"])
+    return migrate_price_histories(
+        batch_size=event.get("batchSize", 1000),
+        limit=event.get("limit"),
+        context=context,
+    )
+
+
+def compare_price_history_layouts(uris: List[str]):
+    """
+    Measures the time to fetch and the BSON bytes transferred for the price histories
+    of the uris with the history array and with compactHistory.
+    """
+    collection = get_collection("offerpricinghistories")
+    collection = collection.with_options(
+        codec_options=collection.codec_options.with_options(
+            document_class=RawBSONDocument
+        )
+    )
+    result = {}
+    for layout in ["history", "compactHistory"]:
+        start = time.perf_counter()
+        documents = list(collection.find({"uri": {"$in": uris}}, {"uri": 1, layout: 1}))
+        result[layout] = {
+            "seconds": time.perf_counter() - start,
+            "bytes": sum(len(x.raw) for x in documents),
+            "documents": len(documents),
+        }
+    logging.info(result)
+    return result
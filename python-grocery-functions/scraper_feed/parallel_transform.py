@@ -0,0 +1,241 @@
+import logging
+import queue
+import threading
+import traceback
+from collections import deque
+from itertools import islice
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from typing import (
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+import pydash
+
+from amp_types.amp_product import (
+    HandleConfig,
+    IngredientType,
+    MpnOffer,
+    ScraperOffer,
+)
+from parsing.ingredient_matcher import IngredientMatcher
+from parsing.quantity_extraction import (
+    add_quantity_cache_stats,
+    get_quantity_cache_stats,
+    reset_quantity_cache_stats,
+)
+from scraper_feed.filters import (
+    OfferPredicate,
+    compile_filters,
+    compile_prefilter,
+    transform_product,
+)
+
+# Number of raw offers sent to a worker process at a time.
+TRANSFORM_BATCH_SIZE = 100
+# Number of batches in flight per worker, which bounds how far ahead of the
+# consumer the feed is read.
+BATCHES_IN_FLIGHT_PER_WORKER = 2
+
+# The transformed offer is None for offers that were filtered away before the transform
+TransformResult = Tuple[Optional[MpnOffer], bool]
+
+
+def _transform_and_filter(
+    offer: ScraperOffer,
+    config: HandleConfig,
+    ingredients_data: Mapping[str, IngredientType],
+    ingredients_matcher: Optional[IngredientMatcher],
+    is_kept: OfferPredicate,
+    is_kept_before_transform: Optional[Callable[[ScraperOffer], bool]],
+) -> TransformResult:
+    if is_kept_before_transform and not is_kept_before_transform(offer):
+        return None, False
+    transformed_offer = transform_product(
+        offer=offer,
+        config=config,
+        ingredients_data=ingredients_data,
+        ingredients_matcher=ingredients_matcher,
+    )
+    return transformed_offer, is_kept(transformed_offer)
+
+
+def _run_worker(
+    connection: Connection,
+    config: HandleConfig,
+    ingredients_data: Mapping[str, IngredientType],
+    ingredients_matcher: Optional[IngredientMatcher],
+):
+    """
+    Transforms the batches received on the connection and sends back the results in
+    the same order. None stops the worker, which then sends its quantity cache stats.
+    Batches are received in a thread, so that the parent can send the next batch
+    while a result waits to be read.
+    """
+    # Predicates can't be pickled, so each worker compiles the filters itself
+    is_kept = compile_filters(pydash.get(config, ["filters"], []))
+    is_kept_before_transform = compile_prefilter(config)
+    reset_quantity_cache_stats()
+    batches = queue.Queue()
+
+    def receive():
+        try:
+            while True:
+                batch = connection.recv()
+                batches.put(batch)
+                if batch is None:
+                    return
+        except EOFError:
+            batches.put(None)
+
+    threading.Thread(target=receive, daemon=True).start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                connection.send(("stats", get_quantity_cache_stats()))
+                return
+            connection.send(
+                (
+                    "result",
+                    list(
+                        _transform_and_filter(
+                            offer,
+                            config,
+                            ingredients_data,
+                            ingredients_matcher,
+                            is_kept,
+                            is_kept_before_transform,
+                        )
+                        for offer in batch
+                    ),
+                )
+            )
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+class TransformWorker:
+    def __init__(self, *args):
+        self.connection, worker_connection = Pipe()
+        self.process = Process(
+            target=_run_worker, args=(worker_connection, *args), daemon=True
+        )
+        self.process.start()
+        worker_connection.close()
+
+    def send(self, batch: Optional[List[ScraperOffer]]):
+        self.connection.send(batch)
+
+    def receive(self, kind: str):
+        received_kind, value = self.connection.recv()
+        if received_kind == "error":
+            raise Exception(f"Transform worker failed: {value}")
+        if received_kind != kind:
+            raise Exception(f"Transform worker sent {received_kind}, expected {kind}")
+        return value
+
+    def stop(self, is_finished: bool):
+        """
+        Adds the quantity cache stats of the worker to this process when it finished
+        all its batches, otherwise the worker is terminated.
+        """
+        try:
+            if is_finished:
+                self.send(None)
+                add_quantity_cache_stats(self.receive("stats"))
+        finally:
+            self.connection.close()
+            if not is_finished:
+                self.process.terminate()
+            self.process.join()
+
+
+def get_parallel_workers(config: HandleConfig) -> int:
+    workers = config.get("parallelWorkers", 0)
+    if type(workers) is not int or workers < 2:
+        return 0
+    return workers
+
+
+def transform_offers(
+    offers: Iterable[ScraperOffer],
+    config: HandleConfig,
+    ingredients_data: Mapping[str, IngredientType],
+    ingredients_matcher: Optional[IngredientMatcher] = None,
+    workers: int = 0,
+) -> Iterator[TransformResult]:
+    """
+    Transforms and filters the offers, yielding (transformed_offer, should_keep) for every
+    offer in the same order as the input.
+    When all the filters can be evaluated before the transform, offers that are
+    filtered away are not transformed, and are yielded as (None, False).
+    With workers, batches of offers are transformed in worker processes. The config,
+    ingredients data and matcher are sent to each worker once when it starts.
+    The workers use Process and Pipe rather than a process pool, since pools need
+    /dev/shm for their semaphores, which AWS Lambda doesn't have. The quantity cache
+    hits and misses of the workers are added to the ones of this process.
+    Falls back to transforming in this process if the workers can't be started.
+    """
+    transform_workers: List[TransformWorker] = []
+    if workers:
+        try:
+            for _ in range(workers):
+                transform_workers.append(
+                    TransformWorker(config, ingredients_data, ingredients_matcher)
+                )
+        except OSError as e:
+            logging.warning(
+                f"Could not start transform workers, transforming serially: {e}"
+            )
+            for worker in transform_workers:
+                worker.stop(is_finished=False)
+            transform_workers = []
+
+    if not transform_workers:
+        is_kept = compile_filters(pydash.get(config, ["filters"], []))
+        is_kept_before_transform = compile_prefilter(config)
+        for offer in offers:
+            yield _transform_and_filter(
+                offer,
+                config,
+                ingredients_data,
+                ingredients_matcher,
+                is_kept,
+                is_kept_before_transform,
+            )
+        return
+
+    offers = iter(offers)
+    # The workers of the batches in flight, in the order the batches were read
+    pending: Deque[TransformWorker] = deque()
+    max_pending = workers * BATCHES_IN_FLIGHT_PER_WORKER
+    n_batches = 0
+    is_finished = False
+    try:
+        while True:
+            while len(pending) < max_pending:
+                batch = list(islice(offers, TRANSFORM_BATCH_SIZE))
+                if not batch:
+                    break
+                # Each worker gets every n-th batch and sends back results in order
+                worker = transform_workers[n_batches % workers]
+                worker.send(batch)
+                pending.append(worker)
+                n_batches += 1
+            if not pending:
+                break
+            yield from pending.popleft().receive("result")
+        is_finished = True
+    finally:
+        for worker in transform_workers:
+            worker.stop(is_finished)
@@ -0,0 +1,168 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+from ijson.common import IncompleteJSONError
+from pymongo import UpdateOne
+
+from amp_types.amp_product import HandleConfig
+from config.mongo import get_collection
+from scraper_feed.feed_stream import iterate_feed_offer_fields
+from scraper_feed.helpers import PRICING_OFFER_FIELDS, get_offer_prices
+from storage.bulk_writer import adaptive_bulk_write
+from storage.db import chunked_iterable
+from storage.s3 import get_s3_object, list_s3_object_versions
+
+BACKFILL_MAX_WORKERS = 8
+# Number of feed versions merged in memory before they are written in one bulk upsert
+BACKFILL_VERSIONS_PER_WRITE = 30
+# Stop a backfill run this long before the Lambda times out
+BACKFILL_TIME_MARGIN_MILLIS = 2 * 60 * 1000
+
+
+def get_version_prices(
+    bucket: str, key: str, version_id: str, namespace: str
+) -> Dict[str, float]:
+    s3_object = get_s3_object(bucket, key, version_id)
+    try:
+        return get_offer_prices(
+            iterate_feed_offer_fields(s3_object["Body"], PRICING_OFFER_FIELDS),
+            namespace,
+        )
+    except IncompleteJSONError:
+        # Means empty or incomplete S3 file
+        logging.warning(f"Skipping incomplete feed version {version_id}")
+        return {}
+
+
+def get_backfill_updates(
+    price_maps: Dict[str, Dict[str, float]],
+    updated_at_map: Dict[str, datetime],
+    config: HandleConfig,
+) -> List[UpdateOne]:
+    """
+    One upsert per offer that adds all its backfilled prices to the history at once.
+    The backfilled prices can be older than the latest price, so latestPrice is only set
+    for new offers. The price window and compact history can't be updated without
+    reading the history, so they are removed and recreated from the full history later.
+    """
+    result = []
+    for uri, price_map in price_maps.items():
+        dates = sorted(price_map.keys())
+        result.append(
+            UpdateOne(
+                {"uri": uri},
+                {
+                    "$set": {"siteCollection": config["collection_name"]},
+                    "$setOnInsert": {"latestPrice": price_map[dates[-1]]},
+                    "$max": {"updatedAt": updated_at_map[uri]},
+                    "$addToSet": {
+                        "history": {
+                            "$each": list(
+                                {"price": price_map[date], "date": date}
+                                for date in dates
+                            )
+                        }
+                    },
+                    "$unset": {"priceWindow": "", "compactHistory": ""},
+                },
+                upsert=True,
+            )
+        )
+    return result
+
+
+def backfill_price_histories(
+    bucket: str,
+    key: str,
+    config: HandleConfig,
+    max_workers: int = BACKFILL_MAX_WORKERS,
+    versions_per_write: int = BACKFILL_VERSIONS_PER_WRITE,
+    restart: bool = False,
+    context=None,
+):
+    """
+    Adds the prices of every version of a feed to the price histories.
+    Versions are fetched and streamed concurrently and merged into date to price maps per
+    offer, oldest first, so a later version of the same day replaces the earlier price.
+    After each versions_per_write versions the merged prices are written with one bulk
+    upsert, and the last written VersionId is stored as a checkpoint. A new run continues
+    after the checkpoint unless restart is set.
+    The checkpoint is only moved past chunks that were written without failures. The run
+    stops at the first chunk with failed writes, and the next run starts with that chunk.
+    """
+    versions = list_s3_object_versions(bucket, key)
+    checkpoint_collection = get_collection("pricingbackfillcheckpoints")
+    checkpoint = None if restart else checkpoint_collection.find_one({"feedKey": key})
+    if checkpoint:
+        version_ids = list(x["VersionId"] for x in versions)
+        if checkpoint["lastVersionId"] in version_ids:
+            versions = versions[version_ids.index(checkpoint["lastVersionId"]) + 1 :]
+        logging.info(f"Continuing backfill after version {checkpoint['lastVersionId']}")
+
+    pricing_collection = get_collection("offerpricinghistories")
+    n_versions = 0
+    n_offer_updates = 0
+    n_failed = 0
+    last_version_id = checkpoint["lastVersionId"] if checkpoint else None
+    is_done = True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for version_chunk in chunked_iterable(versions, versions_per_write):
+            price_maps: Dict[str, Dict[str, float]] = {}
+            updated_at_map: Dict[str, datetime] = {}
+            version_prices_list = executor.map(
+                lambda x: get_version_prices(
+                    bucket, key, x["VersionId"], config["namespace"]
+                ),
+                version_chunk,
+            )
+            # executor.map returns the results in the order of the versions
+            for version, version_prices in zip(version_chunk, version_prices_list):
+                scrape_time = version["LastModified"]
+                date = scrape_time.strftime("%Y-%m-%d")
+                for uri, price in version_prices.items():
+                    price_maps.setdefault(uri, {})[date] = price
+                    updated_at_map[uri] = scrape_time
+
+            updates = get_backfill_updates(price_maps, updated_at_map, config)
+            write_result = adaptive_bulk_write(pricing_collection, updates)
+            n_failed += write_result["nFailed"]
+            if write_result["nFailed"] > 0:
+                # The checkpoint stays before the chunk, so the next run writes it again
+                logging.error(
+                    f"Failed to write {write_result['nFailed']} offers, stopping backfill"
+                )
+                is_done = False
+                break
+            n_versions += len(version_chunk)
+            n_offer_updates += len(updates)
+            last_version_id = version_chunk[-1]["VersionId"]
+            checkpoint_collection.update_one(
+                {"feedKey": key},
+                {
+                    "$set": {
+                        "lastVersionId": last_version_id,
+                        "lastModified": version_chunk[-1]["LastModified"],
+                        "updatedAt": datetime.now(),
+                    }
+                },
+                upsert=True,
+            )
+            logging.info(f"Backfilled {n_versions} of {len(versions)} feed versions")
+
+            if (
+                context
+                and context.get_remaining_time_in_millis() < BACKFILL_TIME_MARGIN_MILLIS
+            ):
+                is_done = n_versions == len(versions)
+                break
+
+    return {
+        "versions": n_versions,
+        "offerUpdates": n_offer_updates,
+        "failedUpdates": n_failed,
+        "lastVersionId": last_version_id,
+        "done": is_done,
+    }
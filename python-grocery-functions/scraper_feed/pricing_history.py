@@ -1,61 +1,137 @@
-from datetime import timedelta
-from typing import List
-from amp_types.amp_product import HandleConfig, PriceHistoryForOffer, PriceHistoryRecord
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import List, Optional
+from amp_types.amp_product import (
+    HandleConfig,
+    PriceHistoryForOffer,
+    PriceHistoryRecord,
+    PriceWindow,
+)
 from statistics import mean
 
 from util.helpers import get_difference_percentage
 
+# The oldest price used in the update set is from 455 days ago, for the previous year's 90 days.
+PRICE_WINDOW_DAYS = 455
+PRICE_MEAN_WINDOW_DAYS = (7, 30, 90, 365)
+
+
+def get_date_string(time: datetime, days_before: int = 0) -> str:
+    return (time - timedelta(days=days_before)).strftime("%Y-%m-%d")
+
+
+def create_price_window(
+    history: List[PriceHistoryRecord], scrape_time: datetime
+) -> PriceWindow:
+    """
+    Creates the price window from the full history of an offer.
+    The window keeps every history record from PRICE_WINDOW_DAYS before scrape_time and
+    later sorted by date, so the update set can be computed without the full history.
+    """
+    sorted_history = sorted(history, key=lambda x: x["date"])
+    start = get_date_string(scrape_time, PRICE_WINDOW_DAYS)
+    return {
+        "start": start,
+        "firstDate": sorted_history[0]["date"] if sorted_history else None,
+        "lastRecord": sorted_history[-1] if sorted_history else None,
+        "prices": list(
+            {"date": x["date"], "price": x["price"]}
+            for x in sorted_history
+            if x["date"] >= start
+        ),
+    }
+
+
+def get_price_window(
+    price_history: PriceHistoryForOffer, scrape_time: datetime
+) -> Optional[PriceWindow]:
+    """
+    Returns the stored price window if it has all the records needed for scrape_time.
+    """
+    price_window = price_history.get("priceWindow")
+    if not price_window:
+        return None
+    if price_window["start"] > get_date_string(scrape_time, PRICE_WINDOW_DAYS):
+        return None
+    return price_window
+
+
+def get_updated_price_window(
+    price_history: PriceHistoryForOffer,
+    pricing_object: PriceHistoryRecord,
+    scrape_time: datetime,
+) -> PriceWindow:
+    """
+    Adds a new record to the price window, the same way $addToSet adds it to the history,
+    and drops the records that are too old to be used from scrape_time on.
+    """
+    price_window = get_price_window(price_history, scrape_time)
+    if price_window is None:
+        price_window = create_price_window(
+            price_history.get("history", []), scrape_time
+        )
+
+    record = {"date": pricing_object["date"], "price": pricing_object["price"]}
+    start = max(price_window["start"], get_date_string(scrape_time, PRICE_WINDOW_DAYS))
+    prices = list(x for x in price_window["prices"] if x["date"] >= start)
+    first_date = price_window["firstDate"]
+    last_record = price_window["lastRecord"]
+    if record["date"] >= start:
+        is_new_record = record not in prices
+    else:
+        is_new_record = record != last_record
+    if is_new_record:
+        if record["date"] >= start:
+            dates = list(x["date"] for x in prices)
+            prices.insert(bisect_right(dates, record["date"]), record)
+        if first_date is None or record["date"] < first_date:
+            first_date = record["date"]
+        if last_record is None or record["date"] >= last_record["date"]:
+            last_record = record
+
+    return {
+        "start": start,
+        "firstDate": first_date,
+        "lastRecord": last_record,
+        "prices": prices,
+    }
+
 
 def get_price_difference_update_set(
     price_history: PriceHistoryForOffer, config: HandleConfig, current_price: float
 ):
     scrape_time = config["scrape_time"]
-    scrape_time_string = scrape_time.strftime("%Y-%m-%d")
-    scrape_time_minus_7_days = scrape_time - timedelta(days=7)
-    scrape_time_minus_30_days = scrape_time - timedelta(days=30)
-    scrape_time_minus_90_days = scrape_time - timedelta(days=90)
-    scrape_time_minus_180_days = scrape_time - timedelta(days=180)
-    scrape_time_minus_365_days = scrape_time - timedelta(days=365)
-    scrape_time_minus_455_days = scrape_time - timedelta(days=455)
-    scrape_time_minus_7_days_string = scrape_time_minus_7_days.strftime("%Y-%m-%d")
-    scrape_time_minus_30_days_string = scrape_time_minus_30_days.strftime("%Y-%m-%d")
-    scrape_time_minus_90_days_string = scrape_time_minus_90_days.strftime("%Y-%m-%d")
-    scrape_time_minus_180_days_string = scrape_time_minus_180_days.strftime("%Y-%m-%d")
-    scrape_time_minus_365_days_string = scrape_time_minus_365_days.strftime("%Y-%m-%d")
-    scrape_time_minus_455_days_string = scrape_time_minus_455_days.strftime("%Y-%m-%d")
-
-    sorted_price_history = sorted(price_history["history"], key=lambda x: x["date"])
-    prev_year_last_90_days_prices = list(
-        x
-        for x in sorted_price_history
-        if x["date"] >= scrape_time_minus_455_days_string
-        and x["date"] < scrape_time_minus_365_days_string
-    )
-    last_365_days_prices = list(
-        x
-        for x in sorted_price_history
-        if x["date"] >= scrape_time_minus_365_days_string
-        and x["date"] < scrape_time_string
-    )
-    last_90_days_prices = list(
-        x
-        for x in last_365_days_prices
-        if x["date"] >= scrape_time_minus_90_days_string
-        and x["date"] < scrape_time_string
-    )
-    last_30_days_prices = list(
-        x
-        for x in last_90_days_prices
-        if x["date"] >= scrape_time_minus_30_days_string
-        and x["date"] < scrape_time_string
-    )
-    last_7_days_prices = list(
-        x
-        for x in last_30_days_prices
-        if x["date"] >= scrape_time_minus_7_days_string
-        and x["date"] < scrape_time_string
+    scrape_time_string = get_date_string(scrape_time)
+    prev_year_start_string = get_date_string(scrape_time, 455)
+    prev_year_end_string = get_date_string(scrape_time, 365)
+    window_start_strings = dict(
+        (days, get_date_string(scrape_time, days)) for days in PRICE_MEAN_WINDOW_DAYS
     )
 
+    price_window = get_price_window(price_history, scrape_time)
+    if price_window is None:
+        price_window = create_price_window(price_history["history"], scrape_time)
+
+    # Running sums and counts of the prices in each window, in one pass over the window
+    prev_year_sum = 0
+    prev_year_count = 0
+    window_sums = dict((days, 0) for days in PRICE_MEAN_WINDOW_DAYS)
+    window_counts = dict((days, 0) for days in PRICE_MEAN_WINDOW_DAYS)
+    for x in price_window["prices"]:
+        date = x["date"]
+        if date >= scrape_time_string:
+            break
+        if date < prev_year_start_string:
+            continue
+        if date < prev_year_end_string:
+            prev_year_sum += x["price"]
+            prev_year_count += 1
+            continue
+        for days in PRICE_MEAN_WINDOW_DAYS:
+            if date >= window_start_strings[days]:
+                window_sums[days] += x["price"]
+                window_counts[days] += 1
+
     update_set = {
         "siteCollection": config["collection_name"],
         "updatedAt": scrape_time,
@@ -78,81 +154,41 @@ def get_price_difference_update_set(
         "differencePrevYear90DaysMean": 0,
         "differencePrevYear90DaysPercentage": 0,
     }
-    if len(sorted_price_history) > 0:
-        previous_pricing = sorted_price_history[-1]
-        earliest_pricing = sorted_price_history[0]
-        if scrape_time_string > previous_pricing["date"] or True:
-            price_difference = current_price - previous_pricing["price"]
-            price_difference_percentage = get_difference_percentage(
-                previous_pricing["price"], current_price
-            )
+    if price_window["lastRecord"] is not None:
+        previous_pricing = price_window["lastRecord"]
+        earliest_date = price_window["firstDate"]
+        price_difference = current_price - previous_pricing["price"]
+        price_difference_percentage = get_difference_percentage(
+            previous_pricing["price"], current_price
+        )
 
-            update_set["difference"] = price_difference
-            update_set["differencePercentage"] = price_difference_percentage
+        update_set["difference"] = price_difference
+        update_set["differencePercentage"] = price_difference_percentage
 
-            if len(prev_year_last_90_days_prices) > 0 and len(last_90_days_prices) > 0:
-                quarter_price = mean(x["price"] for x in last_90_days_prices)
-                differences = get_differences_for_series(
-                    prev_year_last_90_days_prices, quarter_price
-                )
-                update_set["pricePrevYear90DaysMean"] = differences["mean"]
-                update_set["differencePrevYear90DaysMean"] = differences["difference"]
-                update_set["differencePrevYear90DaysPercentage"] = differences[
-                    "differencePercentage"
-                ]
-            if (
-                len(last_7_days_prices) > 0
-                and earliest_pricing["date"] <= scrape_time_minus_7_days_string
-            ):
-                differences = get_differences_for_series(
-                    last_7_days_prices, current_price
-                )
-                update_set["price7DaysMean"] = differences["mean"]
-                update_set["difference7DaysMean"] = differences["difference"]
-                update_set["difference7DaysMeanPercentage"] = differences[
-                    "differencePercentage"
-                ]
-            if (
-                len(last_30_days_prices) > 0
-                and earliest_pricing["date"] <= scrape_time_minus_30_days_string
-            ):
-                differences = get_differences_for_series(
-                    last_30_days_prices, current_price
-                )
-                update_set["price30DaysMean"] = differences["mean"]
-                update_set["difference30DaysMean"] = differences["difference"]
-                update_set["difference30DaysMeanPercentage"] = differences[
-                    "differencePercentage"
-                ]
-            if (
-                len(last_90_days_prices) > 0
-                and earliest_pricing["date"] <= scrape_time_minus_90_days_string
-            ):
-                differences = get_differences_for_series(
-                    last_90_days_prices, current_price
-                )
-                update_set["price90DaysMean"] = differences["mean"]
-                update_set["difference90DaysMean"] = differences["difference"]
-                update_set["difference90DaysMeanPercentage"] = differences[
-                    "differencePercentage"
-                ]
-            if (
-                len(last_365_days_prices) > 0
-                and earliest_pricing["date"] <= scrape_time_minus_365_days_string
-            ):
-                differences = get_differences_for_series(
-                    last_365_days_prices, current_price
+        if prev_year_count > 0 and window_counts[90] > 0:
+            quarter_price = window_sums[90] / window_counts[90]
+            differences = get_differences_for_mean(
+                prev_year_sum / prev_year_count, quarter_price
+            )
+            update_set["pricePrevYear90DaysMean"] = differences["mean"]
+            update_set["differencePrevYear90DaysMean"] = differences["difference"]
+            update_set["differencePrevYear90DaysPercentage"] = differences[
+                "differencePercentage"
+            ]
+        for days in PRICE_MEAN_WINDOW_DAYS:
+            if window_counts[days] > 0 and earliest_date <= window_start_strings[days]:
+                differences = get_differences_for_mean(
+                    window_sums[days] / window_counts[days], current_price
                 )
-                update_set["price365DaysMean"] = differences["mean"]
-                update_set["difference365DaysMean"] = differences["difference"]
-                update_set["difference365DaysMeanPercentage"] = differences[
+                update_set[f"price{days}DaysMean"] = differences["mean"]
+                update_set[f"difference{days}DaysMean"] = differences["difference"]
+                update_set[f"difference{days}DaysMeanPercentage"] = differences[
                     "differencePercentage"
                 ]
     return update_set
 
 
-def get_differences_for_series(prices: List[PriceHistoryRecord], current_price: float):
-    mean_price = mean(x["price"] for x in prices)
+def get_differences_for_mean(mean_price: float, current_price: float):
     difference = current_price - mean_price
     difference_percentage = get_difference_percentage(mean_price, current_price)
 
@@ -161,3 +197,7 @@ def get_differences_for_series(prices: List[PriceHistoryRecord], current_price:
         "difference": difference,
         "differencePercentage": difference_percentage,
     }
+
+
+def get_differences_for_series(prices: List[PriceHistoryRecord], current_price: float):
+    return get_differences_for_mean(mean(x["price"] for x in prices), current_price)
@@ -0,0 +1,115 @@
+from typing import List
+
+import numpy as np
+
+from amp_types.amp_product import HandleConfig, PriceHistoryForOffer
+from scraper_feed.pricing_history import (
+    PRICE_MEAN_WINDOW_DAYS,
+    create_price_window,
+    get_price_window,
+)
+
+
+def get_price_difference_update_sets(
+    price_histories: List[PriceHistoryForOffer],
+    config: HandleConfig,
+    current_prices: List[float],
+) -> List[dict]:
+    """
+    Same as calling get_price_difference_update_set for every price history, but computes
+    the window means and differences for all of them at once with NumPy.
+    The price windows are flattened into arrays of (offer index, day, price) and each
+    window mean is a masked sum per offer divided by a masked count per offer.
+    """
+    scrape_time = config["scrape_time"]
+    n_offers = len(price_histories)
+    if n_offers == 0:
+        return []
+
+    price_windows = list(
+        get_price_window(x, scrape_time)
+        or create_price_window(x["history"], scrape_time)
+        for x in price_histories
+    )
+
+    offer_indexes = np.repeat(
+        np.arange(n_offers), list(len(x["prices"]) for x in price_windows)
+    )
+    days = np.array(
+        list(y["date"] for x in price_windows for y in x["prices"]),
+        dtype="datetime64[D]",
+    )
+    prices = np.array(
+        list(y["price"] for x in price_windows for y in x["prices"]), dtype=float
+    )
+
+    today = np.datetime64(scrape_time.strftime("%Y-%m-%d"), "D")
+    is_before_today = days < today
+
+    def get_sums_and_counts(mask):
+        sums = np.bincount(offer_indexes, weights=prices * mask, minlength=n_offers)
+        counts = np.bincount(offer_indexes, weights=mask, minlength=n_offers)
+        return sums, counts
+
+    has_history = np.array(list(x["lastRecord"] is not None for x in price_windows))
+    first_days = np.array(
+        list(x["firstDate"] or "NaT" for x in price_windows), dtype="datetime64[D]"
+    )
+    previous_prices = np.array(
+        list(
+            x["lastRecord"]["price"] if x["lastRecord"] else np.nan
+            for x in price_windows
+        ),
+        dtype=float,
+    )
+    current = np.array(current_prices, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns = {
+            "difference": np.where(has_history, current - previous_prices, 0),
+            "differencePercentage": np.where(
+                has_history, (current - previous_prices) / previous_prices * 100, 0
+            ),
+        }
+
+        window_means = {}
+        for window_days in PRICE_MEAN_WINDOW_DAYS:
+            start = today - np.timedelta64(window_days, "D")
+            sums, counts = get_sums_and_counts((days >= start) & is_before_today)
+            window_means[window_days] = sums / counts
+            is_used = has_history & (counts > 0) & (first_days <= start)
+            means = window_means[window_days]
+            columns[f"price{window_days}DaysMean"] = np.where(is_used, means, 0)
+            columns[f"difference{window_days}DaysMean"] = np.where(
+                is_used, current - means, 0
+            )
+            columns[f"difference{window_days}DaysMeanPercentage"] = np.where(
+                is_used, (current - means) / means * 100, 0
+            )
+
+        prev_year_sums, prev_year_counts = get_sums_and_counts(
+            (days >= today - np.timedelta64(455, "D"))
+            & (days < today - np.timedelta64(365, "D"))
+        )
+        prev_year_means = prev_year_sums / prev_year_counts
+        quarter_means = window_means[90]
+        is_used = has_history & (prev_year_counts > 0) & np.isfinite(quarter_means)
+        columns["pricePrevYear90DaysMean"] = np.where(is_used, prev_year_means, 0)
+        columns["differencePrevYear90DaysMean"] = np.where(
+            is_used, quarter_means - prev_year_means, 0
+        )
+        columns["differencePrevYear90DaysPercentage"] = np.where(
+            is_used, (quarter_means - prev_year_means) / prev_year_means * 100, 0
+        )
+
+    # Convert to lists of Python numbers, which can be stored in Mongo
+    columns = dict((key, value.tolist()) for key, value in columns.items())
+    return list(
+        {
+            "siteCollection": config["collection_name"],
+            "updatedAt": scrape_time,
+            "latestPrice": current_prices[i],
+            **dict((key, value[i]) for key, value in columns.items()),
+        }
+        for i in range(n_offers)
+    )
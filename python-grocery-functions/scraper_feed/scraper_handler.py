@@ -1,7 +1,7 @@
 import json
 import logging
 import os
-from scraper_feed.handle_config import fetch_handle_configs
+from scraper_feed.handle_config import fetch_handle_configs, get_event_handle_config
 from util.logging import configure_lambda_logging
 from util.utils import log_traceback
 import boto3
@@ -34,7 +34,7 @@ def scraper_feed_sns(event, context):
         message_record = sns_message["Records"][0]
         key = message_record["s3"]["object"]["key"]
         provenance = key.split("/")[0]
-        configs = fetch_handle_configs(provenance)
+        configs = fetch_handle_configs(provenance, use_cache=True)
         lambda_client = boto3.client("lambda")  # type: botostubs.Lambda
 
         logging.debug("configs")
@@ -87,7 +87,7 @@ def trigger_scraper_feed(event, context):
     try:
         key = event["feed_key"]
         provenance = key.split("/")[0]
-        configs = fetch_handle_configs(provenance)
+        configs = fetch_handle_configs(provenance, use_cache=True)
         lambda_client = boto3.client("lambda")  # type: botostubs.Lambda
 
         logging.debug("configs")
@@ -142,6 +142,7 @@ def trigger_scraper_feed_with_config(event: EventHandleConfig, context):
     try:
         bucket = os.environ["SCRAPER_FEED_BUCKET"]
         key = event["feed_key"]
+        config = get_event_handle_config(event)
         s3_object = get_s3_object(bucket, key)
         scrape_time = s3_object["LastModified"]
         file_content_stream: botocore.response.StreamingBody = s3_object["Body"]
@@ -158,7 +159,7 @@ def trigger_scraper_feed_with_config(event: EventHandleConfig, context):
         result = handle_feed_with_config(
             file_content_stream,
             {
-                **event,
+                **config,
                 "scrape_time": scrape_time,
                 "scrapeBatchId": s3_object["VersionId"],
             },
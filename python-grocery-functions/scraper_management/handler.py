@@ -79,7 +79,7 @@ def handle_feed(event, context):
     feed_uri = spider_run["feed_uri"]
     feed_key = "/".join(feed_uri.split("/")[-2:])
     provenance = feed_key.split("/")[0]
-    handle_configs = fetch_handle_configs(provenance)
+    handle_configs = fetch_handle_configs(provenance, use_cache=True)
 
     result = []
 
@@ -0,0 +1,115 @@
+from unittest import TestCase
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from storage.bulk_writer import (
+    MAX_BATCH_SIZE,
+    MIN_BATCH_SIZE,
+    TARGET_BATCH_BYTES,
+    adaptive_bulk_write,
+    get_next_batch_size,
+)
+
+
+class FakeResult:
+    def __init__(self, bulk_api_result):
+        self.bulk_api_result = bulk_api_result
+
+
+class FakeCollection:
+    """
+    Collection that fails the operations with the given error codes the first time
+    they are written.
+    """
+
+    name = "fakes"
+
+    def __init__(self, error_codes=None):
+        self.error_codes = dict(error_codes or {})
+        self.calls = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.calls.append(list(operations))
+        write_errors = []
+        for i, operation in enumerate(operations):
+            uri = operation._filter["uri"]
+            if uri in self.error_codes:
+                write_errors.append(
+                    {"index": i, "code": self.error_codes.pop(uri), "errmsg": uri}
+                )
+        result = {
+            "nInserted": 0,
+            "nUpserted": 0,
+            "nMatched": len(operations) - len(write_errors),
+            "nModified": len(operations) - len(write_errors),
+            "nRemoved": 0,
+        }
+        if write_errors:
+            raise BulkWriteError({**result, "writeErrors": write_errors})
+        return FakeResult(result)
+
+
+def get_operations(n):
+    return list(UpdateOne({"uri": str(i)}, {"$set": {"i": i}}) for i in range(n))
+
+
+class TestGetNextBatchSize(TestCase):
+    def test_grows_when_fast(self):
+        self.assertEqual(get_next_batch_size(1000, 100, 0.1), 2000)
+
+    def test_shrinks_when_slow(self):
+        self.assertEqual(get_next_batch_size(1000, 100, 4), 500)
+
+    def test_limited_by_bytes(self):
+        self.assertEqual(get_next_batch_size(1000, TARGET_BATCH_BYTES / 800, 0.1), 800)
+
+    def test_clamped(self):
+        self.assertEqual(get_next_batch_size(100, 100, 100), MIN_BATCH_SIZE)
+        self.assertEqual(get_next_batch_size(MAX_BATCH_SIZE, 1, 0), MAX_BATCH_SIZE)
+
+
+class TestAdaptiveBulkWrite(TestCase):
+    def test_writes_in_batches(self):
+        collection = FakeCollection()
+        result = adaptive_bulk_write(
+            collection, iter(get_operations(250)), batch_size=100
+        )
+        self.assertEqual(result["nMatched"], 250)
+        self.assertEqual(result["nFailed"], 0)
+        self.assertEqual(sum(x["size"] for x in result["batches"]), 250)
+        self.assertEqual(result["batches"][0]["size"], 100)
+        self.assertGreater(result["batches"][0]["estimatedBytes"], 0)
+
+    def test_empty(self):
+        collection = FakeCollection()
+        result = adaptive_bulk_write(collection, [])
+        self.assertEqual(result["nMatched"], 0)
+        self.assertEqual(result["batches"], [])
+        self.assertEqual(collection.calls, [])
+
+    def test_retries_failed_indexes(self):
+        collection = FakeCollection({"3": 11000, "7": 11000})
+        result = adaptive_bulk_write(collection, get_operations(10))
+        self.assertEqual(result["nMatched"], 10)
+        self.assertEqual(result["nFailed"], 0)
+        self.assertEqual(result["batches"][0]["retries"], 1)
+        self.assertEqual(
+            list(x._filter["uri"] for x in collection.calls[1]), ["3", "7"]
+        )
+
+    def test_reports_errors_that_are_not_retryable(self):
+        collection = FakeCollection({"3": 11000, "5": 121})
+        result = adaptive_bulk_write(collection, get_operations(10))
+        self.assertEqual(result["nMatched"], 9)
+        self.assertEqual(result["nFailed"], 1)
+        self.assertEqual(result["errors"], [{"code": 121, "errmsg": "5"}])
+        self.assertEqual(list(x._filter["uri"] for x in collection.calls[1]), ["3"])
+
+    def test_ordered_retries_from_first_error(self):
+        collection = FakeCollection({"3": 11000})
+        result = adaptive_bulk_write(collection, get_operations(5), ordered=True)
+        self.assertEqual(
+            list(x._filter["uri"] for x in collection.calls[1]), ["3", "4"]
+        )
+        self.assertEqual(result["nFailed"], 0)
@@ -0,0 +1,131 @@
+from datetime import datetime
+from unittest import TestCase
+
+from storage.changesets import get_changeset
+from storage.content_hash import (
+    get_changed_offer_updates,
+    get_offer_content_hash,
+    get_offer_content_hashes,
+)
+
+
+def get_offer(**kwargs):
+    return {
+        "uri": "meny:product:1",
+        "title": "Melk",
+        "pricing": {"price": 20.9, "currency": "NOK"},
+        "gtins": {"ean": "7038010000737"},
+        "scrapeBatchId": "batch-1",
+        "validFrom": datetime(2022, 1, 1),
+        "validThrough": datetime(2022, 1, 11),
+        "isRecent": True,
+        **kwargs,
+    }
+
+
+class TestGetOfferContentHash(TestCase):
+    def test_ignores_field_order(self):
+        offer = get_offer()
+        reversed_offer = dict(reversed(list(offer.items())))
+        self.assertEqual(
+            get_offer_content_hash(offer), get_offer_content_hash(reversed_offer)
+        )
+
+    def test_ignores_volatile_fields(self):
+        self.assertEqual(
+            get_offer_content_hash(get_offer()),
+            get_offer_content_hash(
+                get_offer(
+                    scrapeBatchId="batch-2",
+                    validThrough=datetime(2022, 1, 12),
+                    isRecent=False,
+                )
+            ),
+        )
+
+    def test_changes_with_content(self):
+        self.assertNotEqual(
+            get_offer_content_hash(get_offer()),
+            get_offer_content_hash(get_offer(pricing={"price": 21.9})),
+        )
+
+
+def get_existing_hashes(offer):
+    content_hash, group_hashes = get_offer_content_hashes(offer)
+    return {
+        offer["uri"]: {"contentHash": content_hash, "contentGroupHashes": group_hashes}
+    }
+
+
+class TestGetChangedOfferUpdates(TestCase):
+    def test_unchanged_offer_only_sets_volatile_fields(self):
+        updates, changes = get_changed_offer_updates(
+            [get_offer(scrapeBatchId="batch-2")], get_existing_hashes(get_offer())
+        )
+        self.assertEqual(changes, {})
+        self.assertEqual(
+            updates[0]._doc,
+            {
+                "$set": {
+                    "scrapeBatchId": "batch-2",
+                    "validFrom": datetime(2022, 1, 1),
+                    "validThrough": datetime(2022, 1, 11),
+                    "isRecent": True,
+                }
+            },
+        )
+        self.assertFalse(updates[0]._upsert)
+
+    def test_changed_offer_is_upserted_with_hashes(self):
+        changed_offer = get_offer(title="Lettmelk")
+        updates, changes = get_changed_offer_updates(
+            [changed_offer], get_existing_hashes(get_offer())
+        )
+        self.assertEqual(changes, {"meny:product:1": ["text"]})
+        self.assertEqual(updates[0]._doc["$set"]["title"], "Lettmelk")
+        self.assertEqual(
+            updates[0]._doc["$set"]["contentHash"],
+            get_offer_content_hash(changed_offer),
+        )
+        self.assertTrue(updates[0]._upsert)
+
+    def test_changed_groups(self):
+        updates, changes = get_changed_offer_updates(
+            [get_offer(pricing={"price": 21.9}, gtins={}, quantity={"size": 1})],
+            get_existing_hashes(get_offer()),
+        )
+        self.assertEqual(changes, {"meny:product:1": ["pricing", "gtins", "other"]})
+
+    def test_new_offer_has_all_groups(self):
+        updates, changes = get_changed_offer_updates([get_offer()], {})
+        self.assertEqual(
+            changes,
+            {"meny:product:1": ["pricing", "categories", "gtins", "text", "other"]},
+        )
+        self.assertTrue(updates[0]._upsert)
+
+    def test_removed_group_hash_is_changed(self):
+        # The categories handler removes the hashes when the categories of an offer change
+        existing = get_existing_hashes(get_offer())
+        del existing["meny:product:1"]["contentHash"]
+        del existing["meny:product:1"]["contentGroupHashes"]["categories"]
+        updates, changes = get_changed_offer_updates([get_offer()], existing)
+        self.assertEqual(changes, {"meny:product:1": ["categories"]})
+
+
+class TestGetChangeset(TestCase):
+    def test_uris_by_group(self):
+        changeset = get_changeset(
+            "batch-1",
+            {"meny:product:1": ["pricing"], "meny:product:2": ["pricing", "text"]},
+            3,
+        )
+        self.assertEqual(changeset["uris"], ["meny:product:1", "meny:product:2"])
+        self.assertEqual(
+            changeset["groups"],
+            {
+                "pricing": ["meny:product:1", "meny:product:2"],
+                "text": ["meny:product:2"],
+            },
+        )
+        self.assertEqual(changeset["nUnchanged"], 3)
@@ -0,0 +1,41 @@
+from unittest import TestCase
+import threading
+
+from storage.pipelined_writer import PipelinedWriter
+
+
+class TestPipelinedWriter(TestCase):
+    def test_writes_batches_in_order(self):
+        saved = []
+        writer = PipelinedWriter(saved.append)
+        for i in range(5):
+            writer.put([i, i])
+        writer.close()
+        self.assertEqual(saved, [[0, 0], [1, 1], [2, 2], [3, 3], [4, 4]])
+        stage_times = writer.get_stage_times()
+        self.assertEqual(stage_times["write"]["batches"], 5)
+        self.assertEqual(stage_times["write"]["items"], 10)
+        self.assertGreaterEqual(stage_times["transform"]["busySeconds"], 0)
+
+    def test_put_blocks_when_queue_is_full(self):
+        release = threading.Event()
+        writer = PipelinedWriter(lambda batch: release.wait(), max_pending_batches=1)
+        writer.put([1])
+        writer.put([2])
+        blocked_put = threading.Thread(target=writer.put, args=([3],))
+        blocked_put.start()
+        blocked_put.join(0.1)
+        self.assertTrue(blocked_put.is_alive())
+        release.set()
+        blocked_put.join()
+        writer.close()
+        self.assertEqual(writer.get_stage_times()["write"]["batches"], 3)
+
+    def test_error_is_raised(self):
+        def save_batch(batch):
+            raise ValueError("Write failed")
+
+        writer = PipelinedWriter(save_batch)
+        writer.put([1])
+        with self.assertRaises(ValueError):
+            writer.close()
@@ -0,0 +1,148 @@
+import logging
+import time
+from itertools import islice
+from typing import Iterable, List
+
+import bson
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+# Write errors that can succeed when the operation is tried again. Duplicate key errors
+# happen when two upserts with the same filter run at the same time.
+RETRYABLE_WRITE_ERROR_CODES = frozenset(
+    [6, 7, 50, 89, 91, 112, 189, 262, 9001, 10107, 11000, 11600, 11602, 13435, 13436]
+)
+RESULT_COUNT_FIELDS = ("nInserted", "nUpserted", "nMatched", "nModified", "nRemoved")
+
+DEFAULT_BATCH_SIZE = 1000
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 10000
+# Mongo splits bulk writes in messages of at most 48 MB
+TARGET_BATCH_BYTES = 8 * 1024 * 1024
+TARGET_BATCH_SECONDS = 2.0
+MAX_RETRIES = 3
+MAX_REPORTED_ERRORS = 100
+# Number of operations per batch that are encoded to estimate the batch size in bytes
+SIZE_SAMPLE_COUNT = 10
+
+
+def get_operation_bytes(operation) -> int:
+    return len(
+        bson.encode(
+            {
+                "q": getattr(operation, "_filter", None),
+                "u": getattr(operation, "_doc", None),
+            }
+        )
+    )
+
+
+def get_next_batch_size(batch_size: int, operation_bytes: float, seconds: float) -> int:
+    """
+    The largest batch size that is expected to stay below both the target payload size
+    and the target latency, changed by at most a factor of two from the last batch.
+    """
+    size_by_bytes = TARGET_BATCH_BYTES / max(operation_bytes, 1)
+    size_by_latency = batch_size * TARGET_BATCH_SECONDS / max(seconds, 0.001)
+    next_size = min(size_by_bytes, size_by_latency, batch_size * 2)
+    next_size = max(next_size, batch_size / 2)
+    return int(min(max(next_size, MIN_BATCH_SIZE), MAX_BATCH_SIZE))
+
+
+def write_batch(collection: Collection, operations: List, ordered: bool):
+    """
+    Writes one batch and retries the failed operations that can be retried.
+    """
+    metrics = dict((key, 0) for key in RESULT_COUNT_FIELDS)
+    metrics["nFailed"] = 0
+    metrics["retries"] = 0
+    errors = []
+    pending = operations
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            result = collection.bulk_write(pending, ordered=ordered).bulk_api_result
+            pending = []
+        except BulkWriteError as e:
+            result = e.details
+            write_errors = sorted(
+                result.get("writeErrors", []), key=lambda x: x["index"]
+            )
+            retryable = list(
+                x for x in write_errors if x["code"] in RETRYABLE_WRITE_ERROR_CODES
+            )
+            failed = list(
+                x for x in write_errors if x["code"] not in RETRYABLE_WRITE_ERROR_CODES
+            )
+            errors.extend(failed)
+            metrics["nFailed"] += len(failed)
+            if ordered and write_errors:
+                # An ordered write stops at the first error
+                first_error = write_errors[0]
+                if first_error["code"] in RETRYABLE_WRITE_ERROR_CODES:
+                    pending = pending[first_error["index"] :]
+                else:
+                    metrics["nFailed"] += len(pending) - first_error["index"] - 1
+                    pending = []
+            else:
+                pending = list(pending[x["index"]] for x in retryable)
+        for key in RESULT_COUNT_FIELDS:
+            metrics[key] += result.get(key, 0)
+        if not pending:
+            break
+        if attempt < MAX_RETRIES:
+            metrics["retries"] += 1
+            time.sleep(0.1 * 2**attempt)
+    else:
+        metrics["nFailed"] += len(pending)
+
+    for error in errors[:5]:
+        logging.error(f"Write error {error.get('code')}: {error.get('errmsg')}")
+    return metrics, errors
+
+
+def adaptive_bulk_write(
+    collection: Collection,
+    operations: Iterable,
+    ordered: bool = False,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+):
+    """
+    Writes the operations in batches, by default unordered, so that an error in one
+    document doesn't stop the rest of the batch.
+    The batch size adapts to the estimated payload size and the latency of the last batch.
+    Operations that fail with a retryable error are retried by their index in
+    BulkWriteError.details.
+    Returns counts for the whole write and metrics for each batch.
+    """
+    operations = iter(operations)
+    summary = dict((key, 0) for key in RESULT_COUNT_FIELDS)
+    summary["nFailed"] = 0
+    summary["errors"] = []
+    summary["batches"] = []
+    while True:
+        batch = list(islice(operations, batch_size))
+        if not batch:
+            break
+        sample = batch[:SIZE_SAMPLE_COUNT]
+        operation_bytes = sum(get_operation_bytes(x) for x in sample) / len(sample)
+
+        start = time.perf_counter()
+        metrics, errors = write_batch(collection, batch, ordered)
+        seconds = time.perf_counter() - start
+
+        batch_metrics = {
+            "size": len(batch),
+            "estimatedBytes": int(operation_bytes * len(batch)),
+            "seconds": seconds,
+            **metrics,
+        }
+        logging.debug(f"Bulk write to {collection.name}: {batch_metrics}")
+        summary["batches"].append(batch_metrics)
+        for key in [*RESULT_COUNT_FIELDS, "nFailed"]:
+            summary[key] += metrics[key]
+        summary["errors"].extend(
+            {"code": x.get("code"), "errmsg": x.get("errmsg")}
+            for x in errors[: max(MAX_REPORTED_ERRORS - len(summary["errors"]), 0)]
+        )
+        batch_size = get_next_batch_size(len(batch), operation_bytes, seconds)
+    return summary
@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from config.mongo import get_collection
+
+CHANGESET_COLLECTION = "offerchangesets"
+
+
+def get_changeset(
+    scrape_batch_id: str, changes: Dict[str, List[str]], n_unchanged: int
+) -> dict:
+    """
+    A compact changeset for a written batch of offers, with the uris of the changed
+    offers and the uris by changed field group.
+    """
+    groups: Dict[str, List[str]] = {}
+    for uri, changed_groups in changes.items():
+        for group in changed_groups:
+            groups.setdefault(group, []).append(uri)
+    return {
+        "scrapeBatchId": scrape_batch_id,
+        "uris": list(changes.keys()),
+        "groups": groups,
+        "nUnchanged": n_unchanged,
+        "createdAt": datetime.now(),
+    }
+
+
+def save_changeset(
+    scrape_batch_id: str, changes: Dict[str, List[str]], n_unchanged: int
+):
+    """
+    Stores one changeset document per written batch, so that a scrape batch of any size
+    stays below the document size limit.
+    Changesets are found by scrapeBatchId and expire a week after createdAt, with the
+    indexes of express-api/src/mongo-config/offerChangesetsIndexes.ts.
+    """
+    return get_collection(CHANGESET_COLLECTION).insert_one(
+        get_changeset(scrape_batch_id, changes, n_unchanged)
+    )
+
+
+def get_changed_uris(
+    scrape_batch_id: str, groups: Optional[Iterable[str]] = None
+) -> Optional[List[str]]:
+    """
+    The uris of the offers that changed in the scrape batch, or only those where one
+    of the groups changed.
+    Returns None when the scrape batch has no changeset.
+    """
+    changesets = list(
+        get_collection(CHANGESET_COLLECTION).find({"scrapeBatchId": scrape_batch_id})
+    )
+    if len(changesets) == 0:
+        return None
+    result = set()
+    for changeset in changesets:
+        if groups is None:
+            result.update(changeset["uris"])
+        else:
+            for group in groups:
+                result.update(changeset["groups"].get(group, []))
+    return list(result)
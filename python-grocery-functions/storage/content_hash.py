@@ -0,0 +1,109 @@
+import hashlib
+import json
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo import UpdateOne
+
+# Fields that change on every scrape even when the offer itself is unchanged.
+# validFrom and validThrough default to times relative to the scrape time when the
+# feed doesn't have them, and isRecent follows validThrough.
+VOLATILE_OFFER_FIELDS = ("scrapeBatchId", "validFrom", "validThrough", "isRecent")
+CONTENT_HASH_FIELDS = ("contentHash", "contentGroupHashes")
+
+# Groups of stored fields that are hashed separately, so that downstream handlers can
+# tell what changed in an offer. The fields that are not listed are in the group other.
+OFFER_FIELD_GROUPS = {
+    "pricing": ("pricing", "value", "mpnStock"),
+    "categories": ("categories",),
+    "gtins": ("gtins",),
+    "text": (
+        "title",
+        "subtitle",
+        "shortDescription",
+        "description",
+        "brand",
+        "brandKey",
+        "vendor",
+        "vendorKey",
+        "imageUrl",
+    ),
+}
+OTHER_FIELD_GROUP = "other"
+FIELD_GROUP_MAP = dict(
+    (field, group) for group, fields in OFFER_FIELD_GROUPS.items() for field in fields
+)
+
+
+def get_hash(value) -> str:
+    serialized = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(serialized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_offer_content_hashes(offer: dict) -> Tuple[str, Dict[str, str]]:
+    """
+    Stable hashes of the stored fields of an offer, without the volatile fields.
+    Returns a hash of the whole offer and a hash per field group.
+    Keys are sorted, so the hashes don't depend on the order fields were added in.
+    """
+    groups = dict((group, {}) for group in [*OFFER_FIELD_GROUPS, OTHER_FIELD_GROUP])
+    for key, value in offer.items():
+        if key in VOLATILE_OFFER_FIELDS or key in CONTENT_HASH_FIELDS:
+            continue
+        groups[FIELD_GROUP_MAP.get(key, OTHER_FIELD_GROUP)][key] = value
+    group_hashes = dict((group, get_hash(fields)) for group, fields in groups.items())
+    return get_hash(group_hashes), group_hashes
+
+
+def get_offer_content_hash(offer: dict) -> str:
+    return get_offer_content_hashes(offer)[0]
+
+
+def get_changed_offer_updates(
+    offers: Iterable[dict], existing_hashes: Dict[str, dict], id_field: str = "uri"
+) -> Tuple[List[UpdateOne], Dict[str, List[str]]]:
+    """
+    Upserts the full offer when its content hash differs from the stored one, and only
+    sets the volatile fields when it is unchanged.
+    existing_hashes has the stored contentHash and contentGroupHashes by id.
+    Returns the updates and the changed field groups by id of the changed offers.
+    All groups are changed for new offers.
+    """
+    updates = []
+    changes = {}
+    for offer in offers:
+        content_hash, group_hashes = get_offer_content_hashes(offer)
+        existing = existing_hashes.get(offer[id_field], {})
+        if existing.get("contentHash") == content_hash:
+            updates.append(
+                UpdateOne(
+                    {id_field: offer[id_field]},
+                    {
+                        "$set": dict(
+                            (key, offer[key])
+                            for key in VOLATILE_OFFER_FIELDS
+                            if key in offer
+                        )
+                    },
+                )
+            )
+        else:
+            existing_group_hashes = existing.get("contentGroupHashes") or {}
+            changes[offer[id_field]] = list(
+                group
+                for group, group_hash in group_hashes.items()
+                if existing_group_hashes.get(group) != group_hash
+            )
+            updates.append(
+                UpdateOne(
+                    {id_field: offer[id_field]},
+                    {
+                        "$set": {
+                            **offer,
+                            "contentHash": content_hash,
+                            "contentGroupHashes": group_hashes,
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+    return updates, changes
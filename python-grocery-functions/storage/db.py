@@ -10,6 +10,8 @@ from util.utils import log_traceback
 from pymongo.cursor import Cursor
 
 from config.mongo import get_collection
+from storage.bulk_writer import adaptive_bulk_write
+from storage.content_hash import get_changed_offer_updates
 from util.helpers import get_product_uri
 from util.enums import select_methods, provenances
 from util.errors import NoHandleConfigError
@@ -37,33 +39,66 @@ def get_update_one(offer, id_field: str = "uri"):
 def bulk_upsert(iterable: Iterable, collection_name: str, id_field: str = "uri"):
     print(f"Start saving to Mongo collection: {collection_name}")
     collection = get_collection(collection_name)
-    requests = list(map(get_update_one, iterable))
-    print("{} items to write".format(len(requests)))
-    result = collection.bulk_write(requests)
+    result = adaptive_bulk_write(
+        collection, (get_update_one(x, id_field) for x in iterable)
+    )
+    print(
+        "{} items written, {} failed".format(
+            result["nMatched"] + result["nUpserted"], result["nFailed"]
+        )
+    )
+    return result
+
+
+def upsert_changed_offers(
+    offers: List[dict], collection_name: str, id_field: str = "uri"
+):
+    """
+    Like bulk_upsert, but offers that are unchanged since the last write only get their
+    volatile fields like scrapeBatchId and validThrough updated.
+    The stored content hashes of the offers are fetched with one query.
+    The result has the changed field groups by id of the offers that were written.
+    """
+    collection = get_collection(collection_name)
+    existing_hashes = dict(
+        (x[id_field], x)
+        for x in collection.find(
+            {id_field: {"$in": list(x[id_field] for x in offers)}},
+            {id_field: 1, "contentHash": 1, "contentGroupHashes": 1, "_id": 0},
+        )
+    )
+    updates, changes = get_changed_offer_updates(offers, existing_hashes, id_field)
+    result = adaptive_bulk_write(collection, updates)
+    result["changes"] = changes
+    result["nSkipped"] = len(updates) - len(changes)
+    result["nWritten"] = len(changes)
+    print(
+        "{} offers written, {} unchanged, {} failed".format(
+            result["nWritten"], result["nSkipped"], result["nFailed"]
+        )
+    )
     return result
 
 
 def save_scraped_offers(offers: List[MpnOffer]):
     result = []
-    for chunk in chunked_iterable(offers, 1000):
-        try:
-            # Can get a write error here, probably due to high write load on Mongo
-            result.append(bulk_upsert(chunk, "mpnoffers"))
-        except Exception as e:
-            logging.error(e)
-            log_traceback(e)
+    try:
+        # Failed documents are reported in the result, and the rest are still written
+        result.append(upsert_changed_offers(offers, "mpnoffers"))
+    except Exception as e:
+        logging.error(e)
+        log_traceback(e)
     return result
 
 
+def get_handle_configs_filter(provenance: str):
+    return {"provenance": provenance, "status": {"$ne": "disabled"}}
+
+
 def get_handle_configs(provenance: str):
     print(f"Getting handle config for {provenance}")
     collection = get_collection("handleconfigs")
-    result = list(
-        x
-        for x in collection.find(
-            {"provenance": provenance, "status": {"$ne": "disabled"}}
-        )
-    )
+    result = list(x for x in collection.find(get_handle_configs_filter(provenance)))
     if len(result) > 0:
         return result
     else:
@@ -87,6 +122,18 @@ def get_single_handle_config(provenance: str):
         )
 
 
+def get_handle_config_versions(handle_config_filter: dict, limit: int = 0):
+    """
+    The ids and updatedAt of the handle configs of the filter, without fetching
+    the configs.
+    """
+    collection = get_collection("handleconfigs")
+    return list(
+        (str(x["_id"]), x.get("updatedAt"))
+        for x in collection.find(handle_config_filter, {"updatedAt": 1}, limit=limit)
+    )
+
+
 def store_handle_run(handle_run_config):
     logging.info("Storing handle run config")
     logging.info(handle_run_config)
@@ -95,7 +142,7 @@ def store_handle_run(handle_run_config):
 
 
 def save_book_offers(offers):
-    return bulk_upsert(offers, "bookoffers")
+    return [upsert_changed_offers(offers, "bookoffers")]
 
 
 def yield_rows(cursor: Cursor, chunk_size: int):
@@ -1,3 +1,24 @@
+# Fields of offers that are set by other handlers than the feed handler
+mpn_offer_derived_fields = [
+    # Price difference
+    "difference",
+    "differencePercentage",
+    "price7DaysMean",
+    "difference7DaysMean",
+    "difference7DaysMeanPercentage",
+    "price30DaysMean",
+    "difference30DaysMean",
+    "difference30DaysMeanPercentage",
+    "price90DaysMean",
+    "difference90DaysMean",
+    "difference90DaysMeanPercentage",
+    "price365DaysMean",
+    "difference365DaysMean",
+    "difference365DaysMeanPercentage",
+    # Other added
+    "pageviews",
+]
+
 mpn_offer_store_fields = [
     "title",
     "subtitle",
@@ -35,21 +56,5 @@ mpn_offer_store_fields = [
     "provenanceId",
     "sku",
     "scrapeBatchId",
-    # Price difference
-    "difference",
-    "differencePercentage",
-    "price7DaysMean",
-    "difference7DaysMean",
-    "difference7DaysMeanPercentage",
-    "price30DaysMean",
-    "difference30DaysMean",
-    "difference30DaysMeanPercentage",
-    "price90DaysMean",
-    "difference90DaysMean",
-    "difference90DaysMeanPercentage",
-    "price365DaysMean",
-    "difference365DaysMean",
-    "difference365DaysMeanPercentage",
-    # Other added
-    "pageviews",
+    *mpn_offer_derived_fields,
 ]
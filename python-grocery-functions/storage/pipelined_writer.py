@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class PipelinedWriter:
+    """
+    Saves batches in a background thread so that the caller can keep producing the
+    next batch while the previous one is written.
+    At most max_pending_batches batches wait in the queue. put blocks when the queue
+    is full, which keeps memory bounded when writing is slower than producing.
+    An exception from save_batch stops the writer and is raised from the next put
+    or from close.
+    """
+
+    def __init__(
+        self, save_batch: Callable[[List], object], max_pending_batches: int = 2
+    ):
+        self.save_batch = save_batch
+        self.queue = queue.Queue(maxsize=max_pending_batches)
+        self.error: Optional[BaseException] = None
+        self.n_batches = 0
+        self.n_items = 0
+        self.producer_idle_seconds = 0.0
+        self.writer_busy_seconds = 0.0
+        self.writer_idle_seconds = 0.0
+        self.start_time = time.perf_counter()
+        self.end_time: Optional[float] = None
+        self.thread = threading.Thread(
+            target=self._run, name="PipelinedWriter", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            wait_start = time.perf_counter()
+            batch = self.queue.get()
+            write_start = time.perf_counter()
+            self.writer_idle_seconds += write_start - wait_start
+            if batch is None:
+                return
+            if self.error is not None:
+                # Drain the queue so that a blocked put can return and raise.
+                continue
+            try:
+                self.save_batch(batch)
+                self.n_batches += 1
+                self.n_items += len(batch)
+            except BaseException as e:
+                logging.error(f"Writer failed to save batch: {e}")
+                self.error = e
+            self.writer_busy_seconds += time.perf_counter() - write_start
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def put(self, batch: List):
+        self._raise_error()
+        wait_start = time.perf_counter()
+        self.queue.put(batch)
+        self.producer_idle_seconds += time.perf_counter() - wait_start
+
+    def close(self):
+        """
+        Waits until all queued batches are written. Raises the first error from the writer.
+        """
+        if self.end_time is None:
+            wait_start = time.perf_counter()
+            self.queue.put(None)
+            self.thread.join()
+            self.end_time = time.perf_counter()
+            self.producer_idle_seconds += self.end_time - wait_start
+        self._raise_error()
+
+    def get_stage_times(self):
+        end_time = self.end_time or time.perf_counter()
+        elapsed = end_time - self.start_time
+        return {
+            "transform": {
+                "busySeconds": elapsed - self.producer_idle_seconds,
+                "idleSeconds": self.producer_idle_seconds,
+            },
+            "write": {
+                "busySeconds": self.writer_busy_seconds,
+                "idleSeconds": self.writer_idle_seconds,
+                "batches": self.n_batches,
+                "items": self.n_items,
+            },
+        }
@@ -11,6 +11,7 @@ from sqlalchemy import create_engine, select, update, case
 from sqlalchemy.engine import Result, RowMapping
 
 from amp_types.amp_product import HandleConfig, ProcessedMpnOffer
+from util.union_find import UnionFind
 from storage.postgres_tables import (
     brands_table,
     dealers_table,
@@ -139,27 +140,6 @@ def get_offer_price_object_from_processed_offer(
     }
 
 
-# Union-Find data structure for grouping GTINs
-class UnionFind:
-    def __init__(self) -> None:
-        self.parent: Dict[str, str] = {}
-
-    def find(self, x: str) -> str:
-        # Path compression
-        if x not in self.parent:
-            self.parent[x] = x
-        while x != self.parent[x]:
-            self.parent[x] = self.parent[self.parent[x]]
-            x = self.parent[x]
-        return x
-
-    def union(self, x: str, y: str) -> None:
-        xroot: str = self.find(x)
-        yroot: str = self.find(y)
-        if xroot != yroot:
-            self.parent[yroot] = xroot
-
-
 def handle_store_offer_batch(
     offers: Sequence[ProcessedMpnOffer], scrape_time: datetime
 ):
@@ -43,6 +43,20 @@ def get_s3_object_versions(bucket: str, key: str):
     return bucket_obj.object_versions.filter(Prefix=key)
 
 
+def list_s3_object_versions(bucket: str, key: str):
+    """
+    Lists the versions of an s3 object, oldest first, without fetching their content.
+    """
+    paginator = s3.get_paginator("list_object_versions")
+    versions = list(
+        x
+        for page in paginator.paginate(Bucket=bucket, Prefix=key)
+        for x in page.get("Versions", [])
+        if x["Key"] == key
+    )
+    return sorted(versions, key=lambda x: x["LastModified"])
+
+
 def save_to_s3(bucket: str, key: str, data):
     """
     Saves a json string as a file to S3.
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from transform.offer import get_field_from_scraper_offer
+from transform.offer import OfferView, get_field_from_scraper_offer
 
 
 class TestGetFieldFromOffer(TestCase):
@@ -17,3 +17,46 @@ class TestGetFieldFromOffer(TestCase):
     def test_get_field_from_offer_when_has_none(self):
         actual = get_field_from_scraper_offer({"dealer": "rusta"}, "price")
         self.assertEqual(actual, None)
+
+
+class TestOfferView(TestCase):
+    def test_get_field_from_additional_property(self):
+        offer = OfferView(
+            {
+                "title": "Melk",
+                "additionalProperties": [
+                    {"key": "UnitPrice", "value": "55"},
+                    {"name": "origin", "value": "Norge"},
+                    {"key": "unitprice", "value": "56"},
+                    {"key": "noValue"},
+                ],
+            }
+        )
+        self.assertEqual(get_field_from_scraper_offer(offer, "unitPrice"), "55")
+        self.assertEqual(get_field_from_scraper_offer(offer, "Origin"), "Norge")
+        self.assertEqual(get_field_from_scraper_offer(offer, "title"), "Melk")
+        self.assertEqual(get_field_from_scraper_offer(offer, "noValue", 1), None)
+        self.assertEqual(get_field_from_scraper_offer(offer, "price", 1), 1)
+
+    def test_get_field_with_path(self):
+        offer = OfferView({"pricing": {"price": 20}, "categories": ["Meieri"]})
+        self.assertEqual(get_field_from_scraper_offer(offer, "pricing.price"), 20)
+        self.assertEqual(get_field_from_scraper_offer(offer, "categories.0"), "Meieri")
+
+    def test_cache_is_cleared_when_changed(self):
+        offer = OfferView({"additionalProperties": [{"key": "brand", "value": "Tine"}]})
+        self.assertEqual(get_field_from_scraper_offer(offer, "brand"), "Tine")
+        offer["brand"] = "Q"
+        self.assertEqual(get_field_from_scraper_offer(offer, "brand"), "Q")
+        del offer["brand"]
+        self.assertEqual(get_field_from_scraper_offer(offer, "brand"), "Tine")
+        offer.setdefault("brand", "Q")
+        self.assertEqual(get_field_from_scraper_offer(offer, "brand"), "Q")
+        offer.pop("brand")
+        self.assertEqual(get_field_from_scraper_offer(offer, "brand"), "Tine")
+        offer |= {"brand": "Q"}
+        self.assertEqual(get_field_from_scraper_offer(offer, "brand"), "Q")
+        offer.popitem()
+        self.assertEqual(get_field_from_scraper_offer(offer, "brand"), "Tine")
+        offer.clear()
+        self.assertIsNone(get_field_from_scraper_offer(offer, "brand"))
@@ -0,0 +1,149 @@
+import glob
+import json
+import os
+from copy import deepcopy
+from unittest import TestCase
+
+from pydash import get
+
+from scraper_feed.scraper_configs import get_field_mapping
+from transform.offer import get_field_from_scraper_offer
+from transform.transform import transform_fields
+
+"""
+Compares transform_fields with applying the mapping rules one by one, which is how
+it was done before the field mapping was compiled to a plan.
+"""
+
+assets_path = os.path.join(os.path.dirname(__file__), "..", "..", "assets")
+
+field_mapping = get_field_mapping(
+    [
+        {"replace_type": "key", "source": "sku", "destination": "ean"},
+        {"replace_type": "key", "source": "Varenr", "destination": "sku"},
+        {"replace_type": "key", "source": "nobb", "destination": "nobb"},
+        {"replace_type": "key", "source": "Merke", "destination": "brand"},
+        {"replace_type": "key", "source": "merke", "destination": "vendor"},
+        {
+            "replace_type": "key",
+            "source": "energi_kcal",
+            "destination": "additionalProperties.kcal",
+            "text": "Energi",
+        },
+        {
+            "replace_type": "key",
+            "source": "salt",
+            "destination": "additionalProperties.salt",
+            "force_replace": True,
+        },
+        {
+            "replace_type": "key",
+            "source": "servingSize",
+            "destination": "quantityString",
+        },
+        {"replace_type": "key", "source": "pricing.price", "destination": "price"},
+        {"replace_type": "key", "source": "categories.0", "destination": "category"},
+        {"replace_type": "key", "source": "description", "destination": "subtitle"},
+        {"replace_type": "key", "source": "title", "destination": "title"},
+        {
+            "replace_type": "key",
+            "source": "brand",
+            "destination": "brand",
+            "force_replace": True,
+        },
+        {"replace_type": "fixed", "replace_value": "NOK", "destination": "currency"},
+        {
+            "replace_type": "fixed",
+            "replace_value": "Norway",
+            "destination": "additionalProperties.origin",
+        },
+        {
+            "replace_type": "fixed",
+            "replace_value": True,
+            "destination": "isPartner",
+            "force_replace": True,
+        },
+        {"replace_type": "ignore", "destination": "url"},
+        {"replace_type": "ignore", "destination": "unknown"},
+    ]
+)
+
+
+def add_to_destination(offer, value, field_config):
+    result = {**offer}
+    a, *b = field_config["destination"].split(".")
+    if a == "additionalProperties":
+        destination = b[0]
+        additional_property_item = {
+            "key": destination,
+            "value": value,
+            "text": field_config.get("text"),
+        }
+        if get(result, ["additionalPropertyDict", destination]):
+            if field_config.get("force_replace") is True:
+                result["additionalPropertyDict"][destination] = additional_property_item
+        else:
+            if result.get("additionalPropertyDict"):
+                result["additionalPropertyDict"][destination] = additional_property_item
+            else:
+                result["additionalPropertyDict"] = {
+                    destination: additional_property_item
+                }
+    else:
+        existing_value = offer.get(a)
+        if existing_value:
+            if field_config.get("force_replace") is True:
+                result[a] = value
+        else:
+            result[a] = value
+    return result
+
+
+def transform_fields_by_rule(offer, field_mapping):
+    result = {**offer}
+    for field_config in field_mapping:
+        if field_config["replace_type"] == "fixed":
+            result = add_to_destination(
+                result, field_config["replace_value"], field_config
+            )
+        elif field_config["replace_type"] == "key":
+            value = get_field_from_scraper_offer(offer, field_config["source"])
+            result = add_to_destination(result, value, field_config)
+        elif field_config["replace_type"] == "ignore":
+            try:
+                del result[field_config["destination"]]
+            except KeyError:
+                pass
+    return result
+
+
+def get_sample_offers():
+    result = []
+    for path in sorted(glob.glob(os.path.join(assets_path, "*-scraper-feed.json"))):
+        with open(path) as f:
+            result.extend(json.load(f))
+    return result
+
+
+class TestTransformFieldsPlan(TestCase):
+    def test_same_as_rule_by_rule(self):
+        for offer in get_sample_offers():
+            self.assertEqual(
+                transform_fields(deepcopy(offer), field_mapping),
+                transform_fields_by_rule(deepcopy(offer), field_mapping),
+            )
+
+    def test_mapping_changed_in_place(self):
+        mapping = get_field_mapping(
+            [{"replace_type": "key", "source": "title", "destination": "title"}]
+        )
+        offer = {"title": "Melk", "brand": "Tine"}
+        self.assertEqual(transform_fields(dict(offer), mapping)["title"], "Melk")
+        mapping.append(
+            {"replace_type": "fixed", "replace_value": "Q", "destination": "brand"}
+        )
+        mapping[0]["source"] = "brand"
+        self.assertEqual(
+            transform_fields(dict(offer), mapping),
+            transform_fields_by_rule(dict(offer), mapping),
+        )
@@ -1,10 +1,110 @@
 import logging
+from typing import Dict, Optional
 from pydash import find, get
 
 from amp_types.amp_product import ScraperOffer
 
+# Marks a field that is neither in the offer nor in its additional properties
+_NOT_FOUND = object()
+
+
+def get_additional_properties_index(offer: ScraperOffer) -> Dict[str, dict]:
+    """
+    The additional properties of the offer by lowercase key or name. The first property
+    is used when several have the same key, like get_field_from_scraper_offer does.
+    """
+    result = {}
+    for x in offer.get("additionalProperties") or []:
+        key = x.get("key", x.get("name", ""))
+        if isinstance(key, str):
+            result.setdefault(key.lower(), x)
+    return result
+
+
+def get_additional_property_value(additional_property: dict):
+    try:
+        return additional_property["value"]
+    except KeyError:
+        logging.warn("Additional property in scraper offer without value field.")
+        logging.warn(additional_property)
+
+
+class OfferView(dict):
+    """
+    A scraper offer that caches the lookups of get_field_from_scraper_offer.
+    The additional properties are indexed by lowercase key the first time a field is
+    not found in the offer, and every looked up key is cached until the offer is changed.
+    """
+
+    def __init__(self, offer: ScraperOffer):
+        super().__init__(offer)
+        self._additional_properties_index: Optional[Dict[str, dict]] = None
+        self._fields = {}
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._clear_cache()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._clear_cache()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._clear_cache()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._clear_cache()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._clear_cache()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._clear_cache()
+        return value
+
+    def clear(self):
+        super().clear()
+        self._clear_cache()
+
+    def _clear_cache(self):
+        self._additional_properties_index = None
+        self._fields = {}
+
+    def _find_field(self, key: str):
+        if any(x in key for x in ".[]\\"):
+            value = get(self, key)
+        else:
+            value = super().get(key)
+        if value is not None:
+            return value
+        if self._additional_properties_index is None:
+            self._additional_properties_index = get_additional_properties_index(self)
+        additional_property = self._additional_properties_index.get(key.lower())
+        if additional_property is None:
+            return _NOT_FOUND
+        return get_additional_property_value(additional_property)
+
+    def get_field(self, key: str, default=None):
+        try:
+            value = self._fields[key]
+        except KeyError:
+            value = self._fields[key] = self._find_field(key)
+        return default if value is _NOT_FOUND else value
+
 
 def get_field_from_scraper_offer(offer: ScraperOffer, key: str, default=None):
+    if isinstance(offer, OfferView) and isinstance(key, str) and key:
+        return offer.get_field(key, default)
     if get(offer, key) is not None:
         return get(offer, key, default)
     else:
@@ -14,8 +114,4 @@ def get_field_from_scraper_offer(offer: ScraperOffer, key: str, default=None):
         )
         if additional_property is None:
             return default
-        try:
-            return additional_property["value"]
-        except KeyError:
-            logging.warn("Additional property in scraper offer without value field.")
-            logging.warn(additional_property)
+        return get_additional_property_value(additional_property)
@@ -1,5 +1,6 @@
 import logging
-from typing import List
+from copy import deepcopy
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 from pydash import get
 
@@ -7,48 +8,137 @@ from amp_types.amp_product import (
     MappingConfigField,
     ScraperOffer,
 )
-from transform.offer import get_field_from_scraper_offer
+from transform.offer import get_additional_properties_index
 
+# Number of compiled field mappings that are kept. There is usually one per handle config.
+FIELD_MAPPING_PLAN_CACHE_SIZE = 16
 
-def add_to_destination(
-    offer: ScraperOffer, value, field_config: MappingConfigField
+
+class FieldMappingStep(NamedTuple):
+    replace_type: str
+    # Top level key, or the key in additionalPropertyDict for additionalProperties.x
+    destination: str
+    is_additional_property: bool
+    force_replace: bool
+    text: Optional[str]
+    replace_value: Any
+    source: Optional[str]
+    # Sources without a path can be read with dict.get instead of pydash.get
+    is_simple_source: bool
+    source_lower: Optional[str]
+
+
+FieldMappingPlan = Tuple[FieldMappingStep, ...]
+
+# Compiled plans by id of the field mapping list. The list and a copy of its contents are
+# kept in the cache, so a plan is not reused for another list with the same id, or after
+# the list was changed in place.
+field_mapping_plans: Dict[
+    int, Tuple[List[MappingConfigField], List[MappingConfigField], FieldMappingPlan]
+] = {}
+
+
+def compile_field_mapping(field_mapping: List[MappingConfigField]) -> FieldMappingPlan:
+    result = []
+    for field_config in field_mapping:
+        replace_type = field_config["replace_type"]
+        if replace_type not in ("fixed", "key", "ignore"):
+            continue
+        source = field_config.get("source") if replace_type == "key" else None
+        if replace_type == "ignore":
+            destination = field_config["destination"]
+            is_additional_property = False
+        else:
+            a, *b = field_config["destination"].split(".")
+            is_additional_property = a == "additionalProperties"
+            destination = b[0] if is_additional_property else a
+        result.append(
+            FieldMappingStep(
+                replace_type=replace_type,
+                destination=destination,
+                is_additional_property=is_additional_property,
+                force_replace=field_config.get("force_replace") is True,
+                text=field_config.get("text"),
+                replace_value=field_config.get("replace_value"),
+                source=source,
+                is_simple_source=isinstance(source, str)
+                and not any(x in source for x in ".[]\\"),
+                source_lower=source.lower() if isinstance(source, str) else None,
+            )
+        )
+    return tuple(result)
+
+
+def get_field_mapping_plan(field_mapping: List[MappingConfigField]) -> FieldMappingPlan:
+    cached = field_mapping_plans.get(id(field_mapping))
+    if cached and cached[0] is field_mapping and cached[1] == field_mapping:
+        return cached[2]
+    plan = compile_field_mapping(field_mapping)
+    field_mapping_plans.pop(id(field_mapping), None)
+    if len(field_mapping_plans) >= FIELD_MAPPING_PLAN_CACHE_SIZE:
+        del field_mapping_plans[next(iter(field_mapping_plans))]
+    field_mapping_plans[id(field_mapping)] = (
+        field_mapping,
+        deepcopy(field_mapping),
+        plan,
+    )
+    return plan
+
+
+def apply_field_mapping_plan(
+    offer: ScraperOffer, plan: FieldMappingPlan
 ) -> ScraperOffer:
+    """
+    Same as applying the mapping rules one by one, but in one pass over a single copy
+    of the offer. Values are read from the original offer.
+    """
     result = {**offer}
-    a, *b = field_config["destination"].split(".")
-    if a == "additionalProperties":
-        destination = b[0]
-        additional_property_item = {
-            "key": destination,
-            "value": value,
-            "text": field_config.get("text"),
-        }
-        if get(result, ["additionalPropertyDict", destination]):
-            if field_config.get("force_replace") is True:
-                # logging.debug(f"Replacing {field_config['destination']}.")
-                result["additionalPropertyDict"][destination] = additional_property_item
-            else:
-                pass
-                # logging.debug(f"Avoid replacing {field_config['destination']}")
+    additional_properties_index = None
+    for step in plan:
+        if step.replace_type == "ignore":
+            result.pop(step.destination, None)
+            continue
+
+        if step.replace_type == "fixed":
+            value = step.replace_value
         else:
-            logging.debug(f"Creating new field {field_config['destination']}.")
-            if result.get("additionalPropertyDict"):
-                result["additionalPropertyDict"][destination] = additional_property_item
+            value = (
+                offer.get(step.source)
+                if step.is_simple_source
+                else get(offer, step.source)
+            )
+            if value is None and step.source_lower:
+                if additional_properties_index is None:
+                    additional_properties_index = get_additional_properties_index(offer)
+                additional_property = additional_properties_index.get(step.source_lower)
+                if additional_property is not None:
+                    value = additional_property.get("value")
+                    if "value" not in additional_property:
+                        logging.warn(
+                            "Additional property in scraper offer without value field."
+                        )
+                        logging.warn(additional_property)
+
+        if step.is_additional_property:
+            additional_property_item = {
+                "key": step.destination,
+                "value": value,
+                "text": step.text,
+            }
+            additional_property_dict = result.get("additionalPropertyDict")
+            if get(additional_property_dict, [step.destination]):
+                if step.force_replace:
+                    additional_property_dict[step.destination] = (
+                        additional_property_item
+                    )
+            elif additional_property_dict:
+                additional_property_dict[step.destination] = additional_property_item
             else:
                 result["additionalPropertyDict"] = {
-                    destination: additional_property_item
+                    step.destination: additional_property_item
                 }
-    else:
-        existing_value = offer.get(a)
-        if existing_value:
-            if field_config.get("force_replace") is True:
-                # logging.debug(f"Replacing {a}.")
-                result[a] = value
-            else:
-                pass
-                # logging.debug(f"Avoid replacing {a}")
-        else:
-            # logging.debug(f"Creating new field {a}.")
-            result[a] = value
+        elif not result.get(step.destination) or step.force_replace:
+            result[step.destination] = value
     return result
 
 
@@ -56,20 +146,6 @@ def transform_fields(
     offer: ScraperOffer, field_mapping: List[MappingConfigField]
 ) -> ScraperOffer:
     """
-    Rename , add and remove fields according to config."""
-    result = {**offer}
-    for field_config in field_mapping:
-        if field_config["replace_type"] == "fixed":
-            result = add_to_destination(
-                result, field_config["replace_value"], field_config
-            )
-        elif field_config["replace_type"] == "key":
-            value = get_field_from_scraper_offer(offer, field_config["source"])
-            result = add_to_destination(result, value, field_config)
-        elif field_config["replace_type"] == "ignore":
-            try:
-                del result[field_config["destination"]]
-            except KeyError:
-                pass
-
-    return result
+    Rename , add and remove fields according to config.
+    The field mapping is compiled to a plan the first time it is used."""
+    return apply_field_mapping_plan(offer, get_field_mapping_plan(field_mapping))
@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+from util.cache import LruCache
+
+
+class TestLruCache(TestCase):
+    def test_get_and_put(self):
+        cache = LruCache(2)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertDictEqual(
+            cache.stats(), {"hits": 1, "misses": 1, "size": 1, "maxSize": 2}
+        )
+
+    def test_evicts_least_recently_used(self):
+        cache = LruCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_resize(self):
+        cache = LruCache(3)
+        for key in ("a", "b", "c"):
+            cache.put(key, key)
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("c"), "c")
+
+    def test_zero_size_stores_nothing(self):
+        cache = LruCache(0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
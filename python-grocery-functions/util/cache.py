@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LruCache:
+    """
+    Bounded least recently used cache with hit and miss counters.
+    Values are returned as stored, so callers that mutate results must copy them.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None) -> Any:
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def resize(self, max_size: int):
+        self.max_size = max_size
+        while len(self._items) > max(max_size, 0):
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._items),
+            "maxSize": self.max_size,
+        }
+
+    def __len__(self):
+        return len(self._items)